@@ -0,0 +1,153 @@
+################################################################################
+#   Title: Alignment.py
+#   Author: Zac Lynn
+#
+#   Description: This code corrects the clock drift between sensors before a
+#           recording is saved. Every device counts its samples with a 16-bit
+#           relative time counter and samples on its own crystal, so two
+#           devices set to the same frequency slowly move apart in time.
+#
+#           1. The relative time counter is unwrapped into a sample index
+#              (SequenceTracker has already put the samples in this order).
+#           2. The time every packet was received is saved as an anchor. The
+#              earliest arrivals sit on a straight line of receive time
+#              against sample index (network delay only makes packets late),
+#              the slope of that line is the real sample rate of the device.
+#           3. Every sensor is interpolated onto the same timebase at the
+#              configured sample frequency.
+#
+#   Notes: Data
+################################################################################
+import threading                                                                                # Anchors are added by the decoder thread
+import numpy as np
+
+import SampleStore                                                                              # Aligned samples are saved in a new store
+
+COUNTER_SIZE = 65536                                                                            # Relative time is a uint16 on the devices
+MIN_ANCHORS = 8                                                                                 # Fewer packets than this can't give a useful rate
+MAX_RATE_ERROR = 0.01                                                                           # Rates more than 1% from the configured one are not trusted
+
+
+def unwrap(counter):
+    # Returns (index, valid) for a relative time counter. index counts up
+    # without wrapping at 65536. valid is False for samples that went
+    # backwards or repeated (late or duplicated packets), they are skipped.
+    counter = np.asarray(counter, dtype=np.int64)
+    if (len(counter) == 0):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+
+    step = np.diff(counter) % COUNTER_SIZE
+    valid = np.concatenate(([True], (step > 0) & (step < COUNTER_SIZE // 2)))
+    step = np.where(valid[1:], step, 0)                                                         # Skipped samples don't move the index
+
+    return counter[0] + np.concatenate(([0], np.cumsum(step))), valid
+
+
+def lowerEnvelopeFit(index, rxTime):
+    # Straight line rxTime = offset + index * period that every packet is on
+    # or above, and that is as close to all of them as possible. That line is
+    # the edge of the lower convex hull of the points that spans the average
+    # index. Returns (period, offset).
+    hull = []
+    for point in zip(index.tolist(), rxTime.tolist()):                                          # Monotone chain, index is already increasing
+        while (len(hull) >= 2 and
+               (hull[-1][0] - hull[-2][0]) * (point[1] - hull[-2][1]) -
+               (hull[-1][1] - hull[-2][1]) * (point[0] - hull[-2][0]) <= 0):
+            hull.pop()
+        hull.append(point)
+
+    if (len(hull) < 2):
+        return 0.0, 0.0
+
+    middle = np.mean(index)
+    for (x0, y0), (x1, y1) in zip(hull[:-1], hull[1:]):
+        if (x1 >= middle):
+            break
+
+    period = (y1 - y0) / (x1 - x0)
+    return period, y0 - x0 * period
+
+
+class Aligner:
+
+    def __init__(self, fs):
+        self.fs = fs                                                                            # Configured sample frequency
+        self.anchors = {}                                                                       # Sensor name -> ([last counter of each packet], [receive time])
+        self.lock = threading.Lock()
+        self.report = {}                                                                        # Sensor name -> dict of what align() found
+
+
+    def addPacket(self, sensor, counter, rxTime):                                               # Save the receive time of a packet's last sample
+        if (len(counter) == 0):
+            return
+
+        with self.lock:
+            counters, times = self.anchors.setdefault(sensor, ([], []))
+            counters.append(int(counter[-1]))
+            times.append(rxTime)
+
+
+    def rate(self, sensor):                                                                     # Measured sample frequency of a sensor, or the configured one
+        with self.lock:
+            counters, times = self.anchors.get(sensor, ([], []))
+            counters, times = np.array(counters), np.array(times, dtype=np.float64)
+
+        if (len(counters) < MIN_ANCHORS):
+            return float(self.fs)
+
+        index, valid = unwrap(counters)
+        period, offset = lowerEnvelopeFit(index[valid], times[valid])
+        rate = 1.0 / period if period > 0 else 0.0
+
+        if (abs(rate - self.fs) > MAX_RATE_ERROR * self.fs):                                    # Bad fit, e.g. the broker held back packets
+            return float(self.fs)
+
+        return rate
+
+
+    def align(self, store):
+        # Returns a new SampleStore with every sensor interpolated onto the
+        # same timebase at the configured sample frequency. The relative time
+        # column of the new store counts the aligned samples. Rows of the
+        # store are already in sample order (see SequenceTracker), samples
+        # that were never received stay MISSING instead of being interpolated.
+        aligned = SampleStore.SampleStore(store.trialTime, store.fs, store.inputChannels)
+        tracks = {}
+
+        for sensor in store.sensors():
+            rate = self.rate(sensor)
+            values = store.view(sensor)[:, 1:]
+            received = values[:, 0] != SampleStore.MISSING
+
+            tracks[sensor] = (np.arange(len(values)) / rate, values, received)                  # Time of every sample on its own clock
+            self.report[sensor] = {"rate": rate, "lost": int(np.count_nonzero(~received))}
+
+        duration = min([times[-1] if len(times) > 0 else -1.0 for times, values, received in tracks.values()])
+        count = min(int(np.floor(duration * store.fs)) + 1, aligned.capacity) if duration >= 0 else 0
+        timebase = np.arange(count) / store.fs
+
+        for sensor, (times, values, received) in tracks.items():
+            block = np.empty((count, store.columns), dtype=np.uint16)
+            block[:, 0] = np.arange(count) % COUNTER_SIZE
+
+            if (count > 0 and np.any(received)):
+                missing = np.interp(timebase, times, received.astype(np.float64)) < 1.0         # Between a lost sample and its neighbours
+                for ch in range(store.inputChannels):
+                    block[:, ch+1] = np.rint(np.interp(timebase, times[received], values[received, ch]))
+                block[missing, 1:] = SampleStore.MISSING
+            else:
+                block[:, 1:] = SampleStore.MISSING
+
+            aligned.addSensor(sensor)
+            aligned.append(sensor, block)
+
+        return aligned
+
+
+    def summary(self):                                                                          # One line per sensor for the serial output
+        lines = []
+        for sensor, report in self.report.items():
+            lines.append(sensor + ": %.3f Hz (%+.0f ppm), %d samples lost" %
+                         (report["rate"], (report["rate"] / self.fs - 1) * 1e6, report["lost"]))
+
+        return lines
@@ -0,0 +1,128 @@
+################################################################################
+#   Title: AnalysisPool.py
+#   Author: Zac Lynn
+#
+#   Description: This code implements a small pool of long running processes
+#           that run the custom analysis functions. The workers import NumPy
+#           and matplotlib once when the core application starts, then wait
+#           for jobs. Only a descriptor of the shared memory holding the plot
+#           data is sent through the pipe, so clicking a toolbar button no
+#           longer pays for starting Python, importing the libraries, or
+#           copying the data.
+#
+#   Notes: Used by Plugins.py for plugins with MODE = "process", see that file
+#           for the functions a plugin defines
+################################################################################
+import importlib.util                                                                           # Used to load the custom functions by file name
+import multiprocessing                                                                          # Worker processes and the pipes used to talk to them
+import os
+import traceback
+
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "customFunctions")
+EVENT_INTERVAL = 0.05                                                                           # Seconds between checks for new jobs while analysis windows are open
+
+
+def loadFunction(functions, script):                                                            # Import a custom function file once and keep the module
+    if (script not in functions):
+        path = os.path.join(FUNCTIONS_DIR, script)
+        spec = importlib.util.spec_from_file_location(os.path.splitext(script)[0], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        functions[script] = module
+
+    return functions[script]
+
+
+def workerMain(conn):                                                                           # Runs in each worker process
+    import sys
+    sys.path.insert(0, FUNCTIONS_DIR)                                                           # Custom functions can import helpers that live next to them
+
+    import numpy as np                                                                          # Imported here so the cost is paid once when the worker starts
+    import matplotlib.pyplot as plt
+    import inputData                                                                            # Attaches to the shared memory sent by the core application
+
+    functions = {}                                                                              # Script name -> loaded module
+    attached = []                                                                               # (shared memory, figure numbers) of jobs whose windows are open
+
+    while (True):
+        if (len(plt.get_fignums()) > 0):                                                        # Keep the analysis windows responsive while waiting for a job
+            plt.gcf().canvas.start_event_loop(EVENT_INTERVAL)
+            attached = detachClosed(attached, plt.get_fignums(), inputData)
+            if (not conn.poll()):
+                continue
+        elif (not conn.poll(None)):                                                             # No windows open, block until a job arrives
+            continue
+
+        try:
+            job = conn.recv()
+            if ("name" in job):                                                                 # Data is in shared memory, map it without copying
+                shm, data = inputData.attach(job, untrack=False)
+            else:
+                shm, data = None, np.frombuffer(conn.recv_bytes(), dtype=np.float64)            # Data was sent as raw bytes
+        except EOFError:                                                                        # Core application closed the pipe
+            return
+        except Exception:
+            traceback.print_exc()
+            continue
+
+        try:
+            figures = set(plt.get_fignums())
+            module = loadFunction(functions, job["script"])
+            result = module.compute(data, job["fs"], job["meta"])
+
+            if (hasattr(module, "render")):
+                module.render(result, plt.figure(), job["meta"])
+                plt.show(block=False)                                                           # Show the new figures without blocking the worker
+            else:
+                print(job["meta"]["title"], result)
+        except Exception:
+            traceback.print_exc()                                                               # A broken custom function should not stop the worker
+
+        if (shm is not None):
+            data = None
+            attached.append((shm, set(plt.get_fignums()) - figures))                            # Keep the block open while the job's windows may still use the data
+            attached = detachClosed(attached, plt.get_fignums(), inputData)
+
+
+def detachClosed(attached, openFigures, inputData):                                             # Close the shared memory of jobs whose windows were all closed
+    remaining = []
+    for shm, figures in attached:
+        if (figures & set(openFigures) or not inputData.detach(shm)):
+            remaining.append((shm, figures))
+
+    return remaining
+
+
+class AnalysisPool:
+
+    def __init__(self, workers=2):
+        self.workers = []                                                                       # (process, pipe) pairs
+        self.next = 0                                                                           # Worker that gets the next job
+
+        for i in range(workers):
+            parentConn, childConn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=workerMain, args=(childConn,), daemon=True)
+            process.start()
+            childConn.close()                                                                   # Only the worker uses this end
+            self.workers.append((process, parentConn))
+
+
+    def submit(self, script, buffer, fs, meta):                                                 # Send a job for a PlotBuffer to the next worker
+        process, conn = self.workers[self.next]
+        self.next = (self.next + 1) % len(self.workers)
+
+        descriptor = buffer.describe(fs, meta["title"])
+        if (descriptor is not None):                                                            # Shared buffer, only the descriptor is sent
+            descriptor.update({"script": script, "meta": meta})
+            conn.send(descriptor)
+        else:
+            conn.send({"script": script, "fs": fs, "meta": meta})
+            conn.send_bytes(buffer.y())                                                         # Buffer protocol, no text conversion
+
+
+    def close(self):
+        for process, conn in self.workers:
+            conn.close()                                                                        # Workers exit when their pipe is closed
+        for process, conn in self.workers:
+            process.join(timeout=1)
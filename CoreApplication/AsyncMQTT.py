@@ -0,0 +1,251 @@
+################################################################################
+#   Title: AsyncMQTT.py
+#   Author: Zac Lynn
+#
+#   Description: asyncio version of the MQTT class. paho is driven by an
+#           asyncio event loop through its socket callbacks (loop_read() when
+#           the socket can be read, loop_write() when paho has data to send,
+#           loop_misc() every second for the keep alive) instead of
+#           loop_start() and a decoder thread. Every sensor gets its own
+#           queue and consumer task, so a sensor that sends a lot of data
+#           can't hold back the control messages of the others. When a queue
+#           gets too long the socket is not read until it drains, which holds
+#           the messages back in the broker and the network instead of in
+#           memory. Rows of the output file are written on a separate thread
+#           so the event loop never waits on the disk.
+#
+#   Notes: Communication and data. Same methods as the MQTT class, create it
+#           in place of MQTT.MQTT and call start() once the GUI is set up.
+################################################################################
+import asyncio
+import concurrent.futures                                                                       # Single thread that writes the output file
+import threading
+import time
+
+from paho.mqtt import client as mqtt_client
+
+import DecoderPool                                                                              # POLL_SECONDS while the last packets are decoded
+import MQTT
+
+
+class AsyncMQTT(MQTT.MQTT):
+    QUEUE_HIGH = 256                                                                            # Stop reading the socket when a sensor has this many messages queued,
+    QUEUE_LOW = 64                                                                              # and read again once every queue is down to this many
+    MISC_INTERVAL = 1.0                                                                         # Seconds between loop_misc() calls (keep alive and reconnect)
+
+    def __init__(self, clientID, brokerIP=0, port=1883, top=None):
+        self.loop = asyncio.new_event_loop()                                                    # Created before connect_mqtt() so the socket callbacks can use it
+        self.queues = {}                                                                        # SensorState (None for unrouted messages) -> asyncio.Queue
+        self.full = set()                                                                       # Keys of the queues that stopped the socket from being read
+        self.sock = None                                                                        # Socket of the broker connection, None while disconnected
+        self.reading = False                                                                    # True while the event loop reads the socket
+        self.fileWriter = concurrent.futures.ThreadPoolExecutor(max_workers = 1)                # Output file writes, in the order they were queued
+        self.writePending = False                                                               # Only one update of the output file is queued at a time
+        self.ending = None                                                                      # endCapture() of an "END" message, awaited by consume()
+        self.loopThread = None
+
+        super().__init__(clientID, brokerIP, port, top)
+        self.metrics.addGauge("queue", self.queued)                                             # Messages waiting in every sensor queue
+
+
+    def connect_mqtt(self):
+        client = mqtt_client.Client(self.clientID)
+
+        client.on_connect = self.on_connect                                                     # Set the callback for connection attempt
+        client.on_socket_open = self.on_socket_open                                             # Socket callbacks hand the socket to the event loop
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        try:
+            client.connect(self.broker, self.port)
+        except Exception as err:
+            print("INITIALIZATION ERROR:\t" + str(err))
+
+        return client
+
+
+    # paho calls the socket callbacks from any thread (e.g. publish() from the
+    # GUI), so the event loop is only changed through callSoon(). On the event
+    # loop thread the call can't wait, paho closes the socket right after
+    # on_socket_close()
+    def callSoon(self, function, *args):
+        if (threading.current_thread() is self.loopThread):
+            function(*args)
+        elif (not self.loop.is_closed()):                                                       # paho closes its socket again when it is deleted
+            self.loop.call_soon_threadsafe(function, *args)
+
+
+    def on_socket_open(self, client, userData, sock):
+        self.callSoon(self.openSocket, client, sock)
+
+
+    def on_socket_close(self, client, userData, sock):
+        self.callSoon(self.closeSocket, sock)
+
+
+    def on_socket_register_write(self, client, userData, sock):                                 # paho has packets to send
+        self.callSoon(self.loop.add_writer, sock, client.loop_write)
+
+
+    def on_socket_unregister_write(self, client, userData, sock):
+        self.callSoon(self.loop.remove_writer, sock)
+
+
+    def openSocket(self, client, sock):
+        self.sock = sock
+        self.reading = False
+        if (len(self.full) == 0):
+            self.resumeReading()
+
+
+    def closeSocket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if (self.sock is sock):
+            self.sock = None
+            self.reading = False
+
+
+    def pauseReading(self):                                                                     # Backpressure, messages wait in the broker until the queues drain
+        if (self.reading):
+            self.loop.remove_reader(self.sock)
+            self.reading = False
+
+
+    def resumeReading(self):
+        if (not self.reading and self.sock is not None):
+            self.loop.add_reader(self.sock, self.client.loop_read)
+            self.reading = True
+
+
+    def start(self):                                                                            # Run the event loop on its own thread
+        self.loopThread = threading.Thread(target=self.runLoop, daemon=True)
+        self.loopThread.start()
+
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+        self.loopThread.join()
+        self.fileWriter.shutdown()
+        self.closeDecoders()
+
+
+    def runLoop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self.misc())
+        self.loop.run_forever()
+
+        tasks = asyncio.all_tasks(self.loop)                                                    # Consumers and misc(), stopped by shutdown()
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions = True))
+        self.loop.close()
+
+
+    async def shutdown(self):                                                                   # Send DISCONNECT before the event loop stops
+        self.client.disconnect()
+        end = time.time() + 1.0
+        while (self.sock is not None and time.time() < end):                                    # paho closes the socket once DISCONNECT was written
+            await asyncio.sleep(0.01)
+
+        self.loop.stop()
+
+
+    async def misc(self):                                                                       # Keep alive pings, reconnect if the broker went away
+        while (True):
+            if (self.client.loop_misc() == mqtt_client.MQTT_ERR_NO_CONN):
+                try:
+                    self.client.reconnect()                                                     # Opens a new socket, see on_socket_open()
+                except OSError:
+                    pass
+
+            self.reportMetrics()                                                                # Stats pane keeps updating while nothing is received
+            await asyncio.sleep(self.MISC_INTERVAL)
+
+
+    def queueMessage(self, state, message):                                                     # Runs on the event loop, called by paho from loop_read()
+        messages = self.queues.get(state)
+        if (messages is None):                                                                  # First message of this sensor, start its consumer
+            messages = self.queues[state] = asyncio.Queue()
+            self.loop.create_task(self.consume(state, messages))
+
+        messages.put_nowait((state, message.topic, message.payload, time.time()))
+        self.metrics.count("messages")
+        self.metrics.count("bytes", len(message.payload))
+
+        if (messages.qsize() >= self.QUEUE_HIGH):
+            self.full.add(state)
+            self.pauseReading()
+
+
+    async def consume(self, key, messages):
+        # Handles the messages of one sensor in order. Yields after every
+        # message so the other sensors and the socket get their turn
+        while (True):
+            state, topic, payload, rxTime = await messages.get()
+            self.handleQueued(state, topic, payload, rxTime)
+
+            if (self.ending is not None):                                                       # "END" was handled, finish the capture before the next message
+                ending, self.ending = self.ending, None
+                try:
+                    await ending
+                except Exception as err:
+                    print("DECODER ERROR:\t" + str(err))
+
+            if (key in self.full and messages.qsize() <= self.QUEUE_LOW):
+                self.full.discard(key)
+                if (len(self.full) == 0):
+                    self.resumeReading()
+
+            await asyncio.sleep(0)
+
+
+    def queued(self):                                                                           # Messages waiting in every queue, the "queue" gauge
+        return sum(messages.qsize() for messages in list(self.queues.values()))
+
+
+    def updateRecorder(self, recorder):
+        # Queue the rows every sensor has sent on the file writer thread. An
+        # update that is already queued writes the new rows as well
+        if (self.writePending):
+            return
+
+        self.writePending = True
+        self.fileWriter.submit(self.writeRows, recorder)
+
+
+    def writeRows(self, recorder):                                                              # Runs on the file writer thread
+        self.writePending = False
+        start = time.perf_counter()
+        recorder.update()
+        self.metrics.since("recorder", start)
+
+
+    def writeToFile(self):
+        # Finish the output file on the file writer thread after the rows that
+        # are still queued, and wait for it so the file is complete on return.
+        # Not for the event loop, endCapture() awaits the file instead
+        if (self.recorder is None):
+            return
+
+        self.fileWriter.submit(super().writeToFile).result()
+
+
+    def handleEnd(self, state):
+        # Called by dispatch() on the event loop. Waiting for the decoder
+        # processes and saving the file can take seconds, so this only
+        # creates endCapture() for the consumer of the sensor to await
+        self.ending = self.endCapture(state)
+
+
+    async def endCapture(self, state):
+        end = time.time() + self.DRAIN_TIMEOUT                                                  # The last packets of the sensor may still be decoding
+        while (self.decoderPool is not None and self.decoderPool.pending() > 0 and time.time() < end):
+            await asyncio.sleep(DecoderPool.POLL_SECONDS)
+
+        if (not state.configWasSet or not self.endSensor(state)):                               # Not in a data capture, or other sensors are still sending
+            return
+
+        if (self.recorder is not None):                                                         # Saved after the rows that are still queued
+            await self.loop.run_in_executor(self.fileWriter, super().writeToFile)
+        self.captureEnded()
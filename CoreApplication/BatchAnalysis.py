@@ -0,0 +1,182 @@
+################################################################################
+#   Title: BatchAnalysis.py
+#   Author: Zac Lynn
+#
+#   Description: Runs the custom analysis functions over many recordings
+#           without the GUI. Every (file, sensor, channel, function) job is
+#           run on a process pool. The result of compute() is saved as a .npz
+#           file and the figure drawn by render() as a .png file in the output
+#           folder.
+#
+#   Notes: Run from the CoreApplication folder, for example:
+#           python BatchAnalysis.py "study/*" --functions fft env --output results
+################################################################################
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import glob
+import os
+import time
+import traceback
+import numpy as np
+
+from matplotlib.figure import Figure                                                            # Figure() without pyplot uses the Agg canvas, no display needed
+
+import AnalysisPool                                                                             # Loads the custom functions by file name
+import DataLoader
+import WDAFile
+import Plugins                                                                                  # Finds the custom functions in customFunctions/
+
+DEFAULT_FUNCTIONS = ["fft", "env"]
+EXTENSIONS = (".csv", ".wda")                                                                   # Recording files, the .wda file is used if both were saved
+
+recording = (None, None)                                                                        # ((filename, sensors, channels), data) of the last recording loaded by this worker
+functions = {}                                                                                  # Script name -> module, per worker
+
+
+def sampleFrequency(filename, data):                                                            # Sample frequency of a loaded recording
+    if (filename.endswith(".wda")):
+        return WDAFile.readHeader(filename)[0]["fs"]
+
+    t = next(iter(data.values()))["Time"]
+    return round(1.0 / (t[1] - t[0]))
+
+
+def loadCached(filename, sensors=None, channels=None):
+    # Jobs are submitted in file order, so a worker usually runs several jobs
+    # on the same file in a row. Keep the last file so it is only read once.
+    # Only the sensors and channels of the jobs are loaded, None loads all.
+    global recording
+    key = (filename, sensors, channels)
+    if (recording[0] != key):
+        recording = (key, DataLoader.loadRecording(filename, sensors=sensors, channels=channels))
+
+    return recording[1]
+
+
+def saveResult(path, result, meta):                                                             # Save whatever compute() returned in a .npz file
+    if (isinstance(result, dict)):
+        arrays = dict(result)
+    elif (isinstance(result, (tuple, list))):
+        arrays = {"result" + str(num): value for num, value in enumerate(result)}
+    else:
+        arrays = {"result": result}
+
+    arrays.update({"fs": meta["fs"], "sensor": meta["sensor"], "channel": meta["channel"],
+                   "source": meta["source"]})
+    np.savez(path, **arrays)
+
+
+def runJob(filename, sensor, ch, script, output, plot, sensors=None, channels=None):            # Runs in a worker process, returns the names of the files saved
+    data = loadCached(filename, sensors, channels)
+    fs = sampleFrequency(filename, data)
+    module = AnalysisPool.loadFunction(functions, script)
+
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    name = os.path.join(output, "_".join([stem, sensor, "CH" + str(ch), os.path.splitext(script)[0]]))
+    meta = {"title": stem + " " + sensor + " CH " + str(ch), "sensor": sensor, "channel": ch,
+            "fs": fs, "source": os.path.abspath(filename)}
+
+    signal = data[sensor]["CH" + str(ch)]
+    signal.flags.writeable = False
+    result = module.compute(signal, fs, meta)
+
+    saveResult(name + ".npz", result, meta)
+    saved = [name + ".npz"]
+
+    if (plot and hasattr(module, "render")):
+        fig = Figure(figsize = (6, 4), tight_layout = True)
+        module.render(result, fig, meta)
+        fig.savefig(name + ".png")
+        saved.append(name + ".png")
+
+    return saved
+
+
+def selectRecordings(filenames):
+    # Keep the recordings in filenames, one file per trial. The Recorder
+    # saves recN.csv and recN.wda with the same samples, so only the .wda
+    # file is used when both are given. Other files (e.g. _metrics.jsonl)
+    # are skipped.
+    trials = {}                                                                                 # Path without extension -> file name
+    for filename in filenames:
+        root, ext = os.path.splitext(filename)
+        if (ext not in EXTENSIONS):
+            continue
+
+        if (root not in trials or ext == ".wda"):
+            trials[root] = filename
+
+    return list(trials.values())
+
+
+def makeJobs(filenames, plugins, sensors, channels, output, plot):                              # runJob() arguments for every job, in file order
+    jobs = []
+    for filename in filenames:
+        allSensors, inputChannels = DataLoader.readHeader(filename)
+        fileSensors = None if sensors is None else tuple(sensor for sensor in sensors if sensor in allSensors)
+        fileChannels = None if channels is None else tuple(ch for ch in channels if 1 <= ch <= inputChannels)
+
+        for sensor in (allSensors if fileSensors is None else fileSensors):
+            for ch in (range(1, inputChannels + 1) if fileChannels is None else fileChannels):
+                for plugin in plugins:
+                    jobs.append((filename, sensor, ch, plugin.script, output, plot, fileSensors, fileChannels))
+
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run custom analysis functions over recordings.")
+    parser.add_argument("recordings", nargs = "+", help = "recording files or glob patterns (.csv or .wda)")
+    parser.add_argument("--functions", nargs = "+", default = DEFAULT_FUNCTIONS,
+                        help = "names of the custom functions to run (default: fft env)")
+    parser.add_argument("--output", default = "results", help = "folder the results are saved in")
+    parser.add_argument("--sensors", nargs = "+", help = "only analyse these sensors")
+    parser.add_argument("--channels", nargs = "+", type = int, help = "only analyse these channels (1-3)")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes")
+    parser.add_argument("--no-plots", action = "store_true", help = "only save the .npz results")
+    args = parser.parse_args()
+
+    filenames = []
+    for pattern in args.recordings:
+        filenames += sorted(glob.glob(pattern))
+    filenames = selectRecordings(filenames)
+
+    stems = [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]         # Results are named after the recording
+    clashes = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if (len(clashes) > 0):
+        parser.error("recordings from different folders have the same name, their results would "
+                     "overwrite each other: " + ", ".join(clashes))
+
+    plugins = {plugin.name: plugin for plugin in Plugins.discover()}
+    missing = [name for name in args.functions if name not in plugins]
+    if (len(missing) > 0):
+        parser.error("unknown function(s): " + ", ".join(missing) +
+                     ". Found: " + ", ".join(plugins))
+
+    os.makedirs(args.output, exist_ok = True)
+    jobs = makeJobs(filenames, [plugins[name] for name in args.functions],
+                    args.sensors, args.channels, args.output, not args.no_plots)
+
+    print("Running " + str(len(jobs)) + " jobs on " + str(len(filenames)) + " recordings")
+    start = time.perf_counter()
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers = args.workers) as pool:
+        futures = {pool.submit(runJob, *job): job for job in jobs}
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                failed += 1
+                filename, sensor, ch, script = futures[future][:4]
+                print("FAILED: " + script + " on " + filename + " " + sensor + " CH" + str(ch))
+                traceback.print_exc()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print("%d jobs (%d failed) in %.2f s: %.2f files/s, %.1f jobs/s" %
+          (len(jobs), failed, elapsed, len(filenames) / elapsed, len(jobs) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+################################################################################
+#   Title: BenchmarkDecoder.py
+#   Author: Zac Lynn
+#
+#   Description: Microbenchmark that compares the original per-sample
+#           MQTT.unpack() loop against the vectorized SampleDecoder on packets
+#           the same size as the ones sent by the embedded devices.
+#
+#   Notes: Run from the CoreApplication folder: python BenchmarkDecoder.py
+################################################################################
+import timeit
+import numpy as np
+
+import MQTT
+import SampleDecoder
+
+SAMPLES = 250                                                                                   # Samples per packet, matches SAMPLES in TeensyWiFi/src/main.cpp
+REPEAT = 2000                                                                                   # Number of packets decoded per measurement
+
+
+class UnpackState:                                                                              # Holds the attributes MQTT.unpack() reads from self
+    def __init__(self, inputChannels):
+        self.inputChannels = inputChannels
+        self.sampleBytes = SampleDecoder.sampleBytes(inputChannels)
+
+
+def makePacket(inputChannels):
+    rng = np.random.default_rng(0)
+    data = np.empty((SAMPLES, inputChannels + 1), dtype=">u2")
+    data[:, 0] = np.arange(SAMPLES)                                                             # Relative time counter
+    data[:, 1:] = rng.integers(0, 1024, size=(SAMPLES, inputChannels))                          # 10-bit ADC values
+
+    return data.tobytes() + b"\x00"                                                             # Trailing byte like the loop in readRawData() skips
+
+
+def unpackPath(state, payload):                                                                 # Original readRawData() decoding loop
+    samples = {"time": [], 1: [], 2: [], 3: []}
+    data = []
+
+    for i in range(0, len(payload)-1, state.sampleBytes):
+        sample = MQTT.MQTT.unpack(state, payload[i:i+state.sampleBytes])
+        data.append(sample)
+
+        samples["time"].append(sample[0])
+        samples[1].append(sample[1])
+        if (state.inputChannels > 1):
+            samples[2].append(sample[2])
+        if (state.inputChannels > 2):
+            samples[3].append(sample[3])
+
+    return data
+
+
+def decoderPath(state, payload):
+    return SampleDecoder.decodePayload(payload, state.inputChannels)
+
+
+for inputChannels in range(1, 4):
+    state = UnpackState(inputChannels)
+    payload = makePacket(inputChannels)
+
+    expected = np.array(unpackPath(state, payload), dtype=np.uint16)                            # Make sure both paths decode the same values
+    assert np.array_equal(expected, decoderPath(state, payload))
+
+    unpackTime = min(timeit.repeat(lambda: unpackPath(state, payload), number=REPEAT, repeat=3))
+    decoderTime = min(timeit.repeat(lambda: decoderPath(state, payload), number=REPEAT, repeat=3))
+
+    print("%d CH: unpack %8.2f us/packet   decoder %6.2f us/packet   speedup %5.1fx" %
+          (inputChannels,
+           unpackTime / REPEAT * 1e6,
+           decoderTime / REPEAT * 1e6,
+           unpackTime / decoderTime))
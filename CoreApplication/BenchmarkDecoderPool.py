@@ -0,0 +1,162 @@
+################################################################################
+#   Title: BenchmarkDecoderPool.py
+#   Author: Zac Lynn
+#
+#   Description: Measures the samples per second the core application can
+#           decode and store for each number of decoder processes (0 is the
+#           decoder thread). Packets of every sensor are sent as fast as
+#           possible and go through the same stages as MQTT.handleDecoded():
+#           SequenceTracker, SampleStore, and one PlotBuffer per channel. With
+#           decoder processes the packets are placed here and written into
+#           shared memory by the processes, like MQTT.submitDecoder(). The
+#           CPU time of this process per packet shows how much work is left
+#           on the core the decoder thread runs on.
+#
+#   Notes: Run from the CoreApplication folder, no broker is needed, e.g.
+#           python BenchmarkDecoderPool.py --sensors 16 --processes 0 1 2 4
+################################################################################
+import argparse
+import os
+import threading
+import time
+import numpy as np
+
+import DecoderPool
+import PlotBuffer
+import SampleDecoder
+import SampleStore
+import SequenceTracker
+
+SAMPLES = 250                                                                                   # Samples per packet, SAMPLES in main.cpp
+
+
+def makePackets(sensors, channels, packets):                                                    # Raw payloads in the order they would arrive, sensors interleaved
+    rng = np.random.default_rng(0)
+    payloads = []
+    for num in range(packets):
+        for sensor in range(sensors):
+            data = np.empty((SAMPLES, 1 + channels), dtype=">u2")
+            data[:, 0] = np.arange(num * SAMPLES, (num + 1) * SAMPLES) % 65536                  # Relative time counter
+            data[:, 1:] = rng.integers(0, 1024, size=(SAMPLES, channels))
+            payloads.append(("sensor" + str(sensor + 1), data.tobytes()))
+
+    return payloads
+
+
+class Stages:                                                                                   # Work done after decoding, like MQTT.handleDecoded()
+
+    def __init__(self, sensors, channels, packets, fs=2000, shared=False):
+        trialTime = packets * SAMPLES / fs + 1
+        self.store = SampleStore.SampleStore(trialTime, fs, channels, shared = shared)
+        self.sequence = SequenceTracker.SequenceTracker()
+        self.plots = {}
+        self.handled = 0
+
+        for sensor in range(sensors):
+            name = "sensor" + str(sensor + 1)
+            self.store.addSensor(name)
+            self.sequence.addSensor(name)
+            self.plots[name] = [PlotBuffer.PlotBuffer(self.store.capacity, 1 / fs, shared = shared)
+                                for ch in range(channels)]
+
+
+    def handle(self, sensor, data):
+        voltage = SampleDecoder.toVoltage(data[:, 1:])
+
+        first = self.sequence.place(sensor, data[:, 0])
+        self.store.put(sensor, first, data)
+        for ch, plot in enumerate(self.plots[sensor]):
+            plot.put(first, voltage[:, ch])
+
+        self.handled += 1
+
+
+    def submit(self, pool, sensor, payload, channels):                                          # Place a packet and send it to a decoder process, like MQTT.submitDecoder()
+        counter, count = SampleDecoder.packetCounter(payload, channels)
+        first = self.sequence.placeFirst(sensor, counter, count)
+        pool.submit(sensor, payload, channels, first, 0.0, self.store, self.plots[sensor])
+
+
+    def collect(self, sensor, first, count, stored, rxTime, seconds, store, plots):             # Only the cursors are moved, like MQTT.collectPlaced()
+        store.advance(sensor, first + stored, count - stored)
+        for plot in plots:
+            plot.advance(first + stored)
+
+        self.handled += 1
+
+
+    def close(self):
+        self.store.close()
+        for plots in self.plots.values():
+            for plot in plots:
+                plot.close()
+
+
+def runThread(payloads, stages, channels):                                                      # Decoder thread: decode and handle every packet in order
+    for sensor, payload in payloads:
+        stages.handle(sensor, SampleDecoder.decodePayload(payload, channels))
+
+
+def runPool(payloads, stages, channels, processes):
+    # Submit on this thread and handle the decoded packets on a collector
+    # thread, like MQTT.useDecoderProcesses()
+    pool = DecoderPool.DecoderPool(processes)
+    done = threading.Event()
+
+    def collectLoop():
+        while (not done.is_set() or pool.pending() > 0):
+            if (pool.collect(stages.collect) == 0):
+                time.sleep(DecoderPool.POLL_SECONDS)
+
+    collector = threading.Thread(target=collectLoop, daemon=True)
+    collector.start()
+    start = time.perf_counter()                                                                 # Processes are running, don't count their start up
+
+    for sensor, payload in payloads:
+        stages.submit(pool, sensor, payload, channels)
+    done.set()
+    collector.join()
+
+    seconds = time.perf_counter() - start
+    pool.close()
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Samples per second for each number of decoder processes.")
+    parser.add_argument("--sensors", type = int, default = 16, help = "number of sensors")
+    parser.add_argument("--channels", type = int, default = 3, help = "channels per sensor")
+    parser.add_argument("--packets", type = int, default = 400, help = "packets per sensor")
+    parser.add_argument("--processes", type = int, nargs = "+",
+                        default = sorted({0, 1, 2, 4, os.cpu_count() or 1}), help = "numbers of decoder processes to test")
+    args = parser.parse_args()
+
+    payloads = makePackets(args.sensors, args.channels, args.packets)
+    samples = len(payloads) * SAMPLES
+    print("%d sensors x %d channels, %d packets, %d CPU cores" %
+          (args.sensors, args.channels, len(payloads), os.cpu_count() or 1))
+
+    baseline = None
+    for processes in args.processes:
+        stages = Stages(args.sensors, args.channels, args.packets, shared = processes > 0)
+        cpuStart = time.process_time()                                                          # CPU time of this process only, not the decoder processes
+
+        if (processes == 0):
+            start = time.perf_counter()
+            runThread(payloads, stages, args.channels)
+            seconds = time.perf_counter() - start
+        else:
+            seconds = runPool(payloads, stages, args.channels, processes)
+
+        cpu = time.process_time() - cpuStart
+        assert stages.handled == len(payloads)
+        stages.close()
+        rate = samples / seconds
+        baseline = baseline or rate
+
+        print("%2d processes: %10.0f samples/s  %5.2fx   this process %6.1f us CPU/packet" %
+              (processes, rate, rate / baseline, cpu / len(payloads) * 1e6), flush = True)
+
+
+if __name__ == "__main__":
+    main()
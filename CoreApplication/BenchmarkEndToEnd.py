@@ -0,0 +1,199 @@
+################################################################################
+#   Title: BenchmarkEndToEnd.py
+#   Author: Zac Lynn
+#
+#   Description: Load test of the MQTT client against a local broker. The
+#           sensors are simulated by SensorSimulator.py in a separate process
+#           and the core application runs without the GUI. Every combination
+#           of sensors, sample frequency, and channels is captured once, from
+#           the lightest load to the heaviest, and a trial passes when every
+#           sample was received and the messages never waited longer than
+#           --max-lag in the decoder queue. The largest sensors x fs x channels
+#           that passed is printed at the end for each --backend, the threaded
+#           MQTT class and/or the asyncio AsyncMQTT class.
+#
+#   Notes: Run from the CoreApplication folder. Starts mosquitto with
+#           Broker/mosquitto.conf unless --no-broker is given, for example:
+#           python BenchmarkEndToEnd.py --fs 1000 2000 4000 --max-fs 8000
+################################################################################
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import AsyncMQTT
+import MQTT
+
+BROKER_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Broker", "mosquitto.conf")
+CONNECT_TIMEOUT = 10                                                                            # Seconds to wait for the simulated sensors to answer
+END_TIMEOUT = 30                                                                                # Seconds after the trial time to wait for every END
+BACKENDS = {"thread": MQTT.MQTT, "asyncio": AsyncMQTT.AsyncMQTT}
+
+
+def startBroker():                                                                              # mosquitto with the config used in the lab (port 1883)
+    broker = subprocess.Popen(["mosquitto", "-c", BROKER_CONFIG],
+                              stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    time.sleep(0.5)
+    if (broker.poll() is not None):
+        sys.exit("mosquitto did not start, is it installed and is port 1883 free?")
+
+    return broker
+
+
+def startSimulator(sensors, broker, port, maxFs):
+    return subprocess.Popen([sys.executable, "SensorSimulator.py", "--sensors", str(sensors),
+                             "--broker", broker, "--port", str(port), "--max-fs", str(maxFs)])
+
+
+def waitFor(condition, timeout):                                                                # Poll until condition() is true, returns False on timeout
+    end = time.time() + timeout
+    while (time.time() < end):
+        if (condition()):
+            return True
+        time.sleep(0.05)
+
+    return False
+
+
+def connect(mqtt, sensors):
+    # Same as "Connect to sensors" in the GUI: ping every sensor and wait for
+    # the RTC time it sends back. Sensors that did not answer are pinged
+    # again every second, a simulator that is still starting misses the ping
+    sent = time.time()
+
+    def answered(sensor):
+        state = mqtt.sensors.get(sensor)
+        return state is not None and state.connected and state.rtcRxTime > sent
+
+    waiting = sensors
+    while (len(waiting) > 0 and time.time() < sent + CONNECT_TIMEOUT):
+        mqtt.pingSensors(waiting)
+        waitFor(lambda: all(answered(sensor) for sensor in waiting), 1.0)
+        waiting = [sensor for sensor in sensors if not answered(sensor)]
+
+    return len(waiting) == 0
+
+
+def readMetrics(filename):                                                                      # Worst queue wait and queue depth over the metrics snapshots of a trial
+    queueWait = 0.0
+    queueDepth = 0
+    with open(filename) as file:
+        for line in file:
+            snapshot = json.loads(line)
+            queueWait = max(queueWait, snapshot["latency"].get("queueWait", {}).get("p99", 0.0))
+            queueDepth = max(queueDepth, snapshot["gauges"].get("queue", 0))
+
+    return queueWait / 1e3, queueDepth
+
+
+def runTrial(mqtt, sensors, fs, channels, trialTime, folder):
+    if (not connect(mqtt, sensors)):
+        return None
+
+    name = "%dx%dHzx%dCH" % (len(sensors), fs, channels)
+    cpuStart = time.process_time()                                                              # CPU time of this process, the simulator runs in its own
+    mqtt.outputFilename = os.path.join(folder, name)
+    states = [mqtt.sensors.get(sensor) for sensor in sensors]
+    startTime = max(mqtt.startTimes(states))                                                    # Start time calculated like startDataCapture()
+
+    for sensor in sensors:
+        mqtt.sendConfiguration(trialTime, fs, channels, sensor, startTime)
+
+    waitFor(lambda: any(state.configWasSet for state in states), CONNECT_TIMEOUT + 5)
+    done = waitFor(lambda: mqtt.recorder is None, mqtt.FORWARD_TIME_OFFSET + trialTime + END_TIMEOUT)
+
+    if (not done):                                                                              # Some sensor never sent END, save what was received
+        mqtt.writeToFile()
+    cpu = (time.process_time() - cpuStart) / trialTime
+
+    expected = trialTime * fs
+    received = {sensor: mqtt.sequence.summary(sensor) for sensor in sensors}
+    queueWait, queueDepth = readMetrics(mqtt.outputFilename + "_metrics.jsonl")
+
+    return {"name": name, "load": len(sensors) * fs * channels, "done": done,
+            "lost": sum(expected - stats["received"] for stats in received.values()),
+            "outOfOrder": sum(stats["outOfOrder"] for stats in received.values()),
+            "queueWait": queueWait, "queueDepth": queueDepth, "cpu": cpu}
+
+
+def runBackend(backend, args, folder):                                                          # Every trial with one MQTT class, returns the results
+    mqtt = BACKENDS[backend]("Benchmark", brokerIP = args.broker, port = args.port)             # No GUI, like the recorder runs on a lab laptop
+    mqtt.useDecoderProcesses(args.decoders)
+    mqtt.start()
+
+    results = []
+    try:
+        for numSensors in sorted(args.sensors):
+            simulator = startSimulator(numSensors, args.broker, args.port, args.max_fs)
+            sensors = ["sensor" + str(num + 1) for num in range(numSensors)]                    # Names used by SensorSimulator.py
+
+            for fs, channels in sorted(itertools.product(args.fs, args.channels),
+                                       key = lambda config: config[0] * config[1]):
+                result = runTrial(mqtt, sensors, fs, channels, args.time, folder)
+                if (result is None):
+                    print("%dx%dHzx%dCH: sensors did not connect" % (numSensors, fs, channels))
+                    continue
+
+                result["backend"] = backend
+                result["passed"] = (result["done"] and result["lost"] == 0 and
+                                    result["queueWait"] <= args.max_lag)
+                results.append(result)
+                print("%-7s %-16s load %7d samples/s  lost %6d  out of order %4d  queue wait p99 %7.1f ms  "
+                      "max queue %5d  CPU %5.1f%%  %s" %
+                      (backend, result["name"], result["load"], result["lost"], result["outOfOrder"],
+                       result["queueWait"] * 1e3, result["queueDepth"], result["cpu"] * 100,
+                       "PASS" if result["passed"] else "FAIL"), flush = True)
+
+            simulator.terminate()
+            simulator.wait()
+    finally:
+        mqtt.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "End to end load test with simulated sensors.")
+    parser.add_argument("--broker", default = "127.0.0.1", help = "broker IP address")
+    parser.add_argument("--port", type = int, default = 1883, help = "broker port (use with --no-broker)")
+    parser.add_argument("--no-broker", action = "store_true", help = "use a broker that is already running")
+    parser.add_argument("--sensors", type = int, nargs = "+", default = [1, 2, 4, 8, 16], help = "numbers of sensors to test")
+    parser.add_argument("--fs", type = int, nargs = "+", default = [1000, 1500, 2000], help = "sample frequencies to test")
+    parser.add_argument("--channels", type = int, nargs = "+", default = [1, 2, 3], help = "channel counts to test")
+    parser.add_argument("--time", type = int, default = 10, help = "length of each data capture in seconds")
+    parser.add_argument("--max-lag", type = float, default = 0.5, help = "longest queue wait (p99, seconds) that still passes")
+    parser.add_argument("--max-fs", type = int, default = 2000, help = "highest fs the simulated sensors accept")
+    parser.add_argument("--decoders", type = int, default = 0, help = "decode the sample packets in this many processes")
+    parser.add_argument("--backend", nargs = "+", choices = sorted(BACKENDS), default = ["thread"],
+                        help = "MQTT classes to test, e.g. --backend thread asyncio to compare them")
+    args = parser.parse_args()
+
+    broker = None if args.no_broker else startBroker()
+    folder = tempfile.mkdtemp(prefix = "emgBenchmark")
+
+    results = []
+    try:
+        for backend in args.backend:
+            results += runBackend(backend, args, folder)
+    finally:
+        if (broker is not None):
+            broker.terminate()
+            broker.wait()
+
+    for backend in args.backend:
+        passed = [result for result in results if result["passed"] and result["backend"] == backend]
+        if (len(passed) > 0):
+            best = max(passed, key = lambda result: result["load"])
+            print(backend + ": highest load without loss or lag: " + best["name"] + " (" +
+                  str(best["load"]) + " samples/s)")
+        else:
+            print(backend + ": no configuration passed")
+    print("Recordings and metrics are in " + folder)
+
+
+if __name__ == "__main__":
+    main()
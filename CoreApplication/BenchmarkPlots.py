@@ -0,0 +1,105 @@
+################################################################################
+#   Title: BenchmarkPlots.py
+#   Author: Zac Lynn
+#
+#   Description: Compares the two plot layouts used by addPlots(): a separate
+#           figure and canvas for every plot, or every plot in one figure.
+#           Measures the setup time and the cost of a live view frame, both
+#           the blitted frames and the full redraw when the view moves to the
+#           next window of time.
+#
+#   Notes: Uses the Agg canvas so it can run without a display, this measures
+#           the rendering cost but not the copy to the Tk window.
+#           Run from the CoreApplication folder: python BenchmarkPlots.py
+################################################################################
+import time
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import LivePlot
+import PlotBuffer
+
+SENSORS = 2
+CHANNELS = 3
+FS = 2000
+TRIAL_TIME = 30
+WINDOW = 5                                                                                      # Live view window in seconds
+PACKET = 500                                                                                    # Samples added to each plot between frames (250 ms at 2 kHz)
+
+
+def setupPlot(temp, ax):
+    temp["ax"] = ax
+    temp["line"], = ax.plot([])
+    temp["buffer"] = PlotBuffer.PlotBuffer(TRIAL_TIME * FS, 1.0 / FS)
+    ax.set_ylim(bottom = -0.25, top = 3.6)
+    ax.set_ylabel("Voltage (v)")
+
+
+def separatePlots():
+    plotFrames = []
+    for ch in range(CHANNELS):
+        for devNum in range(SENSORS):
+            temp = {"fig": Figure(figsize = (6, 2.33), tight_layout = True)}
+            temp["canvas"] = FigureCanvasAgg(temp["fig"])
+            setupPlot(temp, temp["fig"].add_subplot(1, 1, 1))
+            temp["canvas"].draw()
+            plotFrames.append(temp)
+
+    return plotFrames
+
+
+def sharedPlots():
+    plotFrames = []
+    fig = Figure(figsize = (6 * SENSORS, 2.33 * CHANNELS), tight_layout = True)
+    grid = fig.add_gridspec(CHANNELS, SENSORS)
+    canvas = FigureCanvasAgg(fig)
+    firstAx = None
+
+    for ch in range(CHANNELS):
+        for devNum in range(SENSORS):
+            temp = {"fig": fig, "canvas": canvas}
+            setupPlot(temp, fig.add_subplot(grid[ch, devNum], sharex = firstAx))
+            firstAx = firstAx or temp["ax"]
+            plotFrames.append(temp)
+
+    canvas.draw()
+    return plotFrames
+
+
+def measure(layout):
+    start = time.perf_counter()
+    plotFrames = layout()
+    setupTime = time.perf_counter() - start
+
+    plotter = LivePlot.LivePlotter(plotFrames, WINDOW)
+    rng = np.random.default_rng(0)
+    blitTimes = []
+    redrawTimes = []
+
+    for frame in range(TRIAL_TIME * FS // PACKET):                                              # Simulate a whole data capture
+        for plotFrame in plotFrames:
+            plotFrame["buffer"].extend(1.65 + rng.normal(0, 0.3, PACKET))
+
+        page = plotter.groups[0]["page"]
+        start = time.perf_counter()
+        plotter.draw()
+        elapsed = time.perf_counter() - start
+
+        if (plotter.groups[0]["page"] != page):                                                 # The view moved, so every canvas was fully redrawn
+            redrawTimes.append(elapsed)
+        else:
+            blitTimes.append(elapsed)
+
+    return setupTime, np.median(blitTimes), np.median(redrawTimes), blitTimes
+
+
+for name, layout in (("separate", separatePlots), ("shared", sharedPlots)):
+    setupTime, blitTime, redrawTime, blitTimes = measure(layout)
+    firstHalf = np.median(blitTimes[:len(blitTimes)//2])
+    secondHalf = np.median(blitTimes[len(blitTimes)//2:])
+
+    print("%-8s setup %7.1f ms   frame %6.1f ms   redraw %6.1f ms   "
+          "frame first/second half %5.1f / %5.1f ms" %
+          (name, setupTime * 1e3, blitTime * 1e3, redrawTime * 1e3, 
+           firstHalf * 1e3, secondHalf * 1e3))
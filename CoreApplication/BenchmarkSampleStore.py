@@ -0,0 +1,78 @@
+################################################################################
+#   Title: BenchmarkSampleStore.py
+#   Author: Zac Lynn
+#
+#   Description: Compares the memory used by the original dict-of-lists sample
+#           storage against the preallocated SampleStore for a full length
+#           data capture (30 s, 2 kHz, 3 channels, 2 sensors).
+#
+#   Notes: Run from the CoreApplication folder: python BenchmarkSampleStore.py
+################################################################################
+import tracemalloc
+import numpy as np
+
+import SampleStore
+
+TRIAL_TIME = 30
+FS = 2000
+CHANNELS = 3
+SENSORS = ["sensor1", "sensor2"]
+SAMPLES = 250                                                                                   # Samples per packet
+
+
+def makePackets():
+    rng = np.random.default_rng(0)
+    total = TRIAL_TIME * FS
+    data = np.empty((total, CHANNELS + 1), dtype=np.uint16)
+    data[:, 0] = np.arange(total) % 65536
+    data[:, 1:] = rng.integers(0, 1024, size=(total, CHANNELS))
+
+    return [data[i:i+SAMPLES] for i in range(0, total, SAMPLES)]
+
+
+def listStorage(packets):                                                                       # Original MQTT.samples layout
+    samples = {}
+    for sensor in SENSORS:
+        samples[sensor] = {"time": []}
+        for ch in range(CHANNELS):
+            samples[sensor][ch+1] = []
+
+    for packet in packets:
+        for sensor in SENSORS:
+            for sample in packet.tolist():
+                samples[sensor]["time"].append(sample[0])
+                for ch in range(CHANNELS):
+                    samples[sensor][ch+1].append(sample[ch+1])
+
+    return samples
+
+
+def storeStorage(packets):
+    store = SampleStore.SampleStore(TRIAL_TIME, FS, CHANNELS)
+    for sensor in SENSORS:
+        store.addSensor(sensor)
+
+    for packet in packets:
+        for sensor in SENSORS:
+            store.append(sensor, packet)
+
+    return store
+
+
+def measure(function, packets):
+    tracemalloc.start()
+    result = function(packets)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return result, size
+
+
+packets = makePackets()
+
+samples, listBytes = measure(listStorage, packets)
+store, storeBytes = measure(storeStorage, packets)
+
+print("dict of lists: %8.2f MB" % (listBytes / 1e6))
+print("SampleStore:   %8.2f MB" % (storeBytes / 1e6))
+print("reduction:     %8.1fx" % (listBytes / storeBytes))
@@ -1,64 +1,30 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+import DataLoader
+import TimeSynch
+
 filename = "./TimeSynchTest_3CH.csv"
-arr = []
 numChannels = None
 data = None
 
 def readData():
-    global arr, data, numChannels
-    with open(filename, "r") as fp:                                                         # Read the data file into an array
-        while (fp.readable()):
-            line = fp.readline()
-            
-            if (len(line) == 0):
-                break
-
-            line = line.strip("\n")
-            line = line.split(",")
-            arr.append(line)
-
-    data = {"sensor1": None, "sensor2": None}
-    data["sensor1"] = {}
-    data["sensor2"] = {}
-    for key in arr[1]:
-        data["sensor1"][str(key)] = []                                                                 # This dictionary will hold the data
-        data["sensor2"][str(key)] = []
-
-    numChannels = int(len(arr[1]) / len(data.keys())) - 1
-
-    for line in range(2, len(arr)):                                                         # Iterate through lines of the file
-        sensorNumber = 0
-        for key in data.keys():                                                             # Iterate across each row based on number of sensors and number of channels per sensor 
-            for i in range(numChannels+1):
-                if (i == 0):
-                    data[key]["Time"].append(
-                        float(arr[line][sensorNumber * (numChannels+1) + i]))
-                else:
-                    data[key]["CH" + str(i)].append(
-                        float(arr[line][sensorNumber * (numChannels+1) + i]) / 1023.0 * 3.3)
-            
-            sensorNumber += 1
-    
-def calculateTimeSynch():                                                                   # Check the time synch by finding when quare waves are out of phase
-    sampleOffset = 0
-    offsetSum = 0
-    numOffsets = 0
-    
-    for t in range(len(arr)-2):
-        temp = [data[key]["CH1"][t] for key in data.keys()]                                 # Put the values from sensor1 and sensor2 at time t into a list
-
-        if (max(temp) - min(temp) > 1.5):                                                   # If there is a difference greater than 1.5 volts, the sensor times are not synched
-            sampleOffset += 1    
-        else:
-            offsetSum += sampleOffset
-            numOffsets += 1 if sampleOffset > 1 else 0
-            sampleOffset = 0
+    global data, numChannels
+    data = DataLoader.loadRecording(filename)                                               # {sensor: {"Time": ..., "CH1": ...}} with channels in volts
 
-    samplePeriod = data["sensor1"]["Time"][1]
-    timeOffset = int((offsetSum / numOffsets) * samplePeriod * 1000)
-    print("Average time offset (ms): " + str(timeOffset))
+    numChannels = DataLoader.readHeader(filename)[1]
+    
+def calculateTimeSynch():                                                                   # Measure the time offset of each sensor from cross-correlation of the test signals
+    samplePeriod = data[list(data.keys())[0]]["Time"][1]
+    lags = TimeSynch.recordingLag(data, 1.0 / samplePeriod, maxLag=maxLag)
+
+    for sensor, (times, lag, peak) in lags.items():
+        slope, offset = TimeSynch.drift(times, lag)
+        for ch in range(numChannels):
+            print(sensor + " CH" + str(ch+1) + 
+                  " average time offset (ms): %.3f" % (np.nanmean(lag[ch]) * 1000) + 
+                  ", drift (ppm): %.1f" % (slope[ch] * 1e6) + 
+                  ", correlation: %.2f" % np.nanmin(peak[ch]))
 
 def plotData():                                                                             # Visually check time synch
     
@@ -91,7 +57,8 @@ def plotData():
     plt.figure()
 
     for i in range(1, numChannels+1): 
-        diff = np.abs(np.subtract(data["sensor1"]["CH" + str(i)], data["sensor2"]["CH" + str(i)]))
+        keys = list(data.keys())
+        diff = np.abs(np.subtract(data[keys[0]]["CH" + str(i)], data[keys[1]]["CH" + str(i)]))
         
         plt.subplot(numChannels, 1, i)    
         plt.plot(data[key]["Time"], diff)
@@ -111,6 +78,7 @@ def plotData():
 # original (0.195, 0.245)
 # 3CH
 xView = (1.00, 1.05)
+maxLag = 0.01                                                                               # Seconds, must be less than half the period of the 40 Hz square wave
 readData()
 calculateTimeSynch()
 plotData()
@@ -12,14 +12,23 @@
 import tkinter as tk                                                                            # Import tkinter to make the GUI
 import tkinter.scrolledtext as st                                                               # Import scrolled text area for the text output
 from tkinter import ttk                                                                         # Used for the spinboxes for entering config
-from tkinter import Frame, Button, DISABLED                                                     # Import basic gui elements: Frame, Button
+from tkinter import Frame, Button, DISABLED, NORMAL                                             # Import basic gui elements: Frame, Button
 
 from matplotlib.figure import Figure                                                            # Used to create the plots
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg                                 # Used to embed the plots in the GUI
-import matplotlib.animation as animation                                                        # Used to continuously update the plots
+from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk                              # Toolbar for the figure shared by all plots
 
+import LivePlot                                                                                 # Draws the embedded plots while data is being captured
+import LiveSpectrum                                                                             # Spectrogram and median frequency while data is being captured
+import Metrics                                                                                  # Formats the metrics snapshots for the stats pane
+import AnalysisPool                                                                             # Processes that run the custom analysis functions
 import CustomToolbar                                                                            # Custom class that adds functions to embedded plots
 import MQTT                                                                                     # Custom class to handle wireless communications
+import AsyncMQTT                                                                                # Same class driven by an asyncio event loop
+import Plugins                                                                                  # Finds and runs the custom analysis functions
+import PlotBuffer                                                                               # Preallocated data and x-axis arrays for the embedded plots
+import SampleStore                                                                              # Used to size the plot buffers the same as the sample arrays
+import argparse
 import time
 
 
@@ -28,21 +37,33 @@ class CoreApplication():
     window = None                                                                               # Holds reference to the application window
     mqtt = None                                                                                 # Stores MQTT class instance
     plotFrames = []                                                                             # Holds data and necessary objects for the embedded plots
+    plotRoutes = {}                                                                             # Maps (sensor name, channel) to the plot frame that displays it
     numDevices = 0                                                                              # Number of connected devices
     sensorNames = []                                                                            # Holds the name of the connected sensor at start of data capture, mainly used by MQTT class
     bgColor = "blue4"                                                                           # TKinter color to use for window background
     dataLen = None
     dataFreq = None
     numChannels = None
+    livePlotter = None                                                                          # Draws the live view of all plots from a single timer
+    spectrumView = None                                                                         # Live spectrum window of the current data capture
+    animationTimer = None                                                                       # ID of the pending window.after() call to animate()
+    lastPlottedTime = None                                                                      # Receive time of the newest packet drawn by animate()
+    ANIMATE_MS = 250                                                                            # Update the plots every 250 ms
+    EVENT_POLL_MS = 50                                                                          # How often the Tk main loop runs GUI updates queued by the MQTT class
+    SENSOR_GRID_COLUMNS = 2                                                                     # Sensors shown side by side in the connected devices grid
 
 
-    def __init__(self):
-        self.mqtt = MQTT.MQTT("Laptop", brokerIP='192.168.1.2', top=self)                       # Set IP to 0 or ommit in arguments to connect to localhost
+    def __init__(self, viewer=False, mqttClass=MQTT.MQTT, decoders=0):
+        self.viewer = viewer                                                                    # Only show the data captures run by RecorderService.py
+        clientID = "Viewer" if viewer else "Laptop"                                             # Both can be connected to the broker at once
+        self.mqtt = mqttClass(clientID, brokerIP='192.168.1.2', top=self)                       # Set IP to 0 or ommit in arguments to connect to localhost
+        self.analysisPool = AnalysisPool.AnalysisPool()                                         # Start the analysis workers now so toolbar buttons respond quickly
 
         self.window = tk.Tk()                                                                   # Create applicatio window
-        self.window.title("EMG Data Capture")
+        self.window.title("EMG Data Capture (viewer)" if viewer else "EMG Data Capture")
         self.window.config(bg=self.bgColor)
         self.window.minsize(1000, 500)                                                          # Prevent user from making window to small to focus
+        self.pluginRunner = Plugins.PluginRunner(self.window, self.analysisPool)                # Custom functions found in customFunctions/
 
         self.setupLeftFrame()                                                                   # Setup controls and serial readout
         self.setupRightFrame()                                                                  # Setup plot area
@@ -51,8 +72,21 @@ class CoreApplication():
         self.window.columnconfigure(0, weight = 1, minsize=450)
         self.window.columnconfigure(1, weight = 1, minsize=550)
         
-        self.mqtt.client.loop_start()                                                           # Begin MQTT looping to automatically poll broker                            
+        if (viewer):                                                                            # The recorder service configures the sensors and saves the files
+            self.mqtt.follow()
+            for button in (self.startButton, self.stopButton, self.connectDevicesBtn):
+                button["state"] = DISABLED
+
+        self.mqtt.useDecoderProcesses(decoders)                                                 # Optional, 0 decodes on the decoder thread
+        self.mqtt.start()                                                                       # Begin MQTT looping to automatically poll broker                            
+        self.window.after(self.EVENT_POLL_MS, self.pollEvents)                                  # Start running GUI updates from the MQTT class on this thread
         self.window.mainloop()                                                                  # Open and run main window
+        self.analysisPool.close()
+        self.pluginRunner.close()
+        self.mqtt.closeDecoders()
+
+        for frame in self.plotFrames:
+            frame["buffer"].close()
 
 
     def setupLeftFrame(self): 
@@ -93,6 +127,34 @@ class CoreApplication():
         dataCaptureTimeSpinBox = ttk.Spinbox(self.lowerFrame, from_ = 1, to = 30, 
                                              justify="center", increment=1, wrap=True,
                                              textvariable = self.dataCaptureTime)
+
+        # Live view window
+        liveWindowLabel = tk.Label(self.lowerFrame, text = "Live View Window (s): ", 
+                                   bg = leftFrameColor)
+
+        self.liveWindow = tk.StringVar()
+        self.liveWindow.set(5)
+        liveWindowSpinBox = ttk.Spinbox(self.lowerFrame, from_ = 1, to = 30, 
+                                        justify="center", increment=1, wrap=True,
+                                        textvariable = self.liveWindow)
+
+        # Plot layout
+        self.sharedFigure = tk.BooleanVar()
+        self.sharedFigure.set(True)
+        sharedFigureCheck = tk.Checkbutton(self.lowerFrame, text = "Draw all plots in one figure", 
+                                           variable = self.sharedFigure, bg = leftFrameColor)
+
+        # Live spectrum
+        self.liveSpectrum = tk.BooleanVar()
+        self.liveSpectrum.set(False)
+        liveSpectrumCheck = tk.Checkbutton(self.lowerFrame, text = "Show live spectrum and median frequency", 
+                                           variable = self.liveSpectrum, bg = leftFrameColor)
+
+        # Clock drift correction
+        self.alignClocks = tk.BooleanVar()
+        self.alignClocks.set(False)
+        alignClocksCheck = tk.Checkbutton(self.lowerFrame, text = "Correct clock drift (file is saved at the end)", 
+                                          variable = self.alignClocks, bg = leftFrameColor)
     
         self.outputFilenameEntryLabel = tk.Label(self.lowerFrame, 
                                                  text = "Output file name: ", 
@@ -112,15 +174,18 @@ class CoreApplication():
         self.connectedDevicesLabel = tk.Label(self.middleFrame, 
                                               text = "Connected Devices: ")
         
-        self.device1Label = tk.Label(self.middleFrame, text = "Sensor1:")
-        self.device1Status = tk.Label(self.middleFrame, text = "-")
-        
-        self.device2Label = tk.Label(self.middleFrame, text = "Sensor2:")
-        self.device2Status = tk.Label(self.middleFrame, text = "-")
+        # One cell per sensor (name, +/- status, lost and out of order samples),
+        # added by addSensor() when a sensor announces itself
+        self.sensorGrid = Frame(self.middleFrame)
+        self.sensorWidgets = {}                                                                 # Sensor name -> {"label", "status", "link"}
 
         self.connectDevicesBtn = Button(self.middleFrame, text = "Connect to sensors", 
                                         command=lambda: self.connectSensors())
 
+        # Message rates and time taken by each stage, updated every second
+        self.statsLabel = tk.Label(self.middleFrame, text = "", font = "TkFixedFont", 
+                                   justify = "left", anchor = "w")
+
         # ----------------- Serial Output Frame -----------------
         # Setting up Serial output
         self.serialMonitorLabel = tk.Label(self.output, text = "Serial Output ")
@@ -164,11 +229,25 @@ class CoreApplication():
         inputChannelsSpinBox.grid(row = 3, column = 1, columnspan = 2, padx = 20,  
                                   sticky = "NWSE")
 
-        self.startButton.grid(row = 4, column = 0, padx = 20, pady = 5, 
+        liveWindowLabel.grid(row = 4, column = 0, padx = 5, pady = 5, 
+                             sticky = "NWSE")
+        liveWindowSpinBox.grid(row = 4, column = 1, columnspan = 2, padx = 20, 
+                               pady = 5, sticky = "NWSE")
+
+        sharedFigureCheck.grid(row = 5, column = 0, columnspan = 3, padx = 5, pady = 5, 
+                               sticky = "NWS")
+
+        liveSpectrumCheck.grid(row = 6, column = 0, columnspan = 3, padx = 5, pady = 5, 
+                               sticky = "NWS")
+
+        alignClocksCheck.grid(row = 7, column = 0, columnspan = 3, padx = 5, pady = 5, 
+                              sticky = "NWS")
+
+        self.startButton.grid(row = 8, column = 0, padx = 20, pady = 5, 
                               sticky = "NWSE")
-        self.stopButton.grid(row = 4, column = 1, padx = 10, pady = 5, 
+        self.stopButton.grid(row = 8, column = 1, padx = 10, pady = 5, 
                              sticky = "NWSE")
-        self.dataCaptureLabel.grid(row = 4, column = 2, padx = 5, pady = 5, 
+        self.dataCaptureLabel.grid(row = 8, column = 2, padx = 5, pady = 5, 
                                    sticky = "NWSE")
 
         # Allow all items to scale with parent frame
@@ -181,23 +260,24 @@ class CoreApplication():
         self.lowerFrame.rowconfigure(2, weight = 1)
         self.lowerFrame.rowconfigure(3, weight = 1)
         self.lowerFrame.rowconfigure(4, weight = 1)
+        self.lowerFrame.rowconfigure(5, weight = 1)
+        self.lowerFrame.rowconfigure(6, weight = 1)
+        self.lowerFrame.rowconfigure(7, weight = 1)
+        self.lowerFrame.rowconfigure(8, weight = 1)
         
         # Adding elements to devices list 
         self.connectedDevicesLabel.grid(row = 0, column = 0, sticky = "NWSE")
         self.connectDevicesBtn.grid(row = 1, column = 0, sticky = "NWSE")
 
-        self.device1Label.grid(row = 0, column = 1, sticky = "NWSE")
-        self.device1Status.grid(row = 0, column = 2, sticky = "NWSE")
+        self.sensorGrid.grid(row = 0, column = 1, rowspan = 2, sticky = "NWSE")
 
-        self.device2Label.grid(row = 1, column = 1, sticky = "NWSE")
-        self.device2Status.grid(row = 1, column = 2, sticky = "NWSE")
+        self.statsLabel.grid(row = 2, column = 0, columnspan = 2, sticky = "NWSE")
         
         # Allow text output but not label to grow with parent
         self.middleFrame.rowconfigure(0, weight = 1)
         self.middleFrame.rowconfigure(1, weight = 1)
         self.middleFrame.columnconfigure(0, weight = 1)
-        self.middleFrame.columnconfigure(1, weight = 1)
-        self.middleFrame.columnconfigure(2, weight = 1)
+        self.middleFrame.columnconfigure(1, weight = 3)
 
         # Adding elements to output
         self.serialMonitorLabel.grid(row = 0, column = 0, sticky = "NWSE")
@@ -209,6 +289,77 @@ class CoreApplication():
         self.output.columnconfigure(0, weight = 1)
 
         
+    def pollEvents(self):                                                                       # Runs the GUI updates queued by the MQTT decoder thread
+        self.mqtt.processEvents()
+        self.pluginRunner.processResults()                                                      # Show results of custom functions that ran on a thread
+        self.window.after(self.EVENT_POLL_MS, self.pollEvents)
+
+
+    def log(self, text):                                                                        # Add a line to the serial output
+        self.serialOutput.insert("end", text + "\n") 
+        self.serialOutput.yview('end')  
+
+
+    def addSensor(self, sensor):                                                                # Add a cell to the sensor grid, called when a new sensor announces itself
+        if (sensor in self.sensorWidgets):
+            return
+
+        row, column = divmod(len(self.sensorWidgets), self.SENSOR_GRID_COLUMNS)                 # Fill the grid left to right, then top to bottom
+        widgets = {"label": tk.Label(self.sensorGrid, text = sensor + ":"),
+                   "status": tk.Label(self.sensorGrid, text = "-"),
+                   "link": tk.Label(self.sensorGrid, text = "")}                                # Lost and out of order samples, updated while data is captured
+
+        for num, key in enumerate(["label", "status", "link"]):
+            widgets[key].grid(row = row, column = column * 3 + num, sticky = "NWSE")
+            self.sensorGrid.columnconfigure(column * 3 + num, weight = 1)
+
+        self.sensorWidgets[sensor] = widgets
+
+
+    def setSensorStatus(self, sensor, connected):                                               # Show a sensor as connected (+) or disconnected (-)
+        self.addSensor(sensor)
+        self.sensorWidgets[sensor]["status"].config(text = "+" if connected else "-")
+
+
+    def setLinkStats(self, sensor, stats):                                                      # Show the lost and out of order samples of a sensor
+        self.addSensor(sensor)
+        self.sensorWidgets[sensor]["link"].config(text = "Lost: %.2f %%  Out of order: %d" % 
+                                                  (stats["lossRate"], stats["outOfOrder"]),
+                                                  fg = "red" if stats["lost"] > 0 else "black") # Red while any samples are missing
+
+
+    def setMetrics(self, snapshot):                                                             # Show the newest metrics snapshot in the stats pane
+        self.statsLabel.config(text = Metrics.formatSnapshot(snapshot))
+
+
+    def enableStart(self):                                                                      # Allow start button to be pressed again
+        if (not self.viewer):
+            self.startButton["state"] = NORMAL
+
+
+    def captureEnded(self):                                                                     # Called once every sensor sent END and the file was saved
+        self.captureData = False
+        self.dataCaptureLabel.config(bg = "red")
+
+        self.stopAnimation()                                                                    # Stop the live view so plots can be manipulated manually
+
+
+    def followCapture(self, config):
+        # Called when the recorder service configures a data capture, the MQTT
+        # class already expects the data of its sensors. Set up the plots the
+        # same way startDataCapture() does
+        self.dataLen = int(config["trialTime"])
+        self.dataFreq = int(config["fs"])
+        self.numChannels = int(config["channels"])
+        self.sensorNames = list(config["sensors"])
+        self.numDevices = len(self.sensorNames)
+        self.captureData = True
+
+        self.log("Recorder service started " + config["output"])
+        self.addPlots()
+        self.dataCaptureLabel.config(bg = "green")
+
+
     def setupRightFrame(self):
         self.rightFrame = Frame(self.window, bg = self.bgColor)
 
@@ -216,26 +367,69 @@ class CoreApplication():
         self.rightFrame.grid(row = 0, column = 1, sticky = "NWSE")
 
         
-    # This function is called periodically from FuncAnimation
-    def animate(self, i, xs, ys, ax, line):
-        
-        line.set_data(xs, ys)                                                                   # Plot the x,y pairs
+    # This function is called periodically by a single timer shared by all plots
+    def animate(self):
+        start = time.perf_counter()
+        self.livePlotter.draw()                                                                 # Draw the newest window of data on every plot
+        self.mqtt.metrics.since("animate", start)
+
+        plottedTime = self.mqtt.plottedTime
+        if (plottedTime is not None and plottedTime != self.lastPlottedTime):                   # New data was drawn by this frame
+            self.mqtt.metrics.observe("receiveToPlot", time.time() - plottedTime)
+            self.lastPlottedTime = plottedTime
 
-        if (len(xs) > 1):                                                                       # If data was added, extend the x-axis veiw to show all data
-            ax.set_xlim(left=xs[0], right=xs[-1])
+        self.animationTimer = self.window.after(self.ANIMATE_MS, self.animate)
 
-        return line,
+
+    def startAnimation(self):
+        self.stopAnimation()
+        self.livePlotter = LivePlot.LivePlotter(self.plotFrames, float(self.liveWindow.get()))
+        self.animationTimer = self.window.after(self.ANIMATE_MS, self.animate)
+
+        if (self.spectrumView is not None):                                                     # Close the spectrum of the previous data capture
+            self.spectrumView.close()
+            self.spectrumView = None
+
+        if (self.liveSpectrum.get()):
+            self.spectrumView = LiveSpectrum.SpectrumView(self.window, self.mqtt, self.sensorNames,
+                                                          self.numChannels, self.dataFreq)
+
+
+    def stopAnimation(self):                                                                    # Cancel the timer and show all of the captured data
+        if (self.animationTimer is not None):
+            self.window.after_cancel(self.animationTimer)
+            self.animationTimer = None
+
+        if (self.livePlotter is not None):
+            self.livePlotter.finish()
+            self.livePlotter = None
+
+        if (self.spectrumView is not None):                                                     # Window stays open with the last frames
+            self.spectrumView.stop()
 
 
     def addPlots(self):
         self.rightFrame.configure(bg = "black")
+        self.stopAnimation()
         for frame in self.plotFrames:
             frame["frame"].destroy()
+            frame["buffer"].close()                                                             # Free the shared memory of the old plots
 
         self.plotFrames = []
+        self.plotRoutes = {}
+        capacity = self.dataLen * self.dataFreq + SampleStore.SampleStore.SPARE_SAMPLES         # Same number of samples the MQTT class allocates per sensor
         
+        if (self.sharedFigure.get()):                                                           # Put every plot on one canvas or give each plot its own canvas
+            self.addSharedPlots(capacity)
+        else:
+            self.addSeparatePlots(capacity)
+
+        self.startAnimation()                                                                   # One timer draws every plot
+            
+
+    def addSeparatePlots(self, capacity):                                                       # One figure, canvas, and toolbar per plot
         for ch in range(self.numChannels):                                                      # Iterate through number of channels (1-3)
-            for devNum in range(self.numDevices):                                               # iterate through connected devices (1-2)
+            for devNum in range(self.numDevices):                                               # iterate through connected devices
                 temp = {"frame": Frame(self.rightFrame)}                                        # Create a dictionary to hold objects required for plotting
 
                 # Creating embedded matplotlib figures in a dictionary
@@ -243,18 +437,8 @@ class CoreApplication():
                 temp["ax"] = temp["fig"].add_subplot(1, 1, 1)                                   # Set the figure up as a subplot for animator function to work well
                 temp["line"], = temp["ax"].plot([])                                             # Initialize the data as empty to intialize plot
                 temp["canvas"] = FigureCanvasTkAgg(temp["fig"], master = temp["frame"])         # Create TK canvas to embbed the plot inside of
-                temp["data"] = []                                                               # Will store the data to be plotted
-                temp["xAxis"] = []                                                              
-
-                # Set up the plot to call animate() periodically to draw the plot in real time
-                temp["animator"] = animation.FuncAnimation(temp["fig"],                         # Figure to plot in
-                                                           self.animate,                        # Animate function
-                                                           fargs = (temp["xAxis"],              # X-data
-                                                                    temp["data"],               # Y-data
-                                                                    temp["ax"],                 # Used to update xAxis view
-                                                                    temp["line"]),              # Used to actually update plot
-                                                            interval=250,                       # Update every 250 ms
-                                                            cache_frame_data=False)             # Each frame is only shown once and not saved, dont need cache       
+                temp["buffer"] = PlotBuffer.PlotBuffer(capacity, 1.0 / self.dataFreq, shared = True) # Will store the data to be plotted and the x-axis
+
                 # Finish setting up blank plot
                 temp["frame"].grid(row = ch, column = devNum, padx = 3,                         # Set the plot position in the canvas and allow it to stetch with window
                                    pady = 3, sticky = "NWSE")
@@ -275,8 +459,55 @@ class CoreApplication():
                 toolbar.update()                                                                
                 temp["canvas"].get_tk_widget().pack()                                           # add the toolbar to the plot            
                 temp["mask"] = (devNum, ch)
+                temp["sensor"] = self.sensorNames[devNum]
+                temp["channel"] = ch+1
                 self.plotFrames.append(temp)                                                    # Add dictionary to list of plots                                  
-            
+                self.plotRoutes[(self.sensorNames[devNum], ch+1)] = temp                        # Route this sensor and channel (1-3) straight to the plot
+
+
+    def addSharedPlots(self, capacity):                                                         # All plots in one figure drawn on a single canvas
+        frame = Frame(self.rightFrame)
+        frame.grid(row = 0, column = 0, padx = 3, pady = 3, sticky = "NWSE")
+        self.rightFrame.columnconfigure(0, weight = 1)
+        self.rightFrame.rowconfigure(0, weight = 1)
+
+        fig = Figure(figsize = (6 * min(self.numDevices, 2), 2.33 * self.numChannels),          # Canvas is resized to fit the window, many sensors get narrower plots
+                     tight_layout = True)
+        grid = fig.add_gridspec(self.numChannels, self.numDevices)                              # Same layout as the separate plots: rows are channels, columns are sensors
+        canvas = FigureCanvasTkAgg(fig, master = frame)
+        firstAx = None
+
+        for ch in range(self.numChannels):                                                      # Iterate through number of channels (1-3)
+            for devNum in range(self.numDevices):                                               # iterate through connected devices
+                temp = {"frame": frame, "fig": fig, "canvas": canvas}                           # Every plot shares the frame, figure, and canvas
+
+                temp["ax"] = fig.add_subplot(grid[ch, devNum], sharex = firstAx)                # All plots share the x-axis of the first plot
+                firstAx = firstAx or temp["ax"]
+                temp["line"], = temp["ax"].plot([])                                             # Initialize the data as empty to intialize plot
+                temp["buffer"] = PlotBuffer.PlotBuffer(capacity, 1.0 / self.dataFreq, shared = True) # Will store the data to be plotted and the x-axis
+
+                # Configure the plot with labels and limits for axes
+                temp["ax"].set_ylim(bottom = -0.25, top = 3.6)                                  # Set the ylim based on possible voltage values (0-3.3v)
+                temp["ax"].set_ylabel("Voltage (v)")                                            # Add y label
+                temp["ax"].set_title(str(self.sensorNames[devNum]) + " CH " + str(ch+1))        # Set title using sensor and channel number
+                if (ch == self.numChannels - 1):                                                # Only the bottom row shows the shared time axis
+                    temp["ax"].set_xlabel("Time (s)")
+                else:
+                    temp["ax"].tick_params(labelbottom = False)
+
+                temp["mask"] = (devNum, ch)
+                temp["sensor"] = self.sensorNames[devNum]
+                temp["channel"] = ch+1
+                self.plotFrames.append(temp)                                                    # Add dictionary to list of plots                                  
+                self.plotRoutes[(self.sensorNames[devNum], ch+1)] = temp                        # Route this sensor and channel (1-3) straight to the plot
+
+        canvas.draw()                                                                           # Draw the canvas to make the plots appear
+        canvas.get_tk_widget().pack(expand=True, fill="both")                                   # Elements within the embedded plot must use pack()
+
+        toolbar = NavigationToolbar2Tk(canvas, frame)                                           # Standard toolbar for the whole figure
+        toolbar.update()
+        self.analysisMenu = CustomToolbar.AnalysisMenu(self, canvas, self.plotFrames)           # Custom functions are in the right click menu of each plot
+
 
     def setDataCaptureFlag(self, flag):                                                         # Called when GUI start and stop buttons are pressed 
         if (flag and self.captureData):                                                         # If the flag is already set to the desired state do nothing
@@ -293,22 +524,11 @@ class CoreApplication():
             
 
     def startDataCapture(self): 
-        self.numDevices = 0
-        self.sensorNames = []
-        startTime = []
-
         ######### Use the RTC time reported by devices to calculate the start time #########
-        for device in list(self.mqtt.devices.keys()):                                           # Iterate through devices
-            if (self.mqtt.devices[device] == 0):                                                # If the deivce is not connected skip over    
-                continue
-
-            # start time = (RTC time) + (time since reading RTC) + offset               
-            startTime.append(int(self.mqtt.deviceTime[device][0] +                              # Use a start time that is offset seconds in the future 
-                            (time.time() - self.mqtt.deviceTime[device][1]) + 
-                            self.mqtt.FORWARD_TIME_OFFSET))
-            
-            self.numDevices += 1                                                                # Keep track of connected devices for setting up embedded plots
-            self.sensorNames.append(device)
+        devices = self.mqtt.sensors.connected()
+        startTime = self.mqtt.startTimes(devices)                                               # Use a start time that is offset seconds in the future 
+        self.numDevices = len(devices)                                                          # Keep track of connected devices for setting up embedded plots
+        self.sensorNames = [device.name for device in devices]
 
         if (self.numDevices == 0):                                                              # Check to make sure there is at leas 1 connected device              
             self.serialOutput.insert("end", "No devices are connected\n") 
@@ -329,14 +549,13 @@ class CoreApplication():
         self.dataLen = int(self.dataCaptureTime.get())                                          
         self.dataFreq = int(self.dataCaptureFrequency.get())                                    
         self.numChannels = int(self.inputChannels.get())
+        self.mqtt.outputFilename = self.outputFilenameEntry.get()                               # Read on this thread, the file is written from the decoder thread
+        self.mqtt.alignClocks = self.alignClocks.get()
 
         ######## If time synchronization is good, setup plots and send start signal ########
         self.addPlots()                                                                         # Setup embedded plots in GUI
 
-        for device in list(self.mqtt.devices.keys()):                                           # Send configuration messages to all connected sensors to start sampling                               
-            if (self.mqtt.devices[device] == 0):                                                # If the deivce is not connected skip over
-                continue
-            
+        for device in self.sensorNames:                                                         # Send configuration messages to all connected sensors to start sampling                               
             self.mqtt.sendConfiguration(self.dataLen, 
                                         self.dataFreq, 
                                         self.numChannels,
@@ -348,23 +567,27 @@ class CoreApplication():
     
 
     def stopDataCapture(self):
-        for device in list(self.mqtt.devices.keys()):                                           # Iterate through devices
-            self.mqtt.configWasSet[device] = False                                              # Ends data capture
+        for device in self.mqtt.sensors.all():                                                  # Iterate through devices
+            device.configWasSet = False                                                         # Ends data capture
             self.dataCaptureLabel.config(bg = "red")                                            # Set data capture label to red 
-            self.mqtt.writeToFile()                                                             # Write data to file
-
 
-    def connectSensors(self):
-        self.mqtt.sendPayload("sensor1", "ping")                                                # Send a "ping" to both sensors
-        self.mqtt.sendPayload("sensor2", "ping")
+        self.mqtt.writeToFile()                                                                 # Write the data of every sensor to file
+        self.stopAnimation()                                                                    # Stop the live view so plots can be manipulated manually
 
-        self.device1Status.config(text="-")                                                     # Update the GUI to show as disconnected
-        self.device2Status.config(text="-")
 
-        for device in list(self.mqtt.devices.keys()):                                           # Update flags to be disconnected
-            self.mqtt.devices[device] = 0 
+    def connectSensors(self):
+        for device in self.mqtt.pingSensors():                                                  # Send a "ping" to every sensor that announced itself
+            self.setSensorStatus(device.name, False)                                            # Update the GUI to show as disconnected
 
         # If devices are connected they will respond and their flags will be set 
 
         
-SM = CoreApplication()
\ No newline at end of file
+if __name__ == "__main__":                                                                      # Worker processes import this file, only the main process opens the GUI
+    parser = argparse.ArgumentParser(description = "EMG data capture GUI.")
+    parser.add_argument("--viewer", action = "store_true", help = "attach to a running RecorderService.py")
+    parser.add_argument("--asyncio", action = "store_true", help = "receive with AsyncMQTT instead of the paho thread")
+    parser.add_argument("--decoders", type = int, default = 0, help = "decode the sample packets in this many processes")
+    args = parser.parse_args()
+
+    SM = CoreApplication(viewer = args.viewer, decoders = args.decoders,
+                         mqttClass = AsyncMQTT.AsyncMQTT if args.asyncio else MQTT.MQTT)
\ No newline at end of file
@@ -2,11 +2,20 @@
 #   Title: CustomToolbar.py
 #   Author: Zac Lynn
 #   Description: This code implements the custom buttons in the user 
-#        interface that call the custom analysis functions.
+#        interface that call the custom analysis functions. The buttons
+#        are made from the plugins found by Plugins.py
 ########################################################################
-from subprocess import PIPE, Popen                                                              # For running analysis functions
 from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk                              # Used for creating custom toolbar
-    
+import tkinter as tk                                                                            # Used for the right click menu on shared figures
+
+
+def runPlugin(GUI, plotFrame, plugin):                                                          # Run a custom function on the data of a plot
+    meta = {"title": str(plotFrame["ax"].get_title()),
+            "sensor": plotFrame["sensor"],
+            "channel": plotFrame["channel"]}
+
+    GUI.pluginRunner.run(plugin, plotFrame["buffer"], GUI.dataFreq, meta)
+
 
 # Custom toolbar class provides custom analysis functions embedded into plots
 class CustomToolbar(NavigationToolbar2Tk):                                                      # Inherit from default toolbar to add new icons/functions                                            
@@ -19,74 +28,46 @@ class CustomToolbar(NavigationToolbar2Tk):
         
         self.toolitems = [t for t in NavigationToolbar2Tk.toolitems]                            # Add standard buttons 
         
-        self.toolitems.append(                                                                  # Add buttons for custom functions   
-            # Button name,    hover hint,    icon file name,  callback function
-            ("fft",        "Calculate FFT",      "fft",        'fft_callback')
-        )
-        self.toolitems.append(          
-            ("env", "Calculate moving average envelope", "env", 'env_callback')
-        )
-        self.toolitems.append(          
-            ("func1", "Custom function 1", "func1", 'func1_callback')
-        )
-        self.toolitems.append(          
-            ("func2", "Custom function 2", "func2", 'func2_callback')
-        )
-        self.toolitems.append(          
-            ("func3", "Custom function 3", "func3", 'func3_callback')
-        )
-        self.toolitems.append(          
-            ("func4", "Custom function 4", "func4", 'func4_callback')
-        )
-        self.toolitems.append(          
-            ("func5", "custom function 5", "func5", 'func5_callback')
-        )
+        for plugin in GUI.pluginRunner.plugins:                                                 # Add buttons for the custom functions found in customFunctions/
+            callback = plugin.name + "_callback"
+            setattr(self, callback, lambda plugin=plugin: self.runPlugin(plugin))               # Toolbar looks the callbacks up by name
+            self.toolitems.append((plugin.name, plugin.hint, plugin.icon, callback))
 
         NavigationToolbar2Tk.__init__(self, plotFrame["canvas"], plotFrame["frame"])            # Call parent init to setup custom toolbar
 
 
-    def start_subProcess(self, script):
-        p = Popen(['python', './customFunctions/' + script],                                    # Start a new process and connect pipes for stdin, stdout, and stderr      
-                  stdin = PIPE, stdout = PIPE, stderr = PIPE)
-        
-        TxData = (str(self.GUI.dataFreq) + "," +                                                # Combine the sampling frequency, figure title, and figure data to send through pipe
-                  str(self.plotFrame["ax"].get_title()) + "," + 
-                  str(self.plotFrame["data"]))
-        
-        # Try catch used to prevent blocking. If timout occurs raises Exception
-        try:                                                                                    # Send the data to new process, timeout will raise exception
-            p.communicate(TxData.encode('utf8'), timeout=1)                                     # Setting a timeout makes this non-blocking, freeing main thread to return
-        except:
-            pass                                                                                # Do nothing with timeout exception so main thread can continue
-
-        # Analysis threads are responsible for killing themselves, 
-        # this happens naturally when code execution ends  
-        # Just dont open 10k windows and it will be fine
-        
+    def runPlugin(self, plugin):
+        runPlugin(self.GUI, self.plotFrame, plugin)
 
-    def fft_callback(self):
-        self.start_subProcess("fft.py")      
-    
 
-    def env_callback(self):
-        self.start_subProcess("env.py")
+# When every plot shares one figure there is only one toolbar, so the custom
+# functions are run from a menu that opens when an axes is right clicked
+class AnalysisMenu:
 
+    def __init__(self, GUI, canvas, plotFrames):
+        self.GUI = GUI
+        self.canvas = canvas
+        self.plotFrames = {id(plotFrame["ax"]): plotFrame for plotFrame in plotFrames}          # Find the plot from the axes that was clicked
+        self.target = None                                                                      # Plot the menu was opened on
 
-    def func1_callback(self):
-        self.start_subProcess("func1.py") 
-
+        self.menu = tk.Menu(canvas.get_tk_widget(), tearoff = 0)
+        for plugin in GUI.pluginRunner.plugins:
+            self.menu.add_command(label = plugin.hint, 
+                                  command = lambda plugin=plugin: self.run(plugin))
 
-    def func2_callback(self):
-        self.start_subProcess("func2.py")
+        canvas.mpl_connect("button_press_event", self.onClick)
 
 
-    def func3_callback(self):
-        self.start_subProcess("func3.py")
+    def onClick(self, event):
+        if (event.button != 3 or event.inaxes is None):                                         # Only open on a right click inside of an axes
+            return
 
+        self.target = self.plotFrames.get(id(event.inaxes))
+        if (self.target is None):
+            return
 
-    def func4_callback(self):
-        self.start_subProcess("func4.py")
+        self.menu.tk_popup(event.guiEvent.x_root, event.guiEvent.y_root)
 
 
-    def func5_callback(self):
-        self.start_subProcess("func5.py")
+    def run(self, plugin):
+        runPlugin(self.GUI, self.target, plugin)
@@ -0,0 +1,107 @@
+################################################################################
+#   Title: DataLoader.py
+#   Author: Zac Lynn
+#
+#   Description: This code loads recordings saved by the core application into
+#           NumPy arrays. Both the .csv layout (two header rows followed by
+#           Time, CH1, ... groups for each sensor) and the binary .wda files
+#           are supported. Only the requested sensors and channels are kept, and
+#           large files can be read in blocks of rows.
+#
+#   Notes: Data
+################################################################################
+import csv                                                                                      # Used to read the .csv header rows
+import itertools                                                                                # Used to read the .csv file in blocks
+import numpy as np
+
+import SampleDecoder                                                                            # ADC value to voltage conversion
+import WDAFile                                                                                  # Binary recordings
+
+CHUNK_ROWS = 100000                                                                             # Rows read at a time
+
+
+def readHeader(filename):                                                                       # Returns the sensor names and number of channels per sensor
+    if (filename.endswith(".wda")):
+        header = WDAFile.readHeader(filename)[0]
+        return header["sensors"], header["channels"]
+
+    with open(filename, "r", newline="") as file:
+        reader = csv.reader(file)
+        sensors = [name for name in next(reader) if name != ""]                                 # First header row has the sensor names
+        names = next(reader)                                                                    # Second header row has Time, CH1, ...
+
+    return sensors, len(names) // len(sensors) - 1
+
+
+def selectColumns(allSensors, inputChannels, sensors=None, channels=None):
+    # Returns (sensor, key, column) for every column that should be loaded.
+    # Time is always loaded, channels are numbered from 1.
+    sensors = allSensors if sensors is None else sensors
+    channels = range(1, inputChannels + 1) if channels is None else channels
+    selected = []
+
+    for sensor in sensors:
+        first = allSensors.index(sensor) * (1 + inputChannels)                                  # Column of this sensor's Time value
+        selected.append((sensor, "Time", first))
+        for ch in channels:
+            selected.append((sensor, "CH" + str(ch), first + ch))
+
+    return selected
+
+
+def splitColumns(block, selected, volts):                                                       # Turn a block of rows into {sensor: {key: values}}
+    data = {}
+    for index, (sensor, key, column) in enumerate(selected):
+        values = block[:, index]
+        if (volts and key != "Time"):
+            values = SampleDecoder.toVoltage(values)
+
+        data.setdefault(sensor, {})[key] = values
+
+    return data
+
+
+def iterRecording(filename, chunkRows=CHUNK_ROWS, sensors=None, channels=None, volts=True):
+    # Yields the recording as blocks of at most chunkRows rows, each block has
+    # the same {sensor: {"Time": ..., "CH1": ...}} layout as loadRecording().
+    # Use this for recordings that do not fit in memory.
+    allSensors, inputChannels = readHeader(filename)
+    selected = selectColumns(allSensors, inputChannels, sensors, channels)
+    columns = [column for sensor, key, column in selected]
+
+    if (filename.endswith(".wda")):
+        header, rows = WDAFile.load(filename)
+        timeIndex = [index for index, (sensor, key, column) in enumerate(selected) if key == "Time"]
+
+        for start in range(0, len(rows), chunkRows):
+            block = rows[start:start+chunkRows, columns].astype(np.float64)                     # Only the selected columns are copied out of the file
+            block[block == header.get("missing", -1)] = np.nan                                  # Lost samples are nan, the same as in the .csv file
+            block[:, timeIndex] = (np.arange(start, start + len(block)) / header["fs"])[:, None]
+            yield splitColumns(block, selected, volts)
+        return
+
+    with open(filename, "r") as file:
+        file.readline()                                                                         # Skip the two header rows
+        file.readline()
+
+        while (True):
+            lines = list(itertools.islice(file, chunkRows))
+            if (len(lines) == 0):
+                return
+
+            block = np.loadtxt(lines, delimiter=",", usecols=columns, ndmin=2)                  # Columns that were not selected are never converted
+            yield splitColumns(block, selected, volts)
+
+
+def loadRecording(filename, sensors=None, channels=None, volts=True):
+    # Returns {sensor: {"Time": array, "CH1": array, ...}}. Time is in seconds
+    # and the channels are in volts unless volts is False.
+    chunks = list(iterRecording(filename, sensors=sensors, channels=channels, volts=volts))
+    allSensors, inputChannels = readHeader(filename)
+    data = {}
+
+    for sensor, key, column in selectColumns(allSensors, inputChannels, sensors, channels):
+        values = [chunk[sensor][key] for chunk in chunks]
+        data.setdefault(sensor, {})[key] = np.concatenate(values) if values else np.zeros(0)
+
+    return data
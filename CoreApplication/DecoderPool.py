@@ -0,0 +1,217 @@
+################################################################################
+#   Title: DecoderPool.py
+#   Author: Zac Lynn
+#
+#   Description: This code moves the per sensor work on the sample packets to
+#           a pool of processes, so sessions with many sensors are not limited
+#           to the one core the decoder thread runs on. Every sensor is given
+#           to one decoder process (round robin in the order the sensors are
+#           first seen), so the packets of a sensor are handled in the order
+#           they arrived. The core application only places each packet with
+#           the SequenceTracker, which needs the first relative time and not
+#           the decoded samples, and copies the raw packet into a shared
+#           memory ring. The decoder process decodes it, writes the samples
+#           straight into the shared SampleStore array of the sensor and the
+#           voltages into the shared PlotBuffers, and returns a small record
+#           that collect() uses to move the cursors. No samples are copied
+#           back, the recorder and the plots read the shared arrays.
+#
+#   Notes: Data. Used by the MQTT class when decoderProcesses is more than 0.
+#           Only plots in shared memory are written, plots without one are
+#           not drawn. Run BenchmarkDecoderPool.py to see the samples per
+#           second for each number of processes.
+################################################################################
+import collections
+import json                                                                                     # Arrays of a sensor sent to its decoder process
+import multiprocessing                                                                          # Decoder processes
+import struct
+import time
+
+import PlotBuffer
+import SampleDecoder                                                                            # Same decoding as the decoder thread
+import SampleStore
+import SharedRing                                                                               # Shared memory rings between the processes
+
+RING_BYTES = 8 * 1024 * 1024                                                                    # Each ring holds a few seconds of 16 sensors at 2 kHz
+POLL_SECONDS = 0.001                                                                            # Sleep while a ring is empty or full
+RAW = struct.Struct("<HBBid")                                                                   # Sensor number, kind, channels, first sample number, receive time
+PLACED = struct.Struct("<HxxIiIIdd")                                                            # Sensor number, generation, first sample number, samples, samples stored, receive time, seconds
+PACKET, CONFIGURE, STOP = 0, 1, 2                                                               # Kinds of the records sent to a decoder process
+
+
+def openSensor(config, store=None):
+    # Attach to the arrays of a sensor, config is made by DecoderPool.configure().
+    # store is kept if the config only changed the plots, its cursor is where
+    # the next packet is written after a gap
+    if (store is None):
+        store = SampleStore.SampleStore(config["trialTime"], config["fs"], config["channels"])
+        store.addSensor(0, name = config["store"])
+    plots = [None if plot is None else PlotBuffer.PlotBuffer(plot["capacity"], plot["samplePeriod"], name = plot["name"])
+             for plot in config["plots"]]
+
+    return config["generation"], store, plots
+
+
+def closePlots(plots):
+    for plot in plots:
+        if (plot is not None):
+            plot.close()
+
+
+def plotName(plot):                                                                             # Shared memory block of a plot, None if there is no plot or it is not shared
+    if (plot is None or plot.shm is None):
+        return None
+
+    return plot.shm.name
+
+
+def workerMain(rawName, placedName):                                                            # Runs in each decoder process
+    raw = SharedRing.SharedRing(name=rawName)
+    placed = SharedRing.SharedRing(name=placedName)
+    sensors = {}                                                                                # Sensor number -> (generation, SampleStore, [PlotBuffer or None for each channel])
+
+    while (True):
+        record = raw.read()
+        if (record is None):
+            time.sleep(POLL_SECONDS)
+            continue
+
+        number, kind, channels, first, rxTime = RAW.unpack_from(record)
+        if (kind == STOP):
+            break
+
+        if (kind == CONFIGURE):                                                                 # New data capture or new plots for this sensor
+            config = json.loads(record[RAW.size:])
+            generation, store, plots = sensors.get(number, (None, None, []))
+            closePlots(plots)
+            if (store is not None and store.name(0) != config["store"]):                        # New data capture
+                store.close()
+                store = None
+            sensors[number] = openSensor(config, store)
+            continue
+
+        start = time.perf_counter()
+        generation, store, plots = sensors[number]
+        data = SampleDecoder.decodePayload(memoryview(record)[RAW.size:], channels)
+        stored = store.put(0, first, data)
+
+        if (any(plot is not None for plot in plots)):
+            voltage = SampleDecoder.toVoltage(data[:, 1:])
+            for ch, plot in enumerate(plots):
+                if (plot is not None):
+                    plot.put(first, voltage[:, ch])
+
+        notice = PLACED.pack(number, generation, first, len(data), stored, rxTime, time.perf_counter() - start)
+        while (not placed.write(notice)):                                                       # Wait for collect() to make room
+            time.sleep(POLL_SECONDS)
+
+    for generation, store, plots in sensors.values():
+        store.close()
+        closePlots(plots)
+    raw.close()
+    placed.close()
+
+
+class DecoderPool:
+
+    def __init__(self, processes=2, ringBytes=RING_BYTES):
+        self.workers = []                                                                       # (process, raw ring, placed ring)
+        self.sensors = []                                                                       # Sensor number -> sensor name
+        self.numbers = {}                                                                       # Sensor name -> sensor number
+        self.arrays = {}                                                                        # Sensor number -> (generation, store, plots) not replaced in the process yet
+        self.submitted = 0                                                                      # Packets sent to the decoder processes
+        self.collected = 0                                                                      # Packets returned by collect()
+
+        for i in range(processes):
+            raw = SharedRing.SharedRing(ringBytes)
+            placed = SharedRing.SharedRing(ringBytes)
+            process = multiprocessing.Process(target=workerMain, args=(raw.name, placed.name), daemon=True)
+            process.start()
+            self.workers.append((process, raw, placed))
+
+
+    def send(self, ring, *parts):                                                               # Waits while the decoder process is behind, which holds back the caller
+        while (not ring.write(*parts)):
+            time.sleep(POLL_SECONDS)
+
+
+    def configure(self, number, ring, store, sensor, plots):
+        # Tell the decoder process of a sensor which arrays to write, only
+        # when they changed since the last packet (new data capture or plots).
+        # Every change gets a new generation, the process returns it with the
+        # packets so collect() knows which arrays they were written to
+        arrays = self.arrays.setdefault(number, collections.deque())
+        if (len(arrays) > 0):
+            generation, lastStore, lastPlots = arrays[-1]                                       # Kept alive by arrays, so "is" can't match a new object
+            if (lastStore is store and len(lastPlots) == len(plots) and
+                all(plot is last for plot, last in zip(plots, lastPlots))):
+                return
+
+        names = (store.name(sensor), [plotName(plot) for plot in plots])
+        generation = arrays[-1][0] + 1 if len(arrays) > 0 else 0
+        arrays.append((generation, store, list(plots)))
+
+        config = {"generation": generation,
+                  "trialTime": store.trialTime, "fs": store.fs, "channels": store.inputChannels,
+                  "store": names[0],
+                  "plots": [None if name is None else {"name": name, "capacity": plot.capacity,
+                                                       "samplePeriod": plot.samplePeriod}
+                            for name, plot in zip(names[1], plots)]}
+        self.send(ring, RAW.pack(number, CONFIGURE, 0, 0, 0.0), json.dumps(config).encode("utf8"))
+
+
+    def submit(self, sensor, payload, channels, first, rxTime, store, plots):
+        # Queue a raw packet for the decoder process of the sensor. first is
+        # the sample number found by the SequenceTracker, store a shared
+        # SampleStore, and plots the PlotBuffer (or None) of every channel
+        number = self.numbers.get(sensor)
+        if (number is None):
+            number = self.numbers[sensor] = len(self.sensors)
+            self.sensors.append(sensor)
+
+        process, raw, placed = self.workers[number % len(self.workers)]
+        self.configure(number, raw, store, sensor, plots)
+        self.send(raw, RAW.pack(number, PACKET, channels, first, rxTime), payload)
+        self.submitted += 1
+
+
+    def collect(self, handler):
+        # Call handler(sensor, first, count, stored, rxTime, seconds, store,
+        # plots) for every packet a decoder process has written: count samples
+        # from sample first, stored of them fit in the store. store and plots
+        # are the arrays the packet was written to. Returns the number of
+        # packets handled
+        count = 0
+        for process, raw, placed in self.workers:
+            while (True):
+                record = placed.read()
+                if (record is None):
+                    break
+
+                number, generation, first, samples, stored, rxTime, seconds = PLACED.unpack(record)
+                arrays = self.arrays[number]
+                while (arrays[0][0] != generation):                                             # The process has moved on to newer arrays
+                    arrays.popleft()
+
+                generation, store, plots = arrays[0]
+                handler(self.sensors[number], first, samples, stored, rxTime, seconds, store, plots)
+                count += 1
+
+        self.collected += count
+        return count
+
+
+    def pending(self):                                                                          # Packets submitted but not collected yet
+        return self.submitted - self.collected
+
+
+    def close(self):
+        for process, raw, placed in self.workers:
+            self.send(raw, RAW.pack(0, STOP, 0, 0, 0.0))
+
+        for process, raw, placed in self.workers:
+            process.join(timeout = 1.0)
+            if (process.is_alive()):
+                process.terminate()
+            raw.close()
+            placed.close()
@@ -0,0 +1,123 @@
+################################################################################
+#   Title: LivePlot.py
+#   Author: Zac Lynn
+#
+#   Description: This code draws the embedded plots while a data capture is
+#           running. Only a window of the most recent data is shown, it is
+#           reduced to a min/max pair per pixel column, and the lines are
+#           blitted on top of a cached background so the cost of a frame does
+#           not grow with the length of the data capture.
+#
+#   Notes: GUI
+################################################################################
+import numpy as np                                                                              # Used for the min/max decimation
+
+
+def decimateMinMax(x, y, bins):
+    # Reduce y to the minimum and maximum of each of "bins" equal groups of
+    # samples. Drawing the min and max of every pixel column looks the same as
+    # drawing every sample. Samples left over at the end are kept as they are.
+    numSamples = len(y)
+    if (bins <= 0 or numSamples <= 2 * bins):                                                   # Already fewer points than pixels
+        return x, y
+
+    perBin = numSamples // bins
+    used = perBin * bins
+
+    groups = y[:used].reshape(bins, perBin)
+    yOut = np.empty(2 * bins + numSamples - used)
+    yOut[0:2*bins:2] = np.fmin.reduce(groups, axis=1)                                           # fmin/fmax skip NaN values unless the whole group is NaN
+    yOut[1:2*bins:2] = np.fmax.reduce(groups, axis=1)
+    yOut[2*bins:] = y[used:]
+
+    xOut = np.empty(len(yOut))
+    xOut[0:2*bins:2] = x[0:used:perBin]                                                         # Min is drawn at the start of the group,
+    xOut[1:2*bins:2] = x[perBin//2:used:perBin]                                                 # max is drawn in the middle of the group
+    xOut[2*bins:] = x[used:]
+
+    return xOut, yOut
+
+
+class LivePlotter:
+    # Plots are grouped by the canvas they are drawn on, every canvas is
+    # redrawn fully only when the view moves to the next window of time. Between
+    # those the cached background is restored and only the lines are drawn.
+
+    def __init__(self, plotFrames, windowSeconds):
+        self.windowSeconds = float(windowSeconds)
+        self.groups = []
+
+        canvases = {}
+        for plotFrame in plotFrames:
+            plotFrame["line"].set_animated(True)                                                # Animated lines are left out of full draws, so they are not in the background
+
+            key = id(plotFrame["canvas"])
+            if (key not in canvases):
+                canvases[key] = {"canvas": plotFrame["canvas"], "frames": [],
+                                 "page": None, "background": None}
+                self.groups.append(canvases[key])
+
+            canvases[key]["frames"].append(plotFrame)
+
+        for group in self.groups:                                                               # Cache the background every time the canvas is fully drawn (including resizing)
+            group["drawEvent"] = group["canvas"].mpl_connect(
+                "draw_event", lambda event, group=group: self.cacheBackground(group))
+
+
+    def cacheBackground(self, group):
+        canvas = group["canvas"]
+        group["background"] = canvas.copy_from_bbox(canvas.figure.bbox)
+
+
+    def draw(self):                                                                             # Draw a single frame on every canvas
+        for group in self.groups:
+            self.drawGroup(group)
+
+
+    def drawGroup(self, group):
+        canvas = group["canvas"]
+        frames = group["frames"]
+
+        newest = max([len(frame["buffer"]) for frame in frames])                                # Number of samples in the most up to date plot
+        if (newest == 0):
+            return
+
+        samplePeriod = frames[0]["buffer"].samplePeriod
+        page = int(((newest - 1) * samplePeriod) // self.windowSeconds)                         # Which window of time the newest sample falls in
+
+        if (page != group["page"] or group["background"] is None):                              # Moving to the next window needs new axis ticks, so redraw everything
+            group["page"] = page
+            for frame in frames:
+                frame["ax"].set_xlim(left = page * self.windowSeconds,
+                                     right = (page + 1) * self.windowSeconds)
+            canvas.draw()                                                                       # Triggers cacheBackground()
+
+        canvas.restore_region(group["background"])
+
+        start = int(round(page * self.windowSeconds / samplePeriod))                            # First sample inside the window
+        for frame in frames:
+            buffer = frame["buffer"]
+            length = len(buffer)                                                                # Read once, the decoder thread may still be appending
+            bins = int(frame["ax"].bbox.width)                                                  # One min/max pair per pixel column
+
+            xs, ys = decimateMinMax(buffer.xAxis[start:length], buffer.data[start:length], bins)
+            frame["line"].set_data(xs, ys)
+            frame["ax"].draw_artist(frame["line"])
+
+        canvas.blit(canvas.figure.bbox)
+
+
+    def finish(self):                                                                           # Show all of the data once the data capture is over
+        for group in self.groups:
+            group["canvas"].mpl_disconnect(group["drawEvent"])
+
+            for frame in group["frames"]:
+                buffer = frame["buffer"]
+
+                frame["line"].set_animated(False)                                               # Draw the line normally so the toolbar can zoom and pan
+                frame["line"].set_data(buffer.x(), buffer.y())
+
+                if (len(buffer) > 1):
+                    frame["ax"].set_xlim(left = buffer.x()[0], right = buffer.x()[-1])
+
+            group["canvas"].draw_idle()
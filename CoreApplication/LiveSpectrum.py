@@ -0,0 +1,228 @@
+################################################################################
+#   Title: LiveSpectrum.py
+#   Author: Zac Lynn
+#
+#   Description: This code shows a live spectrogram and the median frequency
+#           of every sensor channel while a data capture is running, so muscle
+#           fatigue can be followed during the trial. Samples are taken from
+#           the MQTT decoder thread, cut into overlapping Hann windowed frames,
+#           and the frames of every channel are transformed together with a
+#           single rfft call each time the view is updated.
+#
+#   Notes: GUI
+################################################################################
+import threading                                                                                # Samples are added by the decoder thread and used by the GUI thread
+import tkinter as tk
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+import SampleDecoder                                                                            # ADC value to voltage conversion
+
+FRAME_SECONDS = 0.25                                                                            # Frame length, rounded up to a power of two samples
+OVERLAP = 0.5                                                                                   # Fraction of each frame shared with the next one
+HISTORY_SECONDS = 10                                                                            # Time shown by the spectrogram
+UPDATE_MS = 250                                                                                 # How often the view is updated
+
+
+def frameLength(fs, seconds=FRAME_SECONDS):                                                     # Power of two number of samples closest above seconds
+    return int(2 ** np.ceil(np.log2(max(seconds * fs, 2))))
+
+
+def medianFrequency(power, freqs):
+    # Frequency that splits the power of each spectrum in half. power can
+    # have any number of leading dimensions, the last one is frequency.
+    total = np.cumsum(power, axis=-1)
+    index = np.argmax(total >= total[..., -1:] / 2, axis=-1)
+
+    return freqs[index]
+
+
+class SpectrumAnalyzer:
+    # Splits streams of samples into frames and returns their power spectra.
+    # The window, frequency axis, and scaling are calculated once here, and
+    # process() transforms the frames of every stream with one rfft call.
+    # Frames never span lost samples, a stream starts new frames after a gap.
+
+    def __init__(self, fs, keys, nfft=None, overlap=OVERLAP):
+        self.fs = fs
+        self.nfft = frameLength(fs) if nfft is None else nfft
+        self.hop = max(int(self.nfft * (1 - overlap)), 1)                                       # Samples between the start of two frames
+
+        self.window = np.hanning(self.nfft)
+        self.freqs = np.fft.rfftfreq(self.nfft, d = 1.0 / fs)
+        self.scale = 1.0 / (fs * np.sum(self.window ** 2))                                      # Power spectral density in V^2/Hz
+
+        self.keys = list(keys)
+        self.pending = {key: np.zeros(0) for key in self.keys}                                  # Samples not yet used by a full frame
+        self.chunks = {key: [] for key in self.keys}                                            # Samples added since the last process(), None marks a gap
+        self.ends = {}                                                                          # Key -> sample number after the last sample added
+        self.lock = threading.Lock()
+
+
+    def add(self, key, values, first=None):
+        # Can be called from any thread. first is the sample number of
+        # values[0], it is used to find lost samples and late packets
+        with self.lock:
+            if (first is not None):
+                end = self.ends.get(key, first)
+                if (first < end):                                                               # Late packet, the frames after it were already made
+                    return
+
+                if (first > end):                                                               # Samples were lost, frames start again after the gap
+                    self.chunks[key].append(None)
+                self.ends[key] = first + len(values)
+
+            self.chunks[key].append(np.asarray(values, dtype=np.float64))
+
+
+    def process(self):
+        # Returns {key: (frames, nfft//2+1) power spectra} for every frame
+        # completed since the last call
+        with self.lock:
+            chunks = self.chunks
+            self.chunks = {key: [] for key in self.keys}
+
+        frames = []
+        counts = []
+        for key in self.keys:
+            segments = [[self.pending[key]]]                                                    # Runs of samples without a gap
+            for part in chunks[key]:
+                if (part is None):
+                    segments.append([])
+                else:
+                    segments[-1].append(part)
+
+            total = 0
+            for segment in segments:
+                data = np.concatenate(segment) if len(segment) > 0 else np.zeros(0)
+                count = 0 if len(data) < self.nfft else (len(data) - self.nfft) // self.hop + 1
+
+                if (count > 0):
+                    view = np.lib.stride_tricks.sliding_window_view(data, self.nfft)            # Frames are views into data, nothing is copied yet
+                    frames.append(view[0:count * self.hop:self.hop])
+
+                total += count
+                self.pending[key] = data[count * self.hop:]                                     # Only the last segment is kept for the next call
+
+            counts.append(total)
+
+        if (len(frames) == 0):
+            return {}
+
+        frames = np.concatenate(frames)                                                         # (all frames, nfft)
+        frames = frames - frames.mean(axis=1, keepdims=True)                                    # Remove the 1.65 V bias so it does not hide the signal
+        power = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2 * self.scale
+
+        spectra = {}
+        start = 0
+        for key, count in zip(self.keys, counts):
+            if (count > 0):
+                spectra[key] = power[start:start + count]
+            start += count
+
+        return spectra
+
+
+class SpectrumView:
+    # Window with one spectrogram per sensor channel, the median frequency is
+    # drawn on top of each one
+
+    def __init__(self, master, mqtt, sensors, inputChannels, fs, historySeconds=HISTORY_SECONDS):
+        self.mqtt = mqtt
+        self.sensors = list(sensors)
+        self.inputChannels = inputChannels
+        self.timer = None
+
+        keys = [(sensor, ch + 1) for ch in range(inputChannels) for sensor in self.sensors]
+        self.analyzer = SpectrumAnalyzer(fs, keys)
+        self.columns = int(historySeconds * fs / self.analyzer.hop)                             # Number of frames shown
+
+        self.window = tk.Toplevel(master)
+        self.window.title("Live Spectrum")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.fig = Figure(figsize = (5 * min(len(self.sensors), 3), 2.5 * inputChannels), tight_layout = True)
+        self.canvas = FigureCanvasTkAgg(self.fig, master = self.window)
+        grid = self.fig.add_gridspec(inputChannels, len(self.sensors))
+        extent = [-historySeconds, 0, 0, fs / 2]
+
+        self.plots = {}
+        for num, key in enumerate(keys):
+            ch, devNum = divmod(num, len(self.sensors))
+            ax = self.fig.add_subplot(grid[ch, devNum])
+
+            plot = {"ax": ax,
+                    "history": np.full((len(self.analyzer.freqs), self.columns), np.nan),       # dB power, newest frame in the last column
+                    "mdf": np.full(self.columns, np.nan)}
+            plot["image"] = ax.imshow(plot["history"], origin = "lower", aspect = "auto",
+                                      extent = extent, cmap = "viridis")
+            plot["line"], = ax.plot(np.linspace(-historySeconds, 0, self.columns), plot["mdf"],
+                                    color = "white", linewidth = 1)
+
+            ax.set_title(key[0] + " CH " + str(key[1]))
+            ax.set_ylabel("Frequency (Hz)")
+            if (ch == inputChannels - 1):
+                ax.set_xlabel("Time (s)")
+            self.plots[key] = plot
+
+        self.canvas.draw()
+        self.canvas.get_tk_widget().pack(expand=True, fill="both")
+
+        self.mqtt.addSampleListener(self.onSamples)
+        self.timer = self.window.after(UPDATE_MS, self.update)
+
+
+    def onSamples(self, sensor, samples, first):                                                # Runs on the MQTT decoder thread, only stores the samples
+        if (sensor not in self.sensors):
+            return
+
+        volts = SampleDecoder.toVoltage(samples[:, 1:])
+        for ch in range(min(self.inputChannels, volts.shape[1])):
+            self.analyzer.add((sensor, ch + 1), volts[:, ch], first)
+
+
+    def update(self):
+        self.refresh()
+        self.timer = self.window.after(UPDATE_MS, self.update)
+
+
+    def refresh(self):                                                                          # Add the frames completed since the last refresh
+        spectra = self.analyzer.process()
+
+        for key, power in spectra.items():
+            plot = self.plots[key]
+            count = min(len(power), self.columns)
+            power = power[-count:]
+
+            plot["history"] = np.roll(plot["history"], -count, axis=1)                          # Move older frames to the left
+            plot["history"][:, -count:] = 10 * np.log10(power.T + 1e-12)
+            plot["mdf"] = np.roll(plot["mdf"], -count)
+            plot["mdf"][-count:] = medianFrequency(power, self.analyzer.freqs)
+
+            plot["image"].set_data(plot["history"])
+            if (np.isfinite(plot["history"]).any()):                                            # Color range follows the data that is shown
+                plot["image"].set_clim(np.nanpercentile(plot["history"], 5),
+                                       np.nanmax(plot["history"]))
+            plot["line"].set_ydata(plot["mdf"])
+            plot["ax"].set_title(key[0] + " CH " + str(key[1]) +
+                                 "   MDF: %.1f Hz" % plot["mdf"][-1])
+
+        if (len(spectra) > 0):
+            self.canvas.draw_idle()
+
+
+    def stop(self):                                                                             # Stop following the data, the window stays open
+        if (self.timer is None):                                                                # Already stopped
+            return
+
+        self.mqtt.removeSampleListener(self.onSamples)
+        self.window.after_cancel(self.timer)
+        self.timer = None
+        self.refresh()                                                                          # Show the last frames of the data capture
+
+
+    def close(self):
+        self.stop()
+        self.window.destroy()
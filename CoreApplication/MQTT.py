@@ -9,10 +9,20 @@
 #   Notes: Communication and data
 ################################################################################        
 from paho.mqtt import client as mqtt_client                                                     # Provides functions to connect, read, and send messaged with MQTT
-from tkinter import NORMAL                                                                      # Set the state of buttons so that they can be used again
 import socket                                                                                   # Used to get the local network IP of the device
+import json                                                                                     # Status messages of the recorder service
 import time                                                                                     # Used to make some small delays and to get current time
-import csv                                                                                      # Used to write the output data file
+import queue                                                                                    # Hands messages from the network thread to the decoder thread
+import threading                                                                                # Runs the decoder off of the paho network thread
+
+import SampleDecoder                                                                            # Vectorized decoding of the raw sample packets
+import SampleStore                                                                              # Preallocated arrays that hold the samples of a data capture
+import Recorder                                                                                 # Writes the output data file while the data capture is running
+import Alignment                                                                                # Corrects the clock drift between sensors before saving
+import SequenceTracker                                                                          # Places packets by their relative time counter, finds lost samples
+import Metrics                                                                                  # Message rates and the time taken by each stage
+import SensorRegistry                                                                           # Sensors found on the broker, routed by their publish topic
+import DecoderPool                                                                              # Optional decoder processes for sessions with many sensors
 
 
 class MQTT:
@@ -20,17 +30,45 @@ class MQTT:
     port = None                                                                                 # Which port to use for MQTT (1883)
     client = None
     clientID = None                                                                             # Client ID seen by MQTT broker
-    waitingForStart = {"sensor1": False, "sensor2": False}                                      # Flag used when waiting for the system to send "START" / "FAIL"
-    configWasSet = {"sensor1": False, "sensor2": False}                                         # True if the micro recieved the config succesfuly, false else
-    samples = {}                                                                                # Holds the samples received from sensors
+    store = None                                                                                # SampleStore holding the samples received from sensors
+    recorder = None                                                                             # Recorder writing the output file of the current data capture
+    aligner = None                                                                              # Packet receive times used to correct clock drift, None if turned off
+    alignClocks = False                                                                         # Set by the GUI, resample the sensors onto one timebase before saving
+    sequence = None                                                                             # SequenceTracker of the current data capture
+    linkStatsTime = {}                                                                          # Sensor name -> last time the loss stats were sent to the GUI
+    LINK_STATS_INTERVAL = 0.5                                                                   # Seconds between updates of the loss stats in the GUI
+    METRICS_INTERVAL = 1.0                                                                      # Seconds between metrics snapshots (stats pane and metrics file)
+    metricsTime = 0                                                                             # Time of the last metrics snapshot
+    plottedTime = None                                                                          # Receive time of the newest packet added to the plots
+    captureConfig = None                                                                        # (trialTime, fs, inputChannels, startTime) of the current data capture
     inputChannels = 0                                                                           # Stores number of channels being recorded
     sampleBytes = 4                                                                             # Stores the number of bytes each sample is
-    devices = {"sensor1": 0, "sensor2": 0}                                                      # Holds sensor name as key and connection status as value
-    deviceTime = {"sensor1": [0, 0], "sensor2": [0, 0]}                                         # Stores the local time of the sensors, If times are very different then no time synch was done
+    outputFilename = "test"                                                                     # Name of the output file without extension, set before each data capture
     FORWARD_TIME_OFFSET = 3                                                                     # Amount fo time to wait before test starts, must be greater than maximum latency
+    SENSOR_TOPICS = "+/"                                                                        # Every device publishes on "<DEVICE_ID>/", commands go to "<DEVICE_ID>/CONFIG/"
+    CONTROL_BYTES = 8                                                                           # Longest control message, "TIME" + uint32 RTC time
+    COMMAND_TOPIC = "recorder/command"                                                          # Commands for RecorderService.py
+    STATUS_TOPIC = "recorder/status"                                                            # State of the data captures run by RecorderService.py
+    readOnly = False                                                                            # Viewer of a RecorderService: never publishes and saves no files
+    decoderPool = None                                                                          # Decodes the sample packets in other processes, see useDecoderProcesses()
+    DRAIN_TIMEOUT = 5.0                                                                         # Seconds END waits for the decoder processes to return the last packets
 
     def __init__(self, clientID, brokerIP=0, port=1883, top=None):
         self.top = top                                                                          # Holds a reference to the core apllication
+        self.messages = queue.SimpleQueue()                                                     # Raw messages waiting to be decoded: (topic, payload, receive time)
+        self.events = queue.SimpleQueue()                                                       # GUI updates waiting for the Tk main loop: (method name, args)
+        self.sampleListeners = []                                                               # Called with (sensor, samples) for every decoded packet
+        self.saveLock = threading.Lock()                                                        # END on the decoder thread and the stop button can both save the file
+        self.sensors = SensorRegistry.SensorRegistry()                                          # Connection and capture state of every sensor that announced itself
+        self.controlHandlers = {b"ping": self.handlePing,                                       # Control message -> handler(state), see dispatch()
+                                b"pong": self.checkConnectionResponse,                          # If pong was received, update connection status
+                                b"START": self.handleStart,
+                                b"FAIL": self.handleFail,
+                                b"END": self.handleEnd}
+
+        self.metrics = Metrics.Metrics()
+        self.metrics.addGauge("queue", self.messages.qsize)                                     # Messages waiting for the decoder thread
+        self.metrics.addGauge("events", self.events.qsize)                                      # GUI updates waiting for the Tk main loop
         
         # Set member variables
         if (brokerIP == 0):                                                                     # If the Broker IP is not set, use localhost IP
@@ -44,8 +82,8 @@ class MQTT:
         self.client = self.connect_mqtt()                                                       # Create MQTT object and connect
         
         # Add subscriptions
-        topic = "#"
-        result = self.client.subscribe(topic)                                                   # Subscribe to all topics
+        topic = self.SENSOR_TOPICS
+        result = self.client.subscribe(topic)                                                   # Subscribe to the topics the sensors publish on, not our own CONFIG topics
         status = result[0]
 
         if status == 0:
@@ -58,6 +96,75 @@ class MQTT:
         self.client.on_message = self.on_message
 
 
+    def start(self):                                                                            # Start receiving: the paho network thread and the decoder thread
+        self.decoderThread = threading.Thread(target=self.decodeLoop, daemon=True)              # Decodes messages queued by on_message()
+        self.decoderThread.start()
+        self.client.loop_start()
+
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+        self.closeDecoders()
+
+
+    def useDecoderProcesses(self, processes):
+        # Decode sample packets in this many processes instead of the decoder
+        # thread. Call once before start(), from the main module's
+        # "if __name__" block since the processes are started here
+        if (processes <= 0):
+            return
+
+        self.decoderPool = DecoderPool.DecoderPool(processes)
+        self.metrics.addGauge("decoderPending", self.decoderPool.pending)                       # Packets the decoder processes have not returned yet
+        self.collectorThread = threading.Thread(target=self.collectLoop, daemon=True)           # Handles the packets the decoder processes return
+        self.collectorThread.start()
+
+
+    def closeDecoders(self):                                                                    # Stop the decoder processes and the collector thread
+        pool = self.decoderPool
+        if (pool is None):
+            return
+
+        self.decoderPool = None                                                                 # Ends collectLoop()
+        self.collectorThread.join()
+        pool.close()
+
+        if (self.store is not None and self.store.shared and self.recorder is None):            # Free the shared sample arrays, unless the file is still being written
+            self.store.close()
+
+
+    def collectLoop(self):                                                                      # Runs on the collector thread when decoder processes are used
+        pool = self.decoderPool
+        while (self.decoderPool is pool):
+            try:
+                if (pool.collect(self.collectPlaced) == 0):
+                    time.sleep(DecoderPool.POLL_SECONDS)
+            except Exception as err:                                                            # Dont let one bad packet stop the collector thread
+                print("COLLECTOR ERROR:\t" + str(err))
+
+
+    def collectPlaced(self, sensor, first, count, stored, rxTime, decodeSeconds, store, plots):
+        # A decoder process wrote a packet placed by submitDecoder() into the
+        # shared store and plots, only the cursors are moved here
+        self.metrics.observe("decode", decodeSeconds)
+        self.metrics.count("samples", count)
+        if (store is not self.store):                                                           # Packet of the last data capture, its store is closed
+            return
+
+        if (stored < count):
+            print("SAMPLE STORE FULL\nDropped samples from " + sensor + ": " + str(count - stored))
+
+        store.advance(sensor, first + stored, count - stored)
+        self.handleStored(store.view(sensor)[first:first + stored], sensor, first, rxTime, plots)
+
+
+    def drainDecoders(self):                                                                    # Wait until every packet sent to the decoder processes was handled
+        end = time.time() + self.DRAIN_TIMEOUT
+        while (self.decoderPool is not None and self.decoderPool.pending() > 0 and time.time() < end):
+            time.sleep(DecoderPool.POLL_SECONDS)
+
+
     def getLocalIP(self):
         # Solution is a little weird but seems to work and socket library is multi-platform.
         # https://stackoverflow.com/questions/166506/finding-local-ip-addresses-using-pythons-stdlib
@@ -94,6 +201,9 @@ class MQTT:
 
 
     def sendPayload(self, deviceID, msg):                                                       # Publish a message to broker
+        if (self.readOnly):                                                                     # The recorder service talks to the sensors
+            return
+
         topic = deviceID + "/CONFIG/"
 
         result = self.client.publish(topic , msg, qos=2, retain=False)
@@ -105,129 +215,361 @@ class MQTT:
             print(f"Failed to send message to topic: " + topic)
 
   
-    def on_message(self, client, userData, message):
-        if ("CONFIG" in message.topic):
-            return                                                                              # Ignore messages sent by this device
-        
-        sensor = message.topic.split("/")                                                       # Gets the name of sensor that sent message
-        sensor = sensor[0]
+    # Runs on the paho network thread. Only queue the message so the network loop
+    # never waits on decoding, plotting, file writes, or the GUI
+    def on_message(self, client, userData, message):                                            # Messages from sensors that have not announced themselves yet
+        self.queueMessage(None, message)
 
-        keys = list(self.devices.keys())
-        
-        # No easy way to tell if data is UTF-8 unless you try to decode it. 
-        # So using try-except to tell if it is valid UTF-8
-        try:                                                                                    # If the time message was not sent decoding will raise excpetion
-            if ("TIME" == message.payload[0:4].decode('utf-8')):
-                t = ((message.payload[7] << 24) | (message.payload[6] << 16) |                  # Extract a unit32_t time value (RTC time)
-                     (message.payload[5] << 8)  | (message.payload[4]))
-                
-                self.top.startButton["state"] = NORMAL                                          # Allow start button to be pressed again
-                
-                self.deviceTime[sensor][0] = t                                                  # Save the RTC time and,
-                self.deviceTime[sensor][1] = time.time()                                        # Save the time we read the RTC time at
-                return                                                                          # If we read in the time, dont run the rest of code
-        except:                                                                  
-            pass                                                                                # If it was not the time message simply continue on
-        
-        # All config/setup messages aside from RTC time will be fully decodable in UTF-8
-        try:                                                                                    # If this fails it's the raw data not the config/setup messages
-            msg = message.payload.decode('utf-8')
-        except:
-            msg = ""                                                                            # If the message is not UTF-8 it is raw data so set to ""
+
+    def queueMessage(self, state, message):
+        self.messages.put((state, message.topic, message.payload, time.time()))                 # Save the receive time with the raw payload
+        self.metrics.count("messages")
+        self.metrics.count("bytes", len(message.payload))
+
+
+    def addRoute(self, state):
+        # Messages from a known sensor are passed to the decoder thread with its
+        # state, so they skip the topic lookup. paho calls the callback of the
+        # most specific match instead of on_message
+        self.client.message_callback_add(state.topic, lambda client, userData, message:
+                                         self.queueMessage(state, message))
+
+
+    def decodeLoop(self):                                                                       # Runs on the decoder thread, handles queued messages in order
+        while (True):
+            try:
+                state, topic, payload, rxTime = self.messages.get(timeout = self.METRICS_INTERVAL) # Blocks until the network thread queues a message
+            except queue.Empty:                                                                 # Nothing received, still update the stats pane
+                self.reportMetrics()
+                continue
+
+            self.handleQueued(state, topic, payload, rxTime)
+
+
+    def handleQueued(self, state, topic, payload, rxTime):                                      # Handle one message taken from the queue
+        self.metrics.observe("queueWait", time.time() - rxTime)                                 # Receive -> decode
+        start = time.perf_counter()
+
+        try:
+            if (state is None):
+                self.handleMessage(topic, payload, rxTime)
+            else:
+                self.dispatch(state, payload, rxTime)
+        except Exception as err:                                                                # Dont let one bad message stop the decoder
+            print("DECODER ERROR:\t" + str(err))
+
+        self.metrics.since("handleMessage", start)
+        self.reportMetrics()
+
+
+    def reportMetrics(self, force=False):                                                       # Take a metrics snapshot about once a second and show it in the GUI
+        now = time.time()
+        if (not force and now - self.metricsTime < self.METRICS_INTERVAL):
+            return
+
+        self.metricsTime = now
+        self.postUI("setMetrics", self.metrics.snapshot())
+
+
+    def postUI(self, name, *args):                                                              # Queue a call to a core application method
+        if (self.top is None):                                                                  # Nothing to update when running without a GUI
+            return
+
+        self.events.put((name, args))
+
+
+    def processEvents(self):                                                                    # Called from the Tk main loop to run the queued GUI updates
+        while (True):
+            try:
+                name, args = self.events.get_nowait()
+            except queue.Empty:
+                return
+
+            getattr(self.top, name)(*args)
+
+
+    def handleMessage(self, topic, payload, rxTime):                                            # Handle a message from any topic
+        state = self.sensors.lookup(topic)                                                      # Same cost for any number of sensors
+        if (state is None):
+            if (topic == self.STATUS_TOPIC):
+                self.handleStatus(payload)
+                return
+
+            state = self.announce(topic, payload)
+            if (state is None):                                                                 # Not a sensor, or a sensor that did not announce itself yet
+                return
+
+        self.dispatch(state, payload, rxTime)
+
+
+    def announce(self, topic, payload):                                                         # Add a sensor from its ping or RTC time, returns its state or None
+        if (topic.count("/") != 1 or not topic.endswith("/")):                                  # Only "<DEVICE_ID>/", e.g. not the CONFIG topics
+            return None
+
+        if (payload[0:4] != b"TIME" and payload[0:4] != b"ping"):
+            return None
+
+        return self.addSensor(topic)
+
+
+    def addSensor(self, topic):                                                                 # Register a sensor, route its messages, and show it in the GUI
+        state = self.sensors.lookup(topic)
+        if (state is None):
+            state = self.sensors.register(topic)
+            self.addRoute(state)
+            self.postUI("addSensor", state.name)
+
+        return state
+
+
+    def dispatch(self, state, payload, rxTime):
+        # Control messages are at most 8 bytes and are compared as bytes. The
+        # ADC values are 10-bit, so a short data packet can't look like one.
+        # Data packets are never decoded as text.
+        if (len(payload) <= self.CONTROL_BYTES):
+            if (payload[0:4] == b"TIME" and len(payload) == 8):
+                self.handleTime(state, payload, rxTime)
+                return
+
+            handler = self.controlHandlers.get(payload)
+            if (handler is not None):
+                handler(state)
+                return
+
+        if (state.waitingForStart):                                                             # If the wrong message is received; sometimes old pings come through
+            self.postUI("log", "Waiting for response..." + state.name)
             
-        # Ping is initiated by embedded device, pong is initiated by core application
-        if ("ping" in msg):                                                                     # If a ping was received, send a pong back
-            self.sendPayload(sensor, "pong")                                                    
-            self.checkConnectionResponse(keys, sensor)                                          # Update the connection status
-            return                                                                              
-        elif ("pong" in msg):                                                                   # If pong was received, update connection status 
-            self.checkConnectionResponse(keys, sensor)  
-            return     
+        elif (state.configWasSet):                                                              # If data capture is in progress
+            self.readRawData(payload, state.name, rxTime)
+
+
+    def handleTime(self, state, payload, rxTime):
+        t = ((payload[7] << 24) | (payload[6] << 16) |                                          # Extract a unit32_t time value (RTC time)
+             (payload[5] << 8)  | (payload[4]))
         
-        if (self.waitingForStart[sensor]):                                                      # If waiting for start, check messages for "START" / "FAIL"
-            self.checkConfigResponse(msg, sensor)
-            
-        elif (self.configWasSet[sensor]):                                                       # If data capture is in progress
-            if ("END" in msg):                                                                  # If end of data capture was reached
-                self.checkForEND(sensor, keys)     
-                return                                                                          # Dont try to decode data if it is the end of data capture                
-
-            self.readRawData(message, sensor)
-
-
-    def checkConnectionResponse(self, keys, sensor):
-        if (keys[0] in sensor):                                                                 # If sensor 1 responded set it as connected
-            self.top.device1Status.config(text="+")
-            self.devices[keys[0]] = 1
-        if (keys[1] in sensor):                                                                 # If sensor 2 respinded set it as connected
-            self.top.device2Status.config(text="+")
-            self.devices[keys[1]] = 1
-
-
-    def checkConfigResponse(self, msg, sensor):
-        if ("START" in msg):
-            self.waitingForStart[sensor] = False
-            self.configWasSet[sensor] = True                                                    # If start was received set flags to look for incoming raw data
-            self.top.serialOutput.insert("end", "Received the start signal from " +
-                                            sensor + "\n") 
-            self.top.serialOutput.yview('end')                                              
-        elif ("FAIL" in msg):                                                                   # If embedded device sends FAIL, reset and try again                              
-            self.waitingForStart[sensor] = False
-            self.configWasSet[sensor] = False
-            self.top.serialOutput.insert("end", "Received the failure signal from " + 
-                                            sensor + "\n") 
-            self.top.serialOutput.yview('end')  
-            self.top.setDataCaptureFlag(0)
-        else:                                                                                   # If the wrong message is received; sometimes old pings come through
-            self.top.serialOutput.insert("end", "Waiting for response..." + 
-                                            sensor + "\n") 
-            self.top.serialOutput.yview('end')  
-
-    def checkForEND(self, sensor, keys):                                                                
-        if (keys[0] in sensor):                                                                 # Check which sensor sent END
-            self.top.device1Status.config(text="-")
-            self.devices[keys[0]] = 0
-
-        if (keys[1] in sensor):
-            self.top.device2Status.config(text="-")
-            self.devices[keys[1]] = 0
-
-        self.top.serialOutput.insert("end", "Data Capture from " + 
-                                        sensor + " ended\n") 
-        self.top.serialOutput.yview('end') 
-
-        if (self.devices[keys[0]] == 1 or self.devices[keys[1]] == 1):                          # Do not stop the data capture until both sensors report "END"
+        self.postUI("enableStart")                                                              # Allow start button to be pressed again
+        
+        state.rtcTime = t                                                                       # Save the RTC time and,
+        state.rtcRxTime = rxTime                                                                # Save the time we received the RTC time at
+        self.checkConnectionResponse(state)                                                     # Devices send their time right before waiting for a configuration
+
+
+    # Ping is initiated by embedded device, pong is initiated by core application
+    def handlePing(self, state):                                                                # If a ping was received, send a pong back
+        self.sendPayload(state.name, "pong")                                                    
+        self.checkConnectionResponse(state)                                                     # Update the connection status
+
+
+    def handleEnd(self, state):
+        self.drainDecoders()                                                                    # The last packets of the sensor may still be decoding
+        if (state.configWasSet):                                                                # If end of data capture was reached
+            self.checkForEND(state)
+
+
+    def pingSensors(self, names=None):
+        # Same as "Connect to sensors": every sensor is shown as disconnected
+        # until it sends its RTC time again. Devices waiting for their first
+        # ping answer "ping", devices waiting for a configuration answer "pong"
+        states = self.sensors.all() if names is None else [self.addSensor(name + "/") for name in names]
+
+        for state in states:
+            state.connected = False
+            self.sendPayload(state.name, "ping")
+            self.sendPayload(state.name, "pong")
+
+        return states
+
+
+    def startTimes(self, states):                                                               # RTC time of each sensor a few seconds from now
+        # start time = (RTC time) + (time since reading RTC) + offset
+        return [int(state.rtcTime + (time.time() - state.rtcRxTime) + self.FORWARD_TIME_OFFSET)
+                for state in states]
+
+
+    def follow(self):                                                                           # Show the data captures of a RecorderService instead of running them
+        self.readOnly = True
+        self.client.subscribe(self.STATUS_TOPIC)
+
+
+    def handleStatus(self, payload):
+        # Status of a RecorderService, only received by a viewer. Prepare for
+        # the data capture it is configuring so "START" and the data of the
+        # sensors are handled like in a capture started from this application
+        try:
+            status = json.loads(payload)
+        except ValueError:
             return
 
-        self.configWasSet[sensor] = False                                                       # Reset for next data capture
-        self.top.captureData = False
-            
-        self.writeToFile()                                                                      # Write the data to the output file
-        self.top.dataCaptureLabel.config(bg = "red")
+        if (status.get("state") != "configuring" or                                             # Retained status of a service that stopped while configuring
+            time.time() - status.get("time", 0) > self.FORWARD_TIME_OFFSET):
+            return
+
+        config = status["config"]
+        for sensor in config["sensors"]:
+            self.sendConfiguration(config["trialTime"], config["fs"], config["channels"],
+                                   sensor, config["startTime"])
+
+        self.postUI("followCapture", config)
+
+
+    def checkConnectionResponse(self, state):                                                   # The sensor answered, show it as connected
+        state.connected = True
+        self.postUI("setSensorStatus", state.name, True)
+
+
+    def handleStart(self, state):
+        if (not state.waitingForStart):
+            return
+
+        state.waitingForStart = False
+        state.configWasSet = True                                                               # If start was received set flags to look for incoming raw data
+        self.postUI("log", "Received the start signal from " + state.name)
+
 
-        time.sleep(0.5)                                                                         # Allow some time in case animator is finishing up
-        for plot in self.top.plotFrames:                                                        # Stop all animators so plots can be manipulated manually  
-            plot["animator"].pause()
+    def handleFail(self, state):                                                                # If embedded device sends FAIL, reset and try again
+        if (not state.waitingForStart):
+            return
+
+        state.waitingForStart = False
+        state.configWasSet = False
+        self.sensors.endCapture(state.name)
+        self.postUI("log", "Received the failure signal from " + state.name)
+        self.postUI("setDataCaptureFlag", 0)
+
+
+    def checkForEND(self, state):                                                                
+        if (self.endSensor(state)):                                                             # Do not stop the data capture until every sensor reports "END"
+            self.writeToFile()                                                                  # Write the data to the output file
+            self.captureEnded()
+
+
+    def endSensor(self, state):                                                                 # Returns True once every sensor of the data capture has ended
+        state.connected = False                                                                 # The sensor pings again once it is ready for the next data capture
+        state.configWasSet = False                                                              # Reset for next data capture
+        self.postUI("setSensorStatus", state.name, False)
+        self.postUI("log", "Data Capture from " + state.name + " ended")
+
+        if (not self.sensors.endCapture(state.name)):
+            return False
+
+        for name in self.store.sensors():                                                       # Samples after the last packet received were lost, mark them missing
+            if (self.sequence.finish(name, self.store.expected) > 0):                           # so the file keeps every row of the other sensors
+                self.store.markMissing(name, self.store.expected)
+
+        return True
+
+
+    def captureEnded(self):                                                                     # Final loss stats of the data capture, once the file is saved
+        for name in self.store.sensors():
+            stats = self.sequence.summary(name)
+            self.postLinkStats(name, force = True)
+            self.postUI("log", name + ": %d samples lost in %d gaps, %d out of order packets, %d duplicate samples" % 
+                        (stats["lost"], stats["gaps"], stats["outOfOrder"], stats["duplicate"]))
+        self.postUI("captureEnded")                                                             # Stop the animators on the GUI thread once the file is saved
                             
         
 
-    def readRawData(self, message, sensor):
-        data = []
-    
-        # Extract timestamp and data values
-        for i in range(0, len(message.payload)-1, self.sampleBytes):
-            sample = self.unpack(message.payload[i:i+self.sampleBytes])
-            data.append(sample)                                                                 # "data" variable is passed to plotter function
+    def readRawData(self, payload, sensor, rxTime=None):
+        if (self.decoderPool is not None):                                                      # collectPlaced() is called once a decoder process is done
+            self.submitDecoder(payload, sensor, rxTime)
+            return
+
+        start = time.perf_counter()
+        data = SampleDecoder.decodePayload(payload, self.inputChannels)                         # (samples, 1+channels) array: [time, ch1, ch2, ch3]
+        self.metrics.since("decode", start)
+        self.metrics.count("samples", len(data))
+        self.handleDecoded(data, sensor, rxTime)
+
+
+    def submitDecoder(self, payload, sensor, rxTime):
+        # Place the packet from its first relative time and send it to a
+        # decoder process, which writes the samples into the shared store
+        counter, count = SampleDecoder.packetCounter(payload, self.inputChannels)
+        if (count == 0):
+            return
+
+        if (self.aligner is not None):                                                          # Relative time of the last sample of the packet
+            self.aligner.addPacket(sensor, ((counter + count - 1) % SequenceTracker.COUNTER_SIZE,), rxTime)
+
+        first = self.sequence.placeFirst(sensor, counter, count)
+        if (first is None):                                                                     # Packet from before this data capture, or a duplicate
+            return
 
-            self.samples[sensor]["time"].append(sample[0])                                      # self.samples stores data being saved to .csv file
+        plots = [None] * self.inputChannels                                                     # Plot of every channel, None if it has none
+        if (self.top is not None):
+            for ch in range(1, self.inputChannels + 1):
+                plotFrame = self.top.plotRoutes.get((sensor, ch))
+                plots[ch-1] = None if plotFrame is None else plotFrame["buffer"]
 
-            self.samples[sensor][1].append(sample[1])
-            if (self.inputChannels > 1):
-                self.samples[sensor][2].append(sample[2])
-            if (self.inputChannels > 2):
-                self.samples[sensor][3].append(sample[3])   
+        self.decoderPool.submit(sensor, payload, self.inputChannels, first, rxTime, self.store, plots)
 
-        self.plotData(data, sensor)
+
+    def handleDecoded(self, data, sensor, rxTime):                                              # Everything after decoding
+        if (self.aligner is not None):                                                          # Receive time of the packet is used to measure the sample rate
+            self.aligner.addPacket(sensor, data[:, 0], rxTime)
+
+        first = self.sequence.place(sensor, data[:, 0])                                         # Sample number of the first sample, found from the relative time
+        if (first is None):                                                                     # Packet from before this data capture, or a duplicate
+            return
+
+        if (self.store.put(sensor, first, data) < len(data)):                                   # self.store holds the data being saved to .csv file
+            print("SAMPLE STORE FULL\nDropped samples from " + sensor + ": " + 
+                  str(self.store.overflow[sensor]))
+
+        self.handleStored(data, sensor, first, rxTime)
+
+
+    def handleStored(self, data, sensor, first, rxTime, plots=None):
+        # Everything after the samples are in the store. plots are the plot
+        # buffers a decoder process already wrote, their length is only moved
+        recorder = self.recorder                                                                # writeToFile() can set it to None on another thread
+        if (recorder is not None):
+            self.updateRecorder(recorder)
+
+        for listener in self.sampleListeners:                                                   # Live analysis, e.g. env.EnvelopeStream
+            listener(sensor, data, first)
+
+        if (self.top is not None):                                                              # Only plot when running with the GUI
+            start = time.perf_counter()
+            if (plots is None):
+                self.plotData(data, sensor, first)                                              # "data" variable is passed to plotter function
+            else:
+                for plot in plots:
+                    if (plot is not None):
+                        plot.advance(first + len(data))
+            self.metrics.since("plotData", start)
+            self.plottedTime = rxTime                                                           # animate() measures receive -> plotted from this
+            self.postLinkStats(sensor)
+
+
+    def updateRecorder(self, recorder):                                                         # Write any rows that every sensor has now sent
+        start = time.perf_counter()
+        recorder.update()
+        self.metrics.since("recorder", start)
+
+
+    def postLinkStats(self, sensor, force=False):                                               # Show the loss rate and out of order packets of a sensor, at most every half second
+        now = time.time()
+        if (not force and now - self.linkStatsTime.get(sensor, 0) < self.LINK_STATS_INTERVAL):
+            return
+
+        self.linkStatsTime[sensor] = now
+        self.postUI("setLinkStats", sensor, self.sequence.summary(sensor))
+
+
+    def addSampleListener(self, listener):
+        # listener(sensor, samples, first) is called on the decoder thread with
+        # the (samples, 1+channels) ADC array of every packet, column 0 is the
+        # relative time. first is the sample number of samples[0] in the data
+        # capture: a first past the end of the last packet means samples were
+        # lost in between, a first before it is a late packet. Packets arrive
+        # in the order they were received, not in sample order. Keep it fast,
+        # the next packet waits for it to return
+        self.sampleListeners = self.sampleListeners + [listener]                                # New list so the decoder thread never sees it change while looping
+
+
+    def removeSampleListener(self, listener):
+        self.sampleListeners = [other for other in self.sampleListeners if other != listener]
 
 
     def unpack(self, bytes):                                                                    
@@ -243,13 +585,30 @@ class MQTT:
 
 
     def sendConfiguration(self, trialTime, fs, inputChannels, deviceID, startTime):             # Send configuration message to start data sampling
-        self.samples = {}
-
-        for key in self.top.sensorNames:                                                        # Iterate through connected sensors
-            self.samples[key] = {}
-            self.samples[key]["time"] = []
-            for i in range(int(inputChannels)):                                                 # Add a key and empty list for each channels
-                self.samples[key][i+1] = []
+        captureConfig = (int(trialTime), int(fs), int(inputChannels), startTime)
+
+        if (self.captureConfig != captureConfig):                                               # First sensor configured for this capture, allocate the sample arrays
+            previous = self.store
+            self.store = SampleStore.SampleStore(trialTime, fs, inputChannels,                  # Decoder processes write into shared memory arrays
+                                                 shared = self.decoderPool is not None)
+            self.sequence = SequenceTracker.SequenceTracker()
+            self.linkStatsTime = {}
+            self.captureConfig = captureConfig
+            self.sensors.newCapture()                                                           # Sensors of an unfinished data capture are not waited for
+
+            self.writeToFile()                                                                  # Finish the last file in case that data capture never ended
+            if (previous is not None and previous.shared):                                      # Free the shared memory of the last data capture
+                previous.close()
+            self.aligner = Alignment.Aligner(fs) if self.alignClocks else None
+            self.metrics.reset()
+
+            if (not self.readOnly):                                                             # The recorder service saves the file of a followed capture
+                self.recorder = Recorder.Recorder(self.outputFilename, self.store, startTime,   # Open the output file now so rows can be written during the capture
+                                                  aligner = self.aligner)
+                self.metrics.open(self.outputFilename + "_metrics.jsonl")                       # One JSON line per metrics snapshot of this capture
+
+        self.store.addSensor(deviceID)                                                          # Every configured sensor gets its own preallocated array
+        self.sequence.addSensor(deviceID)
 
         config  = str(trialTime)                                                                # Time in seconds
         config += "," + str(fs)                                                                 # Sample frequency
@@ -258,105 +617,41 @@ class MQTT:
         config += "," + str(startTime)                                                          # Send start time which is just device time with a few seconds added
         
         print(deviceID + "\t" + config)
+        self.addSensor(deviceID + "/")                                                          # Sensors are usually added by their ping, this covers a missed one
+        self.sensors.startCapture(deviceID)                                                     # Flag that tells on_message() to look for "START"/"FAIL", only this sensor
         self.sendPayload(deviceID, config)                                                      # Write configuration to micro
-        for key in list(self.devices.keys()):
-            self.waitingForStart[key] = True                                                    # Flag that tells on_message() to look for "START"/"FAIL"
 
         self.inputChannels = int(inputChannels)
         self.sampleBytes = 2 + (self.inputChannels * 2)
 
           
-    def plotData(self, data, sensor):                                                           # Plot data in embedded plots
-        index = 0                                                                               # Holds a calculated index that is used multiple times
-        sensorNum = 0
-        samplePeriod = 1.0 / self.top.dataFreq 
-        
-
-        for key in list(self.devices.keys()):                                                   # Conver the name of the sensor to the embedded plot column
-            sensorNum += self.devices[key]                                                      # Increment for every connected sensor
-            if key in sensor:                                                                   # When we find the sensor whos data we have, break 
-                break
-        
-        for sample in data:                                                                     # Iterate through all of the samples from the msg
-            # sample is [time, ch1, ch2, ch3]
-            
-            for ch in range(self.top.numChannels):                                              # Iterate through the channels used
+    def plotData(self, data, sensor, start):                                                    # Plot data in embedded plots, start is the sample number of the first sample
+        voltage = SampleDecoder.toVoltage(data[:, 1:])                                          # Convert raw ADC values to voltage for every channel at once
 
-                for i in range(len(self.top.plotFrames)):                                       # Look through all of the plotframes and find index of the correct plot
-                    if (self.top.plotFrames[i]["mask"] == (sensorNum-1, ch)):                   # Gets the position of the plot in the grid layout
-                        index = i
-                        break
-                
-                voltage = sample[ch+1] / 1023.0 * 3.3                                           # Convert raw ADC value to voltage 
-                self.top.plotFrames[index]["data"].append(voltage)                              # Add the voltage to the plot data
-                
-                if (len(self.top.plotFrames[index]["xAxis"]) == 0):                             # If the x-axis is empty 
-                    self.top.plotFrames[index]["xAxis"].append(0.0)                             # Append a 0
-                else:                                                                           # If it is not the first sample, caclulate the time value  
-                    self.top.plotFrames[index]["xAxis"].append(
-                        self.top.plotFrames[index]["xAxis"][-1]+samplePeriod)
-
-                if (voltage > 3.3):                                                             # This will happen if something went in data decoding wrong...
-                    print("BAD VOLTAGE PLOTTING\nValue: " + str(voltage))
+        for ch in range(1, data.shape[1]):                                                      # Iterate through the channels used, data is [time, ch1, ch2, ch3]
+            plotFrame = self.top.plotRoutes.get((sensor, ch))                                   # Look up the plot for this sensor and channel
+            if (plotFrame is None):                                                             # No plot was made for this sensor
+                continue
 
+            plotFrame["buffer"].put(start, voltage[:, ch-1])                                    # Add the whole packet to the plot data, x-axis is precomputed
 
-        if (self.configWasSet[sensor] == False):                                                # If the data capture has finished, stop the animator
-            time.sleep(0.3)                                                                     # Allow some time in case animator is finishing up
-            for plot in self.top.plotFrames:
-                plot["animator"].pause()
+        if (len(voltage) > 0 and voltage.max() > 3.3):                                          # This will happen if something went in data decoding wrong...
+            print("BAD VOLTAGE PLOTTING\nValue: " + str(voltage.max()))
 
 
-    def writeToFile(self):
-        filename = self.top.outputFilenameEntry.get() + ".csv"
+    def writeToFile(self):                                                                      # Finish the output file that was written during the data capture
+        with self.saveLock:                                                                     # Only one caller gets the recorder
+            recorder, self.recorder = self.recorder, None
 
-        with open(filename, mode="w", newline="") as file:
-            writer = csv.writer(file)
-            
-            row = []
-            for sensor in self.top.sensorNames:
-                row.append(sensor)                                                              # Make header with sensor name
-                for ch in self.samples[sensor]:                                                 # Append empty line for each channel
-                    if (str(ch) in "time"):
-                        continue
-                    row.append("")
-            
-            writer.writerow(row)
-            
-            row = []
-            num = 0
-            for sensor in self.top.sensorNames:
-                row.append("Time")                                                              # Make header with sensor time and channel names
-                num = 1
-                for ch in self.samples[sensor]:                                                 # Append channel name
-                    if (str(ch) in "time"):
-                        continue
-                    row.append("CH" + str(num))
-                    num += 1
-            
-            writer.writerow(row)
-            
-            
-            # In case there is a mismacth between the number of samples reported by each
-            # device, use the shorter length to make the lengths match
-            num_samples = []
-                                                             
-            for sensor in self.top.sensorNames:                                                 # Iterate through sensors that data was collected on
-                num_samples.append(len(self.samples[sensor]["time"]))                           # add the length of the time array to a list
-            length = min(num_samples)                                                           # Find the minimum length of data received by both sensors
-
-            if (length > (self.top.dataFreq * self.top.dataLen)):                               # If the data length is longer than it should be, truncate it
-                length = self.top.dataFreq * self.top.dataLen
-
-
-            for sensor in self.top.sensorNames:
-                self.samples[sensor]["time"] = [i / self.top.dataFreq 
-                                                for i in range(0, length)]                      # Calculate time based on sample number and capture frequency
+        if (recorder is None):                                                                  # Nothing to save if no data capture was configured, or already saved
+            return
 
-            for sample in range(length):                                                        # Iterate through overall number of samples
-                row = []
-                for sensor in self.top.sensorNames:                                             # Iterate through indvidual data points at same time value
-                    for ch in self.samples[sensor]:                                             # CH can be the channel number or "time" key
-                        row.append(self.samples[sensor][ch][sample])                            # Add the times and channel inputs to each row
+        start = time.perf_counter()
+        recorder.close()                                                                        # Writes the rows that are left and syncs the file to disk
+        self.metrics.since("writeToFile", start)
+        self.reportMetrics(force = True)                                                        # Last line of the metrics file
+        self.metrics.close()
 
-                writer.writerow(row)                                                            # write a single row to output csv
-                
+        if (self.aligner is not None):
+            for line in self.aligner.summary():                                                 # Show the measured sample rates and any lost samples
+                self.postUI("log", line)
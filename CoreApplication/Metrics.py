@@ -0,0 +1,161 @@
+################################################################################
+#   Title: Metrics.py
+#   Author: Zac Lynn
+#
+#   Description: This code counts what the core application does while a data
+#           capture is running so the slowest stage can be found. Counters
+#           (messages, bytes, samples) give rates per second, histograms give
+#           the time taken by each stage (queue wait, decode, plot, frame
+#           draw, file write) and the time from receiving a packet to drawing
+#           it. snapshot() is taken about once a second, it is shown in the
+#           stats pane of the GUI and saved as one JSON line in the metrics
+#           file of the data capture.
+#
+#   Notes: Data. Every method can be called from any thread.
+################################################################################
+import bisect                                                                                   # Finds the histogram bucket of a value
+import json
+import threading
+import time
+
+BUCKETS = [10 ** (exponent / 8) * 1e-6 for exponent in range(0, 57)]                            # Bucket upper edges from 1 us to 10 s, 8 per decade
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram:
+    # Counts of values in logarithmic buckets. Adding a value is a bisect and
+    # an increment, percentiles are the upper edge of the bucket they fall in.
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)                                                  # Last bucket holds values above 10 s
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+    def percentile(self, percent):
+        target = self.count * percent / 100.0
+        seen = 0
+        for num, count in enumerate(self.counts):
+            seen += count
+            if (seen >= target and count > 0):
+                return min(BUCKETS[num], self.max) if num < len(BUCKETS) else self.max
+
+        return 0.0
+
+
+    def summary(self):                                                                          # Milliseconds, rounded so the JSON lines stay short
+        stats = {"count": self.count,
+                 "mean": round(1e3 * self.total / self.count, 3) if self.count > 0 else 0.0,
+                 "max": round(1e3 * self.max, 3)}
+        for percent in PERCENTILES:
+            stats["p" + str(percent)] = round(1e3 * self.percentile(percent), 3)
+
+        return stats
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.gauges = {}                                                                        # Name -> function returning the current value, e.g. a queue size
+        self.file = None                                                                        # JSON lines file of the current data capture
+        self.reset()
+
+
+    def reset(self):                                                                            # Start counting again, e.g. for a new data capture
+        with self.lock:
+            self.counters = {}                                                                  # Name -> total since reset()
+            self.lastCounters = {}                                                              # Totals at the last snapshot, used for the rates
+            self.histograms = {}                                                                # Name -> Histogram since the last snapshot
+            self.startTime = time.time()
+            self.snapshotTime = self.startTime
+
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    def observe(self, name, seconds):                                                           # Add a duration to the histogram of a stage
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if (histogram is None):
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+
+    def since(self, name, start):                                                               # observe() the time since start (a time.perf_counter() value)
+        self.observe(name, time.perf_counter() - start)
+
+
+    def addGauge(self, name, function):
+        self.gauges[name] = function
+
+
+    def snapshot(self):
+        # Returns a dict with the counter totals, their rates per second and
+        # the latency histograms since the last snapshot, then starts new
+        # histograms. Also written to the metrics file if one is open.
+        now = time.time()
+        with self.lock:
+            interval = max(now - self.snapshotTime, 1e-9)
+            counters = dict(self.counters)
+            rates = {name: round((total - self.lastCounters.get(name, 0)) / interval, 2)
+                     for name, total in counters.items()}
+            histograms = self.histograms
+
+            self.lastCounters = counters
+            self.histograms = {}
+            self.snapshotTime = now
+
+        snapshot = {"time": round(now, 3), "elapsed": round(now - self.startTime, 3),
+                    "interval": round(interval, 3), "counters": counters, "rates": rates,
+                    "gauges": {name: function() for name, function in self.gauges.items()},
+                    "latency": {name: histogram.summary() for name, histogram in histograms.items()}}
+
+        self.write(snapshot)
+        return snapshot
+
+
+    def open(self, filename):                                                                   # Save every snapshot to a JSON lines file until close()
+        self.close()
+        self.file = open(filename, "w")
+
+
+    def write(self, snapshot):
+        with self.lock:
+            if (self.file is not None):
+                self.file.write(json.dumps(snapshot) + "\n")
+                self.file.flush()
+
+
+    def close(self):
+        with self.lock:
+            if (self.file is not None):
+                self.file.close()
+                self.file = None
+
+
+def formatSnapshot(snapshot):                                                                   # Short text for the stats pane of the GUI
+    rates = snapshot["rates"]
+    latency = snapshot["latency"]
+    gauges = snapshot["gauges"]
+
+    lines = ["%.0f msg/s  %.1f kB/s  %.0f samples/s  queue: %d" %
+             (rates.get("messages", 0), rates.get("bytes", 0) / 1e3, rates.get("samples", 0),
+              gauges.get("queue", 0))]
+
+    for name in sorted(latency):
+        stats = latency[name]
+        lines.append("%-14s p50 %7.2f  p95 %7.2f  max %7.2f ms" %
+                     (name, stats["p50"], stats["p95"], stats["max"]))
+
+    return "\n".join(lines)
@@ -0,0 +1,97 @@
+################################################################################
+#   Title: PlotBuffer.py
+#   Author: Zac Lynn
+#
+#   Description: This code implements the data buffer behind each embedded
+#           plot. The voltage values are appended a whole packet at a time
+#           into a preallocated array, and the x-axis is calculated once with
+#           arange() since every sample is one sample period apart.
+#
+#   Notes: Data
+################################################################################
+import numpy as np                                                                              # Used for the preallocated plot arrays
+
+import SharedBuffer                                                                             # Lets the analysis functions read the data without a copy
+
+
+class PlotBuffer:
+
+    def __init__(self, capacity, samplePeriod, shared=False, name=None):
+        # name attaches to the values of a shared plot buffer of another
+        # process, e.g. in a decoder process that writes the plot data
+        self.capacity = int(capacity)
+        self.samplePeriod = samplePeriod
+        self.length = 0                                                                         # Number of values that have been added
+        self.shm = None                                                                         # Shared memory block holding the voltage values, if shared
+        self.owner = name is None                                                               # Only the creating process removes the block
+
+        if (name is not None):
+            self.shm = SharedBuffer.attach(name)
+            self.data = np.ndarray((self.capacity,), dtype=np.float64, buffer=self.shm.buf)
+        elif (shared):                                                                          # Analysis functions can map the data without it being copied
+            self.shm = SharedBuffer.create(self.capacity * np.dtype(np.float64).itemsize)
+            self.data = np.ndarray((self.capacity,), dtype=np.float64, buffer=self.shm.buf)     # Voltage values
+            self.data[:] = 0
+        else:
+            self.data = np.zeros(self.capacity, dtype=np.float64)                               # Voltage values
+        self.xAxis = np.arange(self.capacity, dtype=np.float64) * samplePeriod                  # Time of each sample, sample n is at n * samplePeriod
+
+
+    def __len__(self):
+        return self.length
+
+
+    def extend(self, values):                                                                   # Append a block of voltage values, anything past capacity is dropped
+        start = self.length
+        count = min(len(values), self.capacity - start)
+
+        self.data[start:start+count] = values[:count]
+        self.length = start + count                                                             # Update the length last so readers never see unwritten values
+
+        return count
+
+
+    def put(self, start, values):
+        # Write a block of voltage values at sample start. Samples skipped
+        # before start are NaN so the line has a gap, a late block fills its
+        # gap in place.
+        end = min(start + len(values), self.capacity)
+        if (end <= start):
+            return 0
+
+        if (start > self.length):
+            self.data[self.length:start] = np.nan
+
+        self.data[start:end] = values[:end-start]
+        self.length = max(self.length, end)                                                     # Update the length last so readers never see unwritten values
+
+        return end - start
+
+
+    def advance(self, end):                                                                     # Values up to end were written by another process
+        self.length = max(self.length, min(end, self.capacity))
+
+
+    def x(self):                                                                                # Zero-copy view of the x-axis values that have data
+        return self.xAxis[:self.length]
+
+
+    def y(self):                                                                                # Zero-copy view of the voltage values
+        return self.data[:self.length]
+
+
+    def describe(self, fs, title):                                                              # Descriptor sent to analysis functions, None if not shared
+        if (self.shm is None):
+            return None
+
+        return SharedBuffer.describe(self.shm, self.data.dtype, self.length, fs, title)
+
+
+    def close(self):                                                                            # Free the shared memory once the plot is removed
+        if (self.shm is not None):
+            self.data = None                                                                    # Drop this view so the block can be closed
+            if (self.owner):
+                SharedBuffer.release(self.shm)
+            else:
+                SharedBuffer.detach(self.shm)
+            self.shm = None
@@ -0,0 +1,169 @@
+################################################################################
+#   Title: Plugins.py
+#   Author: Zac Lynn
+#
+#   Description: This code finds the custom analysis functions in
+#           customFunctions/ and runs them on the data of a plot. A plugin is a
+#           .py file that defines:
+#
+#               compute(signal, fs, meta) -> result
+#               render(result, fig, meta)           (optional)
+#
+#           signal is a read-only NumPy array of voltages, fs is the sample
+#           frequency, and meta is a dict with the plot "title", "sensor", and
+#           "channel". render() draws the result into a matplotlib Figure. These
+#           optional module level constants describe the plugin:
+#
+#               NAME    Toolbar button name             (file name)
+#               HINT    Hover hint and menu label       (NAME)
+#               ICON    Icon file name                  (NAME)
+#               MODE    "inprocess", "thread", "process"  ("process")
+#               ORDER   Position in the toolbar         (100)
+#
+#           MODE chooses where compute() runs:
+#               inprocess   On the GUI thread, fastest for cheap NumPy transforms
+#               thread      On a thread pool, keeps the GUI responsive
+#               process     In the AnalysisPool workers, for heavy or untrusted code
+#
+#   Notes: Plugin files are read with ast to find their constants, only files
+#           that run in this process are imported here
+################################################################################
+from concurrent.futures import ThreadPoolExecutor                                               # Used by the "thread" mode
+import ast                                                                                      # Used to read the plugin constants without running the file
+import os
+import queue
+import traceback
+import tkinter as tk
+
+from matplotlib.figure import Figure                                                            # Plugins run in this process render into a Tk window
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+import AnalysisPool                                                                             # Runs the "process" mode plugins
+
+MODES = ("inprocess", "thread", "process")
+DEFAULT_ORDER = 100
+
+
+class Plugin:
+
+    def __init__(self, script, info):
+        self.script = script                                                                    # File name in customFunctions/
+        self.name = info.get("NAME", os.path.splitext(script)[0])
+        self.hint = info.get("HINT", self.name)
+        self.icon = info.get("ICON", self.name)
+        self.mode = info.get("MODE", "process")
+        self.order = info.get("ORDER", DEFAULT_ORDER)
+
+        if (self.mode not in MODES):
+            raise ValueError(script + ": MODE must be one of " + ", ".join(MODES))
+
+
+def readInfo(path):
+    # Returns the constants of a plugin file, or None if the file does not
+    # define compute(). Only literal values are read, nothing is executed.
+    with open(path, "r") as file:
+        tree = ast.parse(file.read(), filename=path)
+
+    info = {}
+    functions = set()
+    for node in tree.body:
+        if (isinstance(node, ast.FunctionDef)):
+            functions.add(node.name)
+        elif (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)):
+            try:
+                info[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:                                                                  # Not a constant, can't be plugin information
+                pass
+
+    if ("compute" not in functions):                                                            # Helper modules like inputData.py are skipped
+        return None
+
+    return info
+
+
+def discover(directory=AnalysisPool.FUNCTIONS_DIR):                                             # Find every plugin, sorted in toolbar order
+    plugins = []
+    for script in os.listdir(directory):
+        if (not script.endswith(".py")):
+            continue
+
+        try:
+            info = readInfo(os.path.join(directory, script))
+            if (info is not None):
+                plugins.append(Plugin(script, info))
+        except Exception:                                                                       # A broken plugin should not stop the core application
+            traceback.print_exc()
+
+    plugins.sort(key=lambda plugin: (plugin.order, plugin.name))
+    return plugins
+
+
+class PluginRunner:
+
+    def __init__(self, master, pool, threads=2):
+        self.master = master                                                                    # Tk window that result windows are opened from
+        self.pool = pool                                                                        # AnalysisPool for "process" mode plugins
+        self.threads = ThreadPoolExecutor(threads, thread_name_prefix="plugin")
+        self.results = queue.SimpleQueue()                                                      # Finished "thread" mode jobs, rendered on the GUI thread
+        self.modules = {}                                                                       # Script name -> imported module
+        self.plugins = discover()
+
+
+    def module(self, plugin):
+        return AnalysisPool.loadFunction(self.modules, plugin.script)
+
+
+    def run(self, plugin, buffer, fs, meta):                                                    # Run a plugin on the data of a PlotBuffer
+        if (plugin.mode == "process"):
+            self.pool.submit(plugin.script, buffer, fs, meta)
+            return
+
+        signal = buffer.y().view()                                                              # Values up to the current length never change
+        signal.flags.writeable = False
+        module = self.module(plugin)
+
+        if (plugin.mode == "inprocess"):
+            try:
+                self.show(module, module.compute(signal, fs, meta), meta)
+            except Exception:
+                traceback.print_exc()
+        else:
+            future = self.threads.submit(module.compute, signal, fs, meta)
+            future.add_done_callback(lambda future: self.results.put((module, future, meta)))
+
+
+    def processResults(self):                                                                   # Show the results of finished "thread" jobs, call from the GUI thread
+        while (True):
+            try:
+                module, future, meta = self.results.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                self.show(module, future.result(), meta)
+            except Exception:
+                traceback.print_exc()
+
+
+    def show(self, module, result, meta):                                                       # Render a result in a new window
+        render = getattr(module, "render", None)
+        if (render is None):
+            print(meta["title"], result)
+            return
+
+        window = tk.Toplevel(self.master)
+        window.title(meta["title"])
+
+        fig = Figure(figsize = (6, 4), tight_layout = True)
+        canvas = FigureCanvasTkAgg(fig, master = window)
+        render(result, fig, meta)
+
+        canvas.draw()
+        toolbar = NavigationToolbar2Tk(canvas, window)
+        toolbar.update()
+        canvas.get_tk_widget().pack(expand=True, fill="both")
+
+
+    def close(self):
+        self.threads.shutdown(wait=False)
@@ -0,0 +1,131 @@
+################################################################################
+#   Title: Recorder.py
+#   Author: Zac Lynn
+#
+#   Description: This code writes the output .csv and .wda files while the data
+#           capture is running. The files are opened when the configuration is
+#           sent and rows are written in blocks as soon as every sensor has sent
+#           them, so at the end of the capture only the last few rows are left.
+#
+#           If an Alignment.Aligner is given the clock drift between sensors is
+#           corrected first, so the rows are only written at the end.
+#
+#   Notes: Data
+################################################################################
+import csv                                                                                      # Used to write the header rows
+import os                                                                                       # Used to make sure the file is on disk when the capture ends
+import threading                                                                                # Stop button and decoder thread can both finish the file
+import numpy as np                                                                              # Used to build and write blocks of rows
+
+import SampleStore                                                                              # MISSING marks samples that were never received
+import WDAFile                                                                                  # Binary copy of the recording
+
+
+class CSVWriter:                                                                                # Writes the .csv file in the layout used by the analysis scripts
+    NEWLINE = "\r\n"                                                                            # Same line ending the csv module uses
+
+    def __init__(self, filename):
+        self.filename = filename + ".csv"
+        self.file = open(self.filename, mode="w", newline="")
+        self.headerWritten = False                                                              # Header is written with the first rows, once every sensor was configured
+
+
+    def writeHeader(self, store):
+        sensors = store.sensors()
+        writer = csv.writer(self.file)
+
+        row = []
+        for sensor in sensors:
+            row.append(sensor)                                                                  # Make header with sensor name
+            row.extend([""] * store.inputChannels)                                              # Append empty line for each channel
+        writer.writerow(row)
+
+        row = []
+        for sensor in sensors:
+            row.append("Time")                                                                  # Make header with sensor time and channel names
+            row.extend(["CH" + str(ch+1) for ch in range(store.inputChannels)])
+        writer.writerow(row)
+
+        self.headerWritten = True
+
+
+    def write(self, store, start, end):                                                         # Write samples start to end-1 of every sensor
+        if (not self.headerWritten):
+            self.writeHeader(store)
+
+        if (end <= start):
+            return
+
+        sensors = store.sensors()
+        columns = store.columns
+        block = np.empty((end - start, len(sensors) * columns))
+
+        for num, sensor in enumerate(sensors):                                                  # Sensor groups are side by side: Time, CH1, ..., Time, CH1, ...
+            block[:, num * columns] = np.arange(start, end) / store.fs                          # Calculate time based on sample number and capture frequency
+            block[:, num * columns + 1:(num + 1) * columns] = store.view(sensor)[start:end, 1:]
+
+        block[block == SampleStore.MISSING] = np.nan                                            # Lost samples are saved as nan, time values can't reach 65535
+        fmt = "%.10g"                                                                           # Channels are whole numbers, so they are still written without decimals
+        np.savetxt(self.file, block, fmt=fmt, delimiter=",", newline=self.NEWLINE)
+
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+class Recorder:
+    CHUNK_SAMPLES = 1000                                                                        # Rows are written in blocks of this many samples
+    HOLD_SECONDS = 2.0                                                                          # Newest rows are kept back so late packets can still fill their gap
+
+    def __init__(self, filename, store, startTime=None, binary=True, aligner=None):
+        self.store = store                                                                      # SampleStore the rows are read from
+        self.aligner = aligner                                                                  # Alignment.Aligner, if set the rows are only written when the capture ends
+        self.written = 0                                                                        # Number of rows (samples) already in the files
+        self.lock = threading.Lock()
+        self.writers = [CSVWriter(filename)]
+
+        if (binary):                                                                            # Save the .wda file next to the .csv file
+            header = WDAFile.makeHeader(store.sensors(), store.inputChannels, store.fs,
+                                        startTime, store.trialTime)
+            self.writers.append(WDAFile.Writer(filename, header))
+
+
+    def available(self):                                                                        # Number of rows every sensor has sent so far
+        length = min([self.store.length(sensor) for sensor in self.store.sensors()])            # Use the shortest sensor so every row is complete
+        return min(length, self.store.expected)                                                 # Anything past the configured length is not saved
+
+
+    def writeRows(self, start, end):
+        for writer in self.writers:
+            writer.write(self.store, start, end)
+
+        self.written = max(self.written, end)
+
+
+    def update(self):                                                                           # Write every full block of rows that is ready
+        with self.lock:
+            if (self.writers is None or self.aligner is not None):                              # Sample rates are only known once every packet was received
+                return
+
+            end = self.available() - int(self.HOLD_SECONDS * self.store.fs)
+            end -= (end - self.written) % self.CHUNK_SAMPLES                                    # Only write whole blocks while the capture is running
+
+            if (end > self.written):
+                self.writeRows(self.written, end)
+
+
+    def close(self):                                                                            # Write the remaining rows and make sure the files are on disk
+        with self.lock:
+            if (self.writers is None):                                                          # Already closed
+                return
+
+            if (self.aligner is not None):                                                      # Save every sensor resampled onto the same timebase
+                self.store = self.aligner.align(self.store)
+
+            self.writeRows(self.written, self.available())
+
+            for writer in self.writers:
+                writer.close()
+            self.writers = None
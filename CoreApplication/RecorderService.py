@@ -0,0 +1,285 @@
+################################################################################
+#   Title: RecorderService.py
+#   Author: Zac Lynn
+#
+#   Description: Headless recorder that runs the data captures without the
+#           GUI, e.g. as a long running service on the lab server. It uses the
+#           same MQTT class as the core application, so the sensors are
+#           configured and the recordings are written to disk the same way.
+#           Trials are started by a command, or on a schedule of back to back
+#           trials given on the command line or in a command. The state of
+#           the service is published (retained) on recorder/status, and the
+#           GUI started with --viewer shows the data captures while they run.
+#
+#   Notes: Run from the CoreApplication folder with the broker running, e.g.
+#           python RecorderService.py --broker 127.0.0.1 --folder recordings
+#           Commands are JSON messages published on recorder/command:
+#           {"command": "start", "trialTime": 10, "fs": 1000, "channels": 2,
+#            "sensors": ["sensor1", "sensor2"], "output": "subject1",
+#            "count": 5, "interval": 30}
+#           Every field of "start" is optional, the command line values are
+#           used for the missing ones. {"command": "stop"} ends the current
+#           trial and cancels the schedule, {"command": "status"} publishes
+#           the status again, and {"command": "quit"} stops the service.
+################################################################################
+import argparse
+import json
+import os
+import queue
+import signal
+import time
+
+import AsyncMQTT
+import MQTT
+
+CONNECT_TIMEOUT = 10                                                                            # Seconds to wait for the sensors to send their RTC time
+START_TIMEOUT = 5                                                                               # Seconds to wait for "START" after the configuration
+END_TIMEOUT = 30                                                                                # Seconds after the trial time to wait for every END
+POLL_SECONDS = 0.05                                                                             # How often commands and the capture are checked while waiting
+CONFIG_FIELDS = ("trialTime", "fs", "channels", "sensors", "output", "count", "interval")
+
+
+class RecorderService:
+
+    def __init__(self, broker="127.0.0.1", port=1883, folder=".", defaults=None, mqttClass=MQTT.MQTT,
+                 decoders=0):
+        self.folder = folder                                                                    # Recordings and metrics files are saved here
+        self.defaults = dict(defaults or {})                                                    # Values used for the fields a "start" command leaves out
+        self.commands = queue.SimpleQueue()                                                     # Commands received on MQTT.COMMAND_TOPIC, handled by run()
+        self.running = True
+        self.cancelled = False                                                                  # "stop" was received, end the trial and the schedule
+        self.status = {"state": "idle"}
+        self.trials = 0                                                                         # Trials run since the service started, numbers the output files
+
+        os.makedirs(folder, exist_ok = True)
+        self.mqtt = mqttClass("Recorder", brokerIP = broker, port = port)                       # No GUI, the decoder does all of the work
+        self.mqtt.client.message_callback_add(MQTT.MQTT.COMMAND_TOPIC, self.on_command)
+        self.mqtt.client.subscribe(MQTT.MQTT.COMMAND_TOPIC, qos = 1)
+        self.mqtt.useDecoderProcesses(decoders)
+        self.mqtt.start()
+
+
+    def on_command(self, client, userData, message):                                            # Runs on the paho network thread, run() handles the command
+        try:
+            command = json.loads(message.payload)
+        except ValueError:
+            print("BAD COMMAND:\t" + str(message.payload))
+            return
+
+        if (isinstance(command, dict)):
+            self.commands.put(command)
+
+
+    def publishStatus(self, state=None, **info):                                                # Retained, so a viewer that connects later gets the last state
+        if (state is not None):                                                                 # Without a state the last status is published again
+            self.status = dict(info, state = state)
+            print(state + ("\t" + info["message"] if "message" in info else ""), flush = True)
+
+        self.status["time"] = round(time.time(), 3)
+        self.mqtt.client.publish(MQTT.MQTT.STATUS_TOPIC, json.dumps(self.status), qos = 1, retain = True)
+
+
+    def handleCommand(self, command):
+        # Commands that can be handled at any time. Returns the command if it
+        # has to be handled by run() (e.g. "start"), otherwise None
+        name = command.get("command")
+
+        if (name == "status"):
+            self.publishStatus()
+        elif (name == "stop"):
+            self.cancelled = True
+        elif (name == "quit"):
+            self.cancelled = True
+            self.running = False
+        elif (name == "start"):
+            return command
+        else:
+            print("UNKNOWN COMMAND:\t" + str(command))
+
+        return None
+
+
+    def poll(self, condition, timeout):
+        # Wait until condition() is true while handling commands, returns
+        # False on timeout or if the trial was stopped. A "start" received
+        # while busy is not queued, the schedule has to finish or be stopped
+        end = time.time() + timeout
+        while (time.time() < end):
+            if (condition()):
+                return True
+
+            try:
+                command = self.commands.get(timeout = POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+            if (self.handleCommand(command) is not None):
+                print("BUSY:\tIgnored " + str(command))
+
+            if (self.cancelled):
+                return False
+
+        return condition()
+
+
+    def connect(self, names):
+        # Same as "Connect to sensors" in the GUI. Returns the states of the
+        # sensors that sent their RTC time, or None if a named sensor did not
+        # answer. Without names every sensor that announced itself is used
+        if (not names):
+            self.poll(lambda: len(self.mqtt.sensors.all()) > 0, CONNECT_TIMEOUT)                # Sensors announce themselves with a ping every second
+
+        sent = time.time()
+        states = self.mqtt.pingSensors(names or None)
+
+        def answered(state):
+            return state.connected and state.rtcRxTime > sent
+
+        waiting = states
+        while (len(waiting) > 0 and time.time() < sent + CONNECT_TIMEOUT and not self.cancelled):
+            self.poll(lambda: all(answered(state) for state in waiting), 1.0)
+            waiting = [state for state in states if not answered(state)]
+            self.mqtt.pingSensors([state.name for state in waiting])                            # A sensor that is still starting up misses the first ping
+
+        if (len(waiting) > 0 and names):
+            return None
+
+        states = [state for state in states if answered(state)]
+        return states if len(states) > 0 else None
+
+
+    def runTrial(self, config, number, count):
+        # Configure the sensors, wait for every END, and return the result that
+        # is published with the status
+        states = self.connect(config["sensors"])
+        if (states is None):
+            return {"error": "sensors did not connect"}
+
+        startTimes = self.mqtt.startTimes(states)
+        if (max(startTimes) - min(startTimes) > self.mqtt.FORWARD_TIME_OFFSET):                 # Same check as startDataCapture()
+            return {"error": "RTC times are off, synchronize the sensors"}
+
+        output = "%s_%03d" % (config["output"], number)
+        self.mqtt.outputFilename = os.path.join(self.folder, output)
+        capture = {"trialTime": int(config["trialTime"]), "fs": int(config["fs"]),
+                   "channels": int(config["channels"]), "sensors": [state.name for state in states],
+                   "startTime": max(startTimes), "output": output}
+
+        self.publishStatus("configuring", trial = number, trials = count, config = capture)     # Before the configuration so a viewer is ready for START
+        for state in states:
+            self.mqtt.sendConfiguration(capture["trialTime"], capture["fs"], capture["channels"],
+                                        state.name, capture["startTime"])
+
+        started = self.poll(lambda: any(state.configWasSet for state in states), START_TIMEOUT)
+        if (started):
+            self.publishStatus("capturing", trial = number, trials = count, config = capture)
+            done = self.poll(lambda: self.mqtt.recorder is None,
+                             self.mqtt.FORWARD_TIME_OFFSET + capture["trialTime"] + END_TIMEOUT)
+        else:
+            done = False
+
+        if (not done):                                                                          # Stopped, or a sensor never sent START or END, save what was received
+            for state in states:
+                state.configWasSet = False
+            self.mqtt.writeToFile()
+
+        result = {"file": self.mqtt.outputFilename + ".csv", "done": done,
+                  "lost": {name: self.mqtt.sequence.summary(name)["lost"] for name in capture["sensors"]}}
+        if (not started):
+            result["error"] = "sensors did not start"
+        elif (not done):
+            result["error"] = "stopped" if self.cancelled else "not every sensor sent END"
+
+        return result
+
+
+    def runSchedule(self, command):
+        # Run "count" trials, "interval" seconds apart (start to start), with
+        # the command values or the defaults
+        config = {field: command.get(field, self.defaults.get(field)) for field in CONFIG_FIELDS}
+        count = max(int(config["count"] or 1), 1)
+        interval = float(config["interval"] or 0)
+        self.cancelled = False
+
+        for num in range(count):
+            trialStart = time.time()
+            self.trials += 1
+            result = self.runTrial(config, self.trials, count)
+            self.publishStatus("saved" if "error" not in result else "failed", trial = self.trials,
+                               trials = count, result = result,
+                               message = result.get("error", result["file"]))
+
+            if (self.cancelled or num == count - 1):
+                break
+
+            wait = trialStart + interval - time.time()
+            if (wait > 0):
+                self.publishStatus("waiting", trial = self.trials, trials = count,
+                                   message = "next trial in %.0f s" % wait)
+                self.poll(lambda: False, wait)
+
+            if (self.cancelled):                                                                # Stopped between trials
+                break
+
+        self.publishStatus("idle")
+
+
+    def run(self, schedule=None):                                                               # Handle commands until "quit", schedule is run first if given
+        if (schedule is not None):
+            self.runSchedule(schedule)
+        else:
+            self.publishStatus("idle")
+
+        while (self.running):
+            try:
+                command = self.commands.get(timeout = 1.0)
+            except queue.Empty:
+                continue
+
+            command = self.handleCommand(command)
+            if (command is not None):
+                self.runSchedule(command)
+
+
+    def close(self):
+        self.mqtt.writeToFile()                                                                 # Save a trial that was still running
+        self.publishStatus("offline")
+        self.mqtt.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Headless EMG recorder controlled over MQTT.")
+    parser.add_argument("--broker", default = "127.0.0.1", help = "broker IP address")
+    parser.add_argument("--port", type = int, default = 1883, help = "broker port")
+    parser.add_argument("--folder", default = "recordings", help = "folder the recordings are saved in")
+    parser.add_argument("--time", type = int, default = 5, help = "default length of a data capture in seconds")
+    parser.add_argument("--fs", type = int, default = 1000, help = "default sample frequency")
+    parser.add_argument("--channels", type = int, default = 1, help = "default number of channels")
+    parser.add_argument("--sensors", nargs = "+", default = None, help = "default sensors, every sensor that answers if not given")
+    parser.add_argument("--output", default = "trial", help = "default name of the output files, the trial number is added")
+    parser.add_argument("--trials", type = int, default = 0, help = "run this many trials at start up")
+    parser.add_argument("--interval", type = float, default = 0, help = "seconds from the start of one trial to the next")
+    parser.add_argument("--asyncio", action = "store_true", help = "receive with AsyncMQTT instead of the paho thread")
+    parser.add_argument("--decoders", type = int, default = 0, help = "decode the sample packets in this many processes")
+    parser.add_argument("--exit", action = "store_true", help = "stop once the --trials are done instead of waiting for commands")
+    args = parser.parse_args()
+
+    defaults = {"trialTime": args.time, "fs": args.fs, "channels": args.channels, "sensors": args.sensors,
+                "output": args.output, "count": 1, "interval": args.interval}
+    service = RecorderService(args.broker, args.port, args.folder, defaults,
+                              AsyncMQTT.AsyncMQTT if args.asyncio else MQTT.MQTT, args.decoders)
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.commands.put({"command": "quit"}))
+
+    if (args.exit):
+        service.running = False
+
+    try:
+        service.run(dict(defaults, command = "start", count = args.trials) if args.trials > 0 else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+################################################################################
+#   Title: SampleDecoder.py
+#   Author: Zac Lynn
+#
+#   Description: This code decodes the raw sample packets sent by the embedded
+#           devices. Each sample is a big-endian 16-bit relative time followed
+#           by one big-endian 16-bit ADC value per channel, so a whole packet
+#           can be viewed as a 2D array of unsigned 16-bit integers.
+#
+#   Notes: Data
+################################################################################
+import numpy as np                                                                              # Used to view the payload bytes as an array without a Python loop
+
+
+SAMPLE_DTYPE = np.dtype(">u2")                                                                  # Embedded devices send every field as a big-endian uint16
+
+
+def sampleBytes(inputChannels):                                                                 # Number of bytes used by a single sample
+    return 2 + (int(inputChannels) * 2)
+
+
+def decodePayload(payload, inputChannels):
+    # Returns a (numSamples, 1 + inputChannels) array where column 0 is the
+    # relative time and columns 1..N are the channels. Any trailing bytes that
+    # do not make up a whole sample are ignored.
+    columns = 1 + int(inputChannels)
+    numSamples = len(payload) // (columns * SAMPLE_DTYPE.itemsize)                              # Whole samples in the packet, drops an odd trailing byte
+
+    data = np.frombuffer(payload, dtype=SAMPLE_DTYPE,                                           # View the bytes directly, no per-sample slicing
+                         count=numSamples * columns)
+
+    return data.reshape(numSamples, columns).astype(np.uint16)                                  # Convert to native byte order for the rest of the app
+
+
+def packetCounter(payload, inputChannels):
+    # Returns (relative time of the first sample, number of samples) of a
+    # packet without decoding it
+    numSamples = len(payload) // sampleBytes(inputChannels)
+    if (numSamples == 0):
+        return 0, 0
+
+    return (payload[0] << 8) | payload[1], numSamples                                           # Relative time is the first big-endian field
+
+
+def toVoltage(raw):                                                                             # Convert raw 10-bit ADC values to voltage
+    return raw / 1023.0 * 3.3
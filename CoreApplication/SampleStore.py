@@ -0,0 +1,137 @@
+################################################################################
+#   Title: SampleStore.py
+#   Author: Zac Lynn
+#
+#   Description: This code implements the storage for the samples received
+#           during a data capture. The trial length, sample frequency, and
+#           number of channels are known when the configuration is sent, so one
+#           array per sensor is allocated up front and filled using a write
+#           cursor instead of growing Python lists one value at a time.
+#
+#           With decoder processes the arrays are in shared memory. Each
+#           process attaches to the arrays of its sensors and writes the
+#           packets into them, the core application only moves the cursor with
+#           advance() once a packet was written.
+#
+#   Notes: Data
+################################################################################
+import numpy as np                                                                              # Used for the preallocated sample arrays
+
+import SharedBuffer                                                                             # Sample arrays the decoder processes can write
+
+
+MISSING = 0xFFFF                                                                                # Channel value of samples that were never received, the ADC is 10-bit
+
+
+class SampleStore:
+    SPARE_SAMPLES = 250                                                                         # Extra room for one packet in case a device sends a little more than expected
+
+    def __init__(self, trialTime, fs, inputChannels, shared=False):
+        self.trialTime = int(trialTime)
+        self.fs = int(fs)
+        self.inputChannels = int(inputChannels)
+        self.columns = 1 + self.inputChannels                                                   # Relative time followed by one column per channel
+        self.expected = self.trialTime * self.fs                                                # Number of samples each sensor should send
+        self.capacity = self.expected + self.SPARE_SAMPLES
+
+        self.buffers = {}                                                                       # Sensor name -> (capacity, columns) uint16 array
+        self.cursors = {}                                                                       # Sensor name -> number of samples written
+        self.overflow = {}                                                                      # Sensor name -> number of samples that did not fit
+        self.shared = shared                                                                    # Arrays are created in shared memory
+        self.shms = {}                                                                          # Sensor name -> shared memory block, if shared or attached
+
+
+    def addSensor(self, sensor, name=None):
+        # name attaches to the array of a sensor in a store of another process
+        if (sensor in self.buffers):                                                            # Sensor was already added for this capture
+            return
+
+        shape = (self.capacity, self.columns)
+        if (name is not None):
+            self.shms[sensor] = SharedBuffer.attach(name)
+            self.buffers[sensor] = np.ndarray(shape, dtype=np.uint16, buffer=self.shms[sensor].buf)
+        elif (self.shared):
+            self.shms[sensor] = SharedBuffer.create(shape[0] * shape[1] * np.dtype(np.uint16).itemsize)
+            self.buffers[sensor] = np.ndarray(shape, dtype=np.uint16, buffer=self.shms[sensor].buf)
+            self.buffers[sensor][:] = 0
+        else:
+            self.buffers[sensor] = np.zeros(shape, dtype=np.uint16)
+        self.cursors[sensor] = 0
+        self.overflow[sensor] = 0
+
+
+    def sensors(self):                                                                          # Sensor names in the order they were added
+        return list(self.buffers.keys())
+
+
+    def append(self, sensor, block):                                                            # Copy a decoded (samples, columns) block to the end of the sensor array
+        return self.put(sensor, self.cursors[sensor], block)
+
+
+    def put(self, sensor, start, block):
+        # Copy a decoded (samples, columns) block to rows start onwards. Rows
+        # skipped between the old end and start are marked MISSING, a block
+        # that arrives late is written back into its place.
+        buffer = self.buffers[sensor]
+        cursor = self.cursors[sensor]
+        count = max(min(len(block), self.capacity - start), 0)                                  # Only copy what still fits
+
+        if (start > cursor):                                                                    # Gap, keep the time column counting so rows stay in order
+            gap = min(start, self.capacity)
+            buffer[cursor:gap, 0] = np.arange(cursor, gap) % 65536
+            buffer[cursor:gap, 1:] = MISSING
+
+        buffer[start:start+count] = block[:count]
+        self.cursors[sensor] = max(cursor, start + count)
+
+        if (count < len(block)):                                                                # Keep track of samples that were dropped because the array is full
+            self.overflow[sensor] += len(block) - count
+
+        return count
+
+
+    def markMissing(self, sensor, end):                                                         # Mark the rows from the last sample received up to end as MISSING
+        return self.put(sensor, end, self.buffers[sensor][:0])
+
+
+    def advance(self, sensor, end, dropped=0):
+        # Rows up to end were written by a decoder process, dropped samples of
+        # the packet did not fit
+        self.cursors[sensor] = max(self.cursors[sensor], min(end, self.capacity))
+        self.overflow[sensor] += dropped
+
+
+    def length(self, sensor):
+        return self.cursors[sensor]
+
+
+    def view(self, sensor):                                                                     # Zero-copy view of the samples received so far
+        return self.buffers[sensor][:self.cursors[sensor]]
+
+
+    def time(self, sensor):                                                                     # Zero-copy view of the device relative time column
+        return self.buffers[sensor][:self.cursors[sensor], 0]
+
+
+    def channel(self, sensor, ch):                                                              # Zero-copy view of a single channel, ch starts at 1
+        return self.buffers[sensor][:self.cursors[sensor], ch]
+
+
+    def nbytes(self):                                                                           # Memory used by all of the sample arrays
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+    def name(self, sensor):                                                                     # Name of the shared memory block of a sensor, None if it is not shared
+        shm = self.shms.get(sensor)
+        return None if shm is None else shm.name
+
+
+    def close(self):                                                                            # Free the shared memory blocks, the store can't be used after this
+        for sensor, shm in self.shms.items():
+            del self.buffers[sensor]                                                            # Views must go before the block can be closed
+            if (self.shared):
+                SharedBuffer.release(shm)
+            else:
+                SharedBuffer.detach(shm)
+
+        self.shms = {}
@@ -0,0 +1,84 @@
+################################################################################
+#   Title: SensorRegistry.py
+#   Author: Zac Lynn
+#
+#   Description: This code keeps track of the sensors connected to the
+#           broker. A sensor is added the first time it announces itself
+#           (its "ping" or its RTC time), so any number of devices can be used
+#           without changing the code. Messages are routed with a dictionary
+#           from the topic a device publishes on to its state, so handling a
+#           message takes the same time for 2 sensors as for 16.
+#
+#   Notes: Communication. Device IDs are set by DEVICE_ID in the firmware,
+#           every device publishes on "<DEVICE_ID>/".
+################################################################################
+
+
+class SensorState:                                                                              # Everything the MQTT class knows about one device
+
+    def __init__(self, name, topic):
+        self.name = name                                                                        # Device ID, e.g. "sensor1"
+        self.topic = topic                                                                      # Topic the device publishes on
+        self.connected = False                                                                  # True after the device answered a ping
+        self.waitingForStart = False                                                            # Configuration sent, waiting for "START" / "FAIL"
+        self.configWasSet = False                                                               # True while the device is sending data
+        self.rtcTime = 0                                                                        # Last RTC time the device sent,
+        self.rtcRxTime = 0                                                                      # and the local time it was received at
+
+
+class SensorRegistry:
+
+    def __init__(self):
+        self.sensors = {}                                                                       # Device ID -> SensorState, in the order they announced themselves
+        self.topics = {}                                                                        # Publish topic -> SensorState
+        self.active = set()                                                                     # Device IDs configured for the current data capture that did not send END yet
+
+
+    def lookup(self, topic):                                                                    # SensorState of the device publishing on topic, or None
+        return self.topics.get(topic)
+
+
+    def register(self, topic):                                                                  # Add the device publishing on topic, returns its state
+        state = self.topics.get(topic)
+        if (state is None):
+            name = topic.split("/")[0]
+            state = self.sensors.get(name)
+
+            if (state is None):
+                state = SensorState(name, topic)
+                self.sensors[name] = state
+
+            self.topics[topic] = state
+
+        return state
+
+
+    def get(self, name):
+        return self.sensors.get(name)
+
+
+    def names(self):
+        return list(self.sensors.keys())
+
+
+    def all(self):                                                                              # Copy, the decoder thread can add sensors while the GUI loops
+        return list(self.sensors.values())
+
+
+    def connected(self):
+        return [state for state in self.all() if state.connected]
+
+
+    def newCapture(self):                                                                       # Forget the sensors of a data capture that never finished
+        self.active = set()
+
+
+    def startCapture(self, name):                                                               # Configuration was sent to this device
+        state = self.sensors[name]
+        state.waitingForStart = True
+        self.active.add(name)
+
+
+    def endCapture(self, name):                                                                 # Device sent END or FAIL, returns True once no device is still capturing
+        self.active.discard(name)
+        return len(self.active) == 0
@@ -0,0 +1,302 @@
+################################################################################
+#   Title: SensorSimulator.py
+#   Author: Zac Lynn
+#
+#   Description: Simulates the EMG devices so the core application can be run
+#           without the Teensy and WizFi360 hardware. Every simulated sensor
+#           follows the same MQTT protocol as TeensyWiFi/src/main.cpp:
+#
+#           1. Publish "ping" every second until the core application sends
+#              "ping", then publish the RTC time ("TIME" + little-endian
+#              uint32 seconds).
+#           2. Wait for "trialTime,fs,channels,startTime" on <name>/CONFIG/.
+#              "pong" is answered with "pong" and the RTC time. A valid
+#              configuration is answered with "START", a bad one with "FAIL".
+#           3. Once the RTC passes startTime, take fs samples per second for
+#              trialTime seconds and publish them in packets of up to 250
+#              samples: big-endian uint16 relative time + one big-endian
+#              uint16 10-bit ADC value per channel.
+#           4. Send what is left in the buffer, publish "END", go back to 1.
+#
+#   Notes: Run from the CoreApplication folder with the broker running, e.g.
+#           python SensorSimulator.py --sensors 2 --broker 127.0.0.1
+#           The GUI connects to the broker IP set in CoreApplication.py.
+################################################################################
+from collections import deque
+import argparse
+import queue
+import struct
+import threading
+import time
+import numpy as np
+
+from paho.mqtt import client as mqtt_client
+
+SAMPLES = 250                                                                                   # Samples per packet, SAMPLES in main.cpp
+BUFFER_SAMPLES = 45000                                                                          # Size of the dataBuffer, new samples are dropped when it is full
+SMALL_PACKET_BYTES = 400                                                                        # Smaller packets are followed by a 25 ms delay, like sendDataToServer()
+MIN_FS = 1000                                                                                   # Configuration limits of MQTT::waitForStart()
+MAX_FS = 2000                                                                                   # MAX_SAMPLE_FREQ
+MAX_LEN = 30
+MAX_CHANNELS = 3
+SIGNAL_HZ = 40                                                                                  # Frequency of the simulated test signal
+
+
+def atoi(text):                                                                                 # C atoi(): leading integer of the text, 0 if there is none
+    digits = ""
+    for char in text.strip():
+        if (char.isdigit() or (char in "+-" and digits == "")):
+            digits += char
+        else:
+            break
+
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+
+def parseConfig(msg):
+    # (trialTime, fs, channels, startTime) from a configuration message, or
+    # None if it does not have four comma separated fields (e.g. "ping")
+    fields = msg.split(",")
+    if (len(fields) < 4):
+        return None
+
+    return tuple(atoi(field) for field in fields[:4])
+
+
+def makeSignal(kind, start, end, fs, channels, rng):
+    # 10-bit ADC values of samples start...end, the test signal is the same on
+    # every sensor so the recordings can be compared with CheckTimeSynch.py
+    t = np.arange(start, end) / fs
+    phase = 2 * np.pi * SIGNAL_HZ * t[:, None] + np.arange(channels) * np.pi / 6                # Each channel is shifted a little
+
+    if (kind == "square"):
+        values = 512 + 300 * np.sign(np.sin(phase))
+    elif (kind == "noise"):
+        values = 512 + rng.normal(0, 100, (len(t), channels))
+    else:
+        values = 512 + 300 * np.sin(phase) + rng.normal(0, 10, (len(t), channels))
+
+    return np.clip(np.rint(values), 0, 1023).astype(np.uint16)
+
+
+class SimulatedSensor:
+
+    def __init__(self, name, broker="127.0.0.1", port=1883, rtcTime=0, driftPPM=0.0,
+                 signal="sine", loss=0.0, maxFs=MAX_FS, seed=None):
+        self.name = name
+        self.rtcZero = time.time() - rtcTime                                                    # Wall clock time the RTC read 0
+        self.clockRate = 1.0 + driftPPM * 1e-6                                                  # Sample clock of this device compared to the PC
+        self.signal = signal
+        self.loss = loss                                                                        # Fraction of data packets that are not published
+        self.maxFs = maxFs
+        self.rng = np.random.default_rng(seed)
+
+        self.inbox = queue.SimpleQueue()                                                        # Messages received on <name>/CONFIG/
+        self.running = True
+        self.stats = {"captures": 0, "packets": 0, "dropped": 0, "lost": 0}
+
+        self.client = mqtt_client.Client(name)
+        self.client.on_message = lambda client, userData, message: self.inbox.put(
+            message.payload.decode("utf-8", errors="replace"))
+        self.client.connect(broker, port)
+        self.client.subscribe(name + "/CONFIG/")
+        self.client.loop_start()
+
+
+    def rtcSecs(self):
+        return int(time.time() - self.rtcZero)
+
+
+    def publish(self, payload):
+        self.client.publish(self.name + "/", payload, qos=0)
+
+
+    def sendTime(self):
+        self.publish(b"TIME" + struct.pack("<I", self.rtcSecs()))
+
+
+    def read(self, timeout):                                                                    # Next message sent to this sensor, or None
+        try:
+            return self.inbox.get(timeout = timeout)
+        except queue.Empty:
+            return None
+
+
+    def pingServer(self):                                                                       # Ping until the core application pings back
+        while (self.running):
+            time.sleep(1.0)
+            self.publish(b"ping")
+            time.sleep(0.25)
+
+            msg = self.read(0)
+            while (msg is not None):
+                if (msg.startswith("ping")):
+                    self.sendTime()
+                    return True
+                msg = self.read(0)
+
+        return False
+
+
+    def waitForStart(self):                                                                     # Returns (trialTime, fs, channels, startTime) of a valid configuration
+        while (self.running):
+            msg = self.read(0.1)
+            if (msg is None):
+                continue
+
+            if (msg.startswith("pong")):
+                self.publish(b"pong")
+                self.sendTime()
+
+            config = parseConfig(msg)
+            if (config is None):
+                continue
+
+            trialTime, fs, channels, startTime = config
+            if (fs < MIN_FS or fs > self.maxFs or trialTime < 1 or trialTime > MAX_LEN or
+                channels < 1 or channels > MAX_CHANNELS):
+                self.publish(b"FAIL")
+                continue
+
+            self.publish(b"START")
+            return config
+
+        return None
+
+
+    def capture(self, trialTime, fs, channels, startTime):
+        # Take samples on the simulated sample clock and publish them as the
+        # firmware does: packets of up to 250 samples, a short delay whenever
+        # the buffer was almost empty, and the rest of the buffer after the end
+        while (self.running and self.rtcSecs() <= startTime):                                   # Delay until start time
+            time.sleep(0.001)
+
+        total = int(trialTime * fs)
+        columns = 1 + channels
+        t0 = time.time()
+        taken = 0                                                                               # Samples taken, relativeTime in main.cpp
+        pending = deque()                                                                       # Sample arrays not published yet, oldest first
+        buffered = 0
+
+        while (self.running):
+            due = min(int((time.time() - t0) * fs * self.clockRate), total)
+            if (due > taken):
+                block = np.empty((due - taken, columns), dtype=np.uint16)
+                block[:, 0] = np.arange(taken, due) % 65536                                     # uint16 relative time wraps
+                block[:, 1:] = makeSignal(self.signal, taken, due, fs, channels, self.rng)
+
+                room = max(BUFFER_SAMPLES - buffered, 0)                                        # dataBuffer::push() fails while the buffer is full
+                self.stats["dropped"] += max(len(block) - room, 0)
+                if (room > 0):
+                    pending.append(block[:room])
+                    buffered += min(len(block), room)
+                taken = due
+
+            if (buffered == 0):
+                if (taken == total):                                                            # Sampling ended and the buffer is empty
+                    break
+                time.sleep(0.025)
+                continue
+
+            packet = self.pop(pending, SAMPLES)
+            buffered -= len(packet)
+
+            if (self.rng.random() >= self.loss):
+                self.publish(packet.astype(">u2").tobytes())                                    # Big-endian, like dataBuffer::toString()
+                self.stats["packets"] += 1
+            else:
+                self.stats["lost"] += len(packet)
+
+            if (packet.nbytes < SMALL_PACKET_BYTES):
+                time.sleep(0.025)
+
+        self.publish(b"END")
+        self.stats["captures"] += 1
+
+
+    def pop(self, pending, count):                                                              # Up to count of the oldest samples, dataBuffer::pop()
+        parts = []
+        while (count > 0 and len(pending) > 0):
+            part = pending[0][:count]
+            if (len(part) == len(pending[0])):
+                pending.popleft()
+            else:
+                pending[0] = pending[0][count:]
+
+            parts.append(part)
+            count -= len(part)
+
+        return np.concatenate(parts)
+
+
+    def run(self):                                                                              # Program flow of main.cpp, until stop() is called
+        if (not self.pingServer()):
+            return
+        self.sendTime()
+
+        while (self.running):
+            config = self.waitForStart()
+            if (config is None):
+                return
+
+            self.capture(*config)
+            if (not self.pingServer()):
+                return
+            self.sendTime()
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Simulate EMG sensors on an MQTT broker.")
+    parser.add_argument("--sensors", type = int, default = 2, help = "number of sensors, named sensor1, sensor2, ...")
+    parser.add_argument("--broker", default = "127.0.0.1", help = "broker IP address")
+    parser.add_argument("--port", type = int, default = 1883, help = "broker port")
+    parser.add_argument("--signal", choices = ["sine", "square", "noise"], default = "sine",
+                        help = "test signal on every channel")
+    parser.add_argument("--drift", type = float, nargs = "+", default = [0.0],
+                        help = "sample clock error of each sensor in ppm, the last value is repeated")
+    parser.add_argument("--loss", type = float, default = 0.0, help = "fraction of data packets not published")
+    parser.add_argument("--max-fs", type = int, default = MAX_FS,
+                        help = "highest sample frequency accepted (firmware: 2000)")
+    args = parser.parse_args()
+
+    sensors = []
+    for num in range(args.sensors):
+        drift = args.drift[min(num, len(args.drift) - 1)]
+        sensors.append(SimulatedSensor("sensor" + str(num + 1), args.broker, args.port,
+                                       driftPPM = drift, signal = args.signal, loss = args.loss,
+                                       maxFs = args.max_fs, seed = num))
+
+    for sensor in sensors:
+        sensor.start()
+
+    print("Simulating " + ", ".join(sensor.name for sensor in sensors) +
+          " on " + args.broker + ":" + str(args.port), flush = True)
+
+    try:
+        while (True):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    for sensor in sensors:
+        sensor.stop()
+        print(sensor.name + ": " + str(sensor.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+################################################################################
+#   Title: SequenceTracker.py
+#   Author: Zac Lynn
+#
+#   Description: This code finds where each packet of samples belongs using
+#           the 16-bit relative time counter the devices put on every sample.
+#           The devices publish with QoS 0, so packets can be lost or arrive
+#           out of order. Instead of appending packets in the order they
+#           arrive, every packet is placed at the sample number of its first
+#           counter value, lost samples are left as gaps, and late packets
+#           are written back into their gap.
+#
+#   Notes: Data
+################################################################################
+import threading                                                                                # Stats are read by the GUI thread while the decoder thread updates them
+
+COUNTER_SIZE = 65536                                                                            # Relative time is a uint16 on the devices
+REORDER_LIMIT = COUNTER_SIZE // 2                                                               # Counters further ahead than this are treated as behind
+
+
+class SequenceTracker:
+
+    def __init__(self):
+        self.expected = {}                                                                      # Sensor name -> sample number the next packet should start at
+        self.gaps = {}                                                                          # Sensor name -> [start, end) sample ranges not received yet
+        self.stats = {}                                                                         # Sensor name -> counts shown in the GUI
+        self.lock = threading.Lock()
+
+
+    def addSensor(self, sensor):
+        with self.lock:
+            self.expected[sensor] = 0                                                           # Devices reset the counter when the capture starts
+            self.gaps[sensor] = []
+            self.stats[sensor] = {"received": 0, "lost": 0, "gaps": 0,
+                                  "outOfOrder": 0, "duplicate": 0}
+
+
+    def place(self, sensor, counter):
+        # Returns the sample number of the first sample of a packet, or None if
+        # the packet is from before the capture started or every sample of it
+        # was received already. counter is the relative time column of the
+        # packet.
+        if (len(counter) == 0):
+            return None
+
+        return self.placeFirst(sensor, int(counter[0]), len(counter))
+
+
+    def placeFirst(self, sensor, counter, count):
+        # Same as place() for a packet of count samples whose first relative
+        # time is counter, used when the packet is not decoded yet
+        with self.lock:
+            if (sensor not in self.expected):
+                return None
+
+            expected = self.expected[sensor]
+            stats = self.stats[sensor]
+            ahead = (counter - expected) % COUNTER_SIZE                                         # How far past the expected counter this packet starts
+
+            if (ahead < REORDER_LIMIT):                                                         # In order, or after a gap
+                start = expected + ahead
+                if (ahead > 0):
+                    self.gaps[sensor].append([expected, start])
+                    stats["lost"] += ahead
+                    stats["gaps"] += 1
+
+                self.expected[sensor] = start + count
+                stats["received"] += count
+                return start
+
+            start = expected - (COUNTER_SIZE - ahead)                                           # Late packet, it belongs before the newest samples
+            if (start < 0):
+                stats["duplicate"] += count
+                return None
+
+            recovered = self.fill(sensor, start, start + count)
+            if (recovered == 0):                                                                # Sent twice, storing or plotting it again would count it twice
+                stats["duplicate"] += count
+                return None
+
+            stats["outOfOrder"] += 1
+            stats["lost"] -= recovered
+            stats["received"] += recovered
+            stats["duplicate"] += count - recovered
+
+            return start
+
+
+    def finish(self, sensor, end):
+        # Called when the capture ends, end is the number of samples the sensor
+        # should have sent. A lost last packet is only found here because no
+        # later packet shows the gap. Returns the number of samples missing at
+        # the end
+        with self.lock:
+            missing = end - self.expected[sensor]
+            if (missing <= 0):
+                return 0
+
+            self.gaps[sensor].append([self.expected[sensor], end])
+            self.stats[sensor]["lost"] += missing
+            self.stats[sensor]["gaps"] += 1
+            self.expected[sensor] = end
+            return missing
+
+
+    def fill(self, sensor, start, end):                                                         # Remove [start, end) from the gaps, returns the number of samples filled
+        recovered = 0
+        remaining = []
+
+        for gapStart, gapEnd in self.gaps[sensor]:
+            overlapStart = max(gapStart, start)
+            overlapEnd = min(gapEnd, end)
+
+            if (overlapStart >= overlapEnd):                                                    # Not part of this packet
+                remaining.append([gapStart, gapEnd])
+                continue
+
+            recovered += overlapEnd - overlapStart
+            if (gapStart < overlapStart):
+                remaining.append([gapStart, overlapStart])
+            if (overlapEnd < gapEnd):
+                remaining.append([overlapEnd, gapEnd])
+
+        self.gaps[sensor] = remaining
+        return recovered
+
+
+    def summary(self, sensor):                                                                  # Copy of the stats with the loss rate in percent
+        with self.lock:
+            stats = dict(self.stats[sensor])
+
+        total = stats["received"] + stats["lost"]
+        stats["lossRate"] = 100.0 * stats["lost"] / total if total > 0 else 0.0
+        return stats
@@ -0,0 +1,49 @@
+################################################################################
+#   Title: SharedBuffer.py
+#   Author: Zac Lynn
+#
+#   Description: This code creates the shared memory blocks that hold the plot
+#           data. Analysis functions are sent a small descriptor with the name
+#           of the block instead of the data, and attach to it as a NumPy view
+#           (see customFunctions/inputData.py), so the data is never copied or
+#           converted to text.
+#
+#   Notes: Data
+################################################################################
+from multiprocessing import shared_memory                                                       # Memory that can be mapped by other processes
+import json
+
+
+def create(nbytes):                                                                             # Create a new shared memory block
+    return shared_memory.SharedMemory(create=True, size=max(int(nbytes), 1))
+
+
+def attach(name):                                                                               # Map a block created by another process, e.g. a decoder process
+    return shared_memory.SharedMemory(name=name)                                                # Processes started by multiprocessing share the resource tracker
+
+
+def detach(shm):                                                                                # Close a block, it stays available to the other processes
+    try:
+        shm.close()
+    except BufferError:                                                                         # A plot may still reference the data, memory is freed when it is garbage collected
+        pass
+
+
+def release(shm):                                                                               # Close and remove a block created by this process
+    detach(shm)
+    try:
+        shm.unlink()                                                                            # Processes that already attached keep their mapping
+    except FileNotFoundError:
+        pass
+
+
+def describe(shm, dtype, length, fs, title):                                                    # Everything an analysis function needs to attach to the data
+    return {"name": shm.name,
+            "dtype": str(dtype),
+            "length": int(length),
+            "fs": fs,
+            "title": title}
+
+
+def encode(descriptor):                                                                         # Single line of text that can be sent through stdin
+    return (json.dumps(descriptor) + "\n").encode("utf8")
@@ -0,0 +1,107 @@
+################################################################################
+#   Title: SharedRing.py
+#   Author: Zac Lynn
+#
+#   Description: This code implements a ring buffer of variable length
+#           records in a shared memory block, used to pass sample packets
+#           between the core application and the decoder processes without a
+#           pipe. One process writes and one process reads. The first 16 bytes
+#           of the block hold the total number of bytes written and read so
+#           far, every record is a 4 byte length followed by the data, padded
+#           to 8 bytes so the counters and the sample arrays stay aligned.
+#
+#   Notes: Data. The writer updates its counter only after the record was
+#           copied, and the reader only after it copied the record out, so
+#           neither side ever sees a half written record.
+################################################################################
+import struct
+import numpy as np
+
+import SharedBuffer                                                                             # Creates and frees the shared memory blocks
+
+HEADER_BYTES = 16                                                                               # Write counter and read counter, both uint64
+LENGTH = struct.Struct("<I")                                                                    # Length of the record that follows
+WRAP = 0xFFFFFFFF                                                                               # Length of a record that does not fit before the end, continue at 0
+
+
+def padded(length):                                                                             # Bytes used by a record of length bytes
+    return (LENGTH.size + length + 7) & ~7
+
+
+class SharedRing:
+
+    def __init__(self, capacity=None, name=None):
+        # Creates a new ring that can hold capacity bytes of records, or
+        # attaches to the ring of another process by name
+        if (name is None):
+            self.shm = SharedBuffer.create(HEADER_BYTES + padded(int(capacity)))
+            self.owner = True                                                                   # Only the creating process removes the block
+        else:
+            self.shm = SharedBuffer.attach(name)
+            self.owner = False
+
+        self.name = self.shm.name
+        self.counters = np.ndarray((2,), dtype=np.uint64, buffer=self.shm.buf)                  # [bytes written, bytes read], each is stored in one write
+        self.data = self.shm.buf[HEADER_BYTES:]                                                 # Memoryview, copying a small record is cheaper than with NumPy
+        self.size = len(self.data) & ~7                                                         # Records always start on 8 bytes
+
+        if (self.owner):
+            self.counters[:] = 0
+
+
+    def write(self, *parts):
+        # Copy the parts (bytes-like objects or contiguous arrays) into one
+        # record. Returns False if the reader has not made enough room yet,
+        # nothing is written then
+        parts = [memoryview(part).cast("B") for part in parts]                                  # Byte views, len() of a 2D array would be its rows
+        length = sum(len(part) for part in parts)
+        need = padded(length)
+        written, read = int(self.counters[0]), int(self.counters[1])
+        position = written % self.size
+        skip = self.size - position if position + need > self.size else 0                       # Records never wrap, the end of the ring is skipped
+
+        if (need > self.size or written + skip + need - read > self.size):
+            return False
+
+        if (skip > 0):                                                                          # Both are multiples of 8, there is always room for the length
+            LENGTH.pack_into(self.data, position, WRAP)
+            written += skip
+            position = 0
+
+        LENGTH.pack_into(self.data, position, length)
+        offset = position + LENGTH.size
+        for part in parts:
+            self.data[offset:offset+len(part)] = part
+            offset += len(part)
+
+        self.counters[0] = written + need                                                       # Publish the record last
+        return True
+
+
+    def read(self):                                                                             # Copy of the oldest record as bytes, or None if the ring is empty
+        written, read = int(self.counters[0]), int(self.counters[1])
+        if (read == written):
+            return None
+
+        position = read % self.size
+        if (LENGTH.unpack_from(self.data, position)[0] == WRAP):                                # Writer skipped the end of the ring
+            read += self.size - position
+            position = 0
+
+        length = LENGTH.unpack_from(self.data, position)[0]
+        record = self.data[position+LENGTH.size:position+LENGTH.size+length].tobytes()
+        self.counters[1] = read + padded(length)                                                # Free the space only after the copy
+        return record
+
+
+    def __len__(self):                                                                          # Bytes of records waiting to be read
+        return int(self.counters[0]) - int(self.counters[1])
+
+
+    def close(self):
+        del self.counters                                                                       # Views must go before the block can be closed
+        self.data.release()
+        if (self.owner):
+            SharedBuffer.release(self.shm)
+        else:
+            self.shm.close()
@@ -2,6 +2,8 @@ from subprocess import PIPE, Popen
 import numpy as np
 import matplotlib.pyplot as plt
 
+import SharedBuffer
+
 frequency = None
 title = None
 data = None
@@ -21,27 +23,27 @@ def create_test_data():
 
     # Bias signal so that it it is centered at 1.65v
     data = data + 1.65 
-    data = data.tolist()
 
 
 def start_subProcess(script):
     p = Popen(['python', './customFunctions/' + script],                                     # Start a new process and connect pipes for stdin, stdout, and stderr      
                 stdin = PIPE, stdout = PIPE, stderr = PIPE)
     
-    TxData = (str(frequency) + "," +                                                       # Combine the sampling frequency, figure title, and figure data to send through pipe
-                str(title) + "," + 
-                str(data))
+    shm = SharedBuffer.create(data.nbytes)                                                 # Put the data in shared memory, only its name is sent through the pipe
+    np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+    TxData = SharedBuffer.describe(shm, data.dtype, len(data), frequency, title)
 
     try:                                                                                    # Send the data to new process, timeout will raise exception
-        p.communicate(TxData.encode('utf8'), timeout=1)                                     # Setting a timeout makes this non-blocking, freeing main thread to return
+        p.communicate(SharedBuffer.encode(TxData), timeout=1)                               # Setting a timeout makes this non-blocking, freeing main thread to return
     except:
         pass                                                                                # Do nothing with timeout exception so main thread can continue
 
     # Analysis threads are resposible for killing themselves, 
     # this happens naturally when code execution ends
+    return shm                                                                              # Keep the block until the test plot is closed
 
 create_test_data()
-start_subProcess("fft.py")
+shm = start_subProcess("fft.py")
 
 
 # Plot example data
@@ -52,4 +54,5 @@ plt.xlabel("Time (s)")
 plt.title(title)
 plt.ylim((-0.2, 3.7))
 
-plt.show()
\ No newline at end of file
+plt.show()
+SharedBuffer.release(shm)
\ No newline at end of file
@@ -0,0 +1,111 @@
+################################################################################
+#   Title: TestLostSamples.py
+#   Author: Zac Lynn
+#
+#   Description: Records two sensors with the same 40 Hz square wave, one of
+#           them 2.1 ms late, and drops one packet and the last packet of the
+#           late sensor. The recording goes through the same SequenceTracker,
+#           SampleStore, and Recorder as a data capture, is loaded again with
+#           DataLoader, and the envelope, FFT, and time offset must still be
+#           right. Every sensor must keep all of its rows.
+#
+#   Notes: Run from the CoreApplication folder: python TestLostSamples.py
+################################################################################
+import os
+import tempfile
+import numpy as np
+
+import AnalysisPool                                                                             # Loads the custom functions by file name
+import DataLoader
+import Recorder
+import SampleStore
+import SequenceTracker
+import TimeSynch
+
+FS = 2000
+SAMPLES = 250                                                                                   # Samples per packet
+TRIAL_TIME = 10
+DELAY = 0.0021                                                                                  # Seconds sensor2 is behind sensor1
+LOST_PACKETS = [20, TRIAL_TIME * FS // SAMPLES - 1]                                             # Packets of sensor2 that never arrive, the last one is only found at the end
+MAX_LAG = 0.01                                                                                  # Less than half the period of the square wave
+
+
+def squareWave(delay):                                                                          # ADC values of a 40 Hz square wave on every channel
+    t = np.arange(TRIAL_TIME * FS) / FS - delay
+    wave = np.where(np.sin(2 * np.pi * 40 * t) >= 0, 900, 100)
+    return np.repeat(wave[:, None], 3, axis=1).astype(np.uint16)
+
+
+def record(folder):                                                                             # Save the capture like MQTT.handleDecoded() does, returns the file name
+    store = SampleStore.SampleStore(TRIAL_TIME, FS, 3)
+    sequence = SequenceTracker.SequenceTracker()
+    waves = {"sensor1": squareWave(0.0), "sensor2": squareWave(DELAY)}
+
+    for sensor in waves:
+        store.addSensor(sensor)
+        sequence.addSensor(sensor)
+
+    for num in range(TRIAL_TIME * FS // SAMPLES):
+        for sensor, wave in waves.items():
+            if (sensor == "sensor2" and num in LOST_PACKETS):
+                continue
+
+            block = np.empty((SAMPLES, 4), dtype=np.uint16)
+            block[:, 0] = np.arange(num * SAMPLES, (num + 1) * SAMPLES) % 65536                 # Relative time counter
+            block[:, 1:] = wave[num * SAMPLES:(num + 1) * SAMPLES]
+            store.put(sensor, sequence.place(sensor, block[:, 0]), block)
+
+    for sensor in waves:                                                                        # End of the capture, like MQTT.checkForEND()
+        if (sequence.finish(sensor, store.expected) > 0):
+            store.markMissing(sensor, store.expected)
+
+    assert sequence.summary("sensor1")["lost"] == 0
+    assert sequence.summary("sensor2")["lost"] == len(LOST_PACKETS) * SAMPLES
+
+    filename = os.path.join(folder, "rec1")
+    recorder = Recorder.Recorder(filename, store)
+    recorder.close()
+    return filename
+
+
+def check(filename):
+    data = DataLoader.loadRecording(filename)
+    signal = data["sensor2"]["CH1"]
+    assert len(data["sensor1"]["CH1"]) == len(signal) == TRIAL_TIME * FS, "every row must be saved"
+    assert np.count_nonzero(np.isnan(signal)) == len(LOST_PACKETS) * SAMPLES, "lost samples must be NaN"
+
+    functions = {}
+    env = AnalysisPool.loadFunction(functions, "env.py")
+    fft = AnalysisPool.loadFunction(functions, "fft.py")
+
+    times, values = env.envelope(signal, FS)
+    assert np.all(np.isfinite(values)), "envelope is NaN"
+    expected = env.envelope(np.nan_to_num(data["sensor1"]["CH1"]), FS)[1]
+    assert np.allclose(values, expected, atol=0.05), "envelope is wrong"
+
+    stream = env.EnvelopeStream(FS)
+    chunks = [stream.update(chunk) for chunk in np.array_split(signal, 37)] + [stream.flush()]
+    streamed = np.concatenate([chunk[1] for chunk in chunks])
+    assert np.all(np.isfinite(streamed)), "streamed envelope is NaN"
+
+    freq, spectrum = fft.compute(signal, FS, {})
+    assert np.all(np.isfinite(spectrum)), "spectrum is NaN"
+    assert abs(freq[np.argmax(spectrum)] - 40) < 1, "spectrum peak is not at 40 Hz"
+
+    times, lag, peak = TimeSynch.recordingLag(data, FS, maxLag=MAX_LAG)["sensor2"]
+    lost = np.isnan(lag[0])
+    assert 0 < np.count_nonzero(lost) <= 5, "only the windows with the lost packets have no lag"
+    assert np.allclose(lag[:, ~lost], DELAY, atol=0.2 / FS), "time offset is wrong"
+    slope, offset = TimeSynch.drift(times, lag)
+    assert np.all(np.abs(slope) < 5e-6), "drift is not 0"
+
+    print(os.path.basename(filename) + ": offset %.3f ms, drift %.2f ppm, %d of %d windows lost" %
+          (np.nanmean(lag) * 1000, np.max(np.abs(slope)) * 1e6, np.count_nonzero(lost), len(lost)))
+
+
+with tempfile.TemporaryDirectory() as folder:
+    filename = record(folder)
+    check(filename + ".csv")
+    check(filename + ".wda")
+
+print("PASS")
@@ -0,0 +1,122 @@
+################################################################################
+#   Title: TimeSynch.py
+#   Author: Zac Lynn
+#
+#   Description: This code measures the time offset between sensors from the
+#           recorded signals. The lag is found with an FFT cross-correlation
+#           and refined to a fraction of a sample with a parabola through the
+#           correlation peak. The recording is split into sliding windows so
+#           the offset is measured over the whole trial, which shows clock
+#           drift as a slope. Every function works on arrays with any number
+#           of leading dimensions (channels, windows, ...) at once.
+#
+#   Notes: Data. A positive lag means the signal is behind the reference.
+#           Periodic test signals (square waves) can only be measured up to
+#           half of their period, set maxLag below that. Windows with lost
+#           samples (NaN) have a NaN lag and peak instead of a wrong lag, and
+#           drift() leaves them out of the fit.
+################################################################################
+import numpy as np
+
+WINDOW = 1.0                                                                                    # Seconds of data in each window
+HOP = 0.5                                                                                       # Seconds between the start of two windows
+
+
+def parabolicPeak(corr, index):
+    # Fraction of a sample to add to index so it points at the top of a
+    # parabola through corr[index-1], corr[index], corr[index+1]
+    index = np.clip(index, 1, corr.shape[-1] - 2)                                               # Peak on the edge can't be refined
+    left = np.take_along_axis(corr, (index - 1)[..., None], axis=-1)[..., 0]
+    center = np.take_along_axis(corr, index[..., None], axis=-1)[..., 0]
+    right = np.take_along_axis(corr, (index + 1)[..., None], axis=-1)[..., 0]
+
+    curve = left - 2 * center + right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = np.where(curve < 0, 0.5 * (left - right) / curve, 0.0)                          # Flat or upward curve has no peak to refine
+
+    return index + np.clip(delta, -0.5, 0.5)
+
+
+def crossCorrelationLag(reference, signal, maxLag=None):
+    # Returns (lag in samples, peak correlation between -1 and 1) over the last
+    # axis. reference and signal are broadcast against each other, so one
+    # reference can be compared with every channel at once. If either input
+    # has a lost sample (NaN) the lag and peak are NaN.
+    lost = np.isnan(reference).any(axis=-1) | np.isnan(signal).any(axis=-1)
+    reference = np.nan_to_num(reference)                                                        # Only for the FFT, the lag of these windows is not used
+    signal = np.nan_to_num(signal)
+    reference = reference - np.mean(reference, axis=-1, keepdims=True)
+    signal = signal - np.mean(signal, axis=-1, keepdims=True)
+
+    n = reference.shape[-1]
+    maxLag = n - 1 if maxLag is None else min(int(maxLag), n - 1)
+    nfft = 1 << int(np.ceil(np.log2(2 * n)))                                                    # Zero padding so the correlation is not circular
+
+    corr = np.fft.irfft(np.fft.rfft(signal, nfft) * np.conj(np.fft.rfft(reference, nfft)), nfft)
+    corr = np.concatenate((corr[..., nfft-maxLag:], corr[..., :maxLag+1]), axis=-1)             # Lags -maxLag ... maxLag
+
+    energy = np.sqrt(np.sum(reference ** 2, axis=-1) * np.sum(signal ** 2, axis=-1))
+    index = np.argmax(corr, axis=-1)
+    peak = np.take_along_axis(corr, index[..., None], axis=-1)[..., 0]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        peak = np.where(energy > 0, peak / energy, 0.0)
+
+    lag = parabolicPeak(corr, index) - maxLag
+    return np.where(lost, np.nan, lag), np.where(lost, np.nan, peak)
+
+
+def slidingLag(reference, signal, fs, window=WINDOW, hop=HOP, maxLag=None):
+    # Lag of signal behind reference in every window. maxLag is in seconds.
+    # Returns (time of the window centers, lag in seconds, peak correlation),
+    # lag and peak have the leading dimensions of the inputs plus one for the
+    # windows.
+    n = min(reference.shape[-1], signal.shape[-1])
+    size = int(window * fs)
+    step = max(int(hop * fs), 1)
+
+    if (n < size):                                                                              # Shorter than one window, use everything
+        size = n
+
+    frames = lambda data: np.lib.stride_tricks.sliding_window_view(data[..., :n], size, axis=-1)[..., ::step, :]
+    lagSamples = None if maxLag is None else maxLag * fs
+    lag, peak = crossCorrelationLag(frames(reference), frames(signal), lagSamples)
+
+    times = (np.arange(lag.shape[-1]) * step + size / 2) / fs
+    return times, lag / fs, peak
+
+
+def drift(times, lags):
+    # Straight line through the lags: (seconds of drift per second, offset at
+    # time 0). NaN lags are skipped, the result is NaN with fewer than 2 lags
+    times = np.asarray(times)
+    lags = np.asarray(lags)
+    rows = lags.reshape(-1, lags.shape[-1])
+    received = ~np.isnan(rows)
+
+    if (np.all(received)):
+        slope, offset = np.polyfit(times, rows.T, 1)                                            # polyfit fits every column of a 2D array
+    else:                                                                                       # Every row has its own windows left, fit them one at a time
+        fits = [np.polyfit(times[ok], row[ok], 1) if np.count_nonzero(ok) >= 2 else (np.nan, np.nan)
+                for row, ok in zip(rows, received)]
+        slope, offset = np.array(fits, dtype=np.float64).reshape(-1, 2).T
+
+    return slope.reshape(lags.shape[:-1]), offset.reshape(lags.shape[:-1])
+
+
+def recordingLag(data, fs, reference=None, channels=None, window=WINDOW, hop=HOP, maxLag=None):
+    # Lag of every sensor behind the reference sensor for a recording loaded
+    # with DataLoader.loadRecording(). Channels are compared with the same
+    # channel of the reference sensor.
+    # Returns {sensor: (times, lag (channels, windows), peak (channels, windows))}
+    sensors = list(data.keys())
+    reference = sensors[0] if reference is None else reference
+    channels = sorted([key for key in data[reference] if key != "Time"]) if channels is None else channels
+
+    stack = lambda sensor: np.stack([data[sensor][key] for key in channels])                    # (channels, samples)
+    lags = {}
+    for sensor in sensors:
+        if (sensor != reference):
+            lags[sensor] = slidingLag(stack(reference), stack(sensor), fs, window, hop, maxLag)
+
+    return lags
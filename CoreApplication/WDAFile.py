@@ -0,0 +1,182 @@
+################################################################################
+#   Title: WDAFile.py
+#   Author: Zac Lynn
+#
+#   Description: This code implements the binary recording format (.wda) that
+#           is saved next to the .csv output. The file is a small JSON header
+#           followed by the raw samples, so it can be opened with np.memmap
+#           without parsing any text.
+#
+#           Layout:
+#               4 bytes     b"WDA1"
+#               4 bytes     header length in bytes (little-endian uint32)
+#               N bytes     JSON header, padded with spaces to a multiple of 64
+#               rest        little-endian uint16 rows, same columns as the .csv:
+#                           Time, CH1, ..., Time, CH1, ... (one group per sensor)
+#
+#           The Time columns hold the relative time counter sent by the
+#           devices, the number of rows is found from the size of the file.
+#
+#   Notes: Data. Convert between formats from the command line:
+#           python WDAFile.py test.csv test.wda
+#           python WDAFile.py test.wda test.csv
+#           A .csv file with less than two rows needs the sample frequency:
+#           python WDAFile.py test.csv test.wda 2000
+################################################################################
+import csv                                                                                      # Used to read and write the .csv header rows
+import itertools                                                                                # Used to read the .csv file in blocks
+import json                                                                                     # Used for the file header
+import os
+import struct                                                                                   # Used to pack the magic number and header length
+import sys
+import numpy as np                                                                              # Used to write and memory map the samples
+
+MAGIC = b"WDA1"
+ALIGNMENT = 64                                                                                  # Samples start at a multiple of this many bytes
+DTYPE = np.dtype("<u2")
+CHUNK_ROWS = 100000                                                                             # Rows converted at a time
+
+
+def makeHeader(sensors, inputChannels, fs, startTime=None, trialTime=None):
+    return {"version": 1,
+            "sensors": list(sensors),
+            "channels": int(inputChannels),
+            "fs": fs,
+            "startTime": startTime,                                                             # RTC time the devices started sampling at
+            "trialTime": trialTime,
+            "dtype": DTYPE.str,
+            "missing": 0xFFFF,                                                                  # Channel value of samples that were never received
+            "voltsPerCount": 3.3 / 1023.0}
+
+
+def writeHeader(file, header):
+    text = json.dumps(header).encode("utf-8")
+    length = len(text) + (-(len(MAGIC) + 4 + len(text)) % ALIGNMENT)                            # Pad so the samples start on an aligned offset
+    file.write(MAGIC + struct.pack("<I", length) + text.ljust(length, b" "))
+
+
+def readHeader(filename):                                                                       # Returns the header and the byte offset of the first sample
+    with open(filename, "rb") as file:
+        if (file.read(len(MAGIC)) != MAGIC):
+            raise ValueError(filename + " is not a .wda file")
+
+        length = struct.unpack("<I", file.read(4))[0]
+        header = json.loads(file.read(length).decode("utf-8"))
+
+    return header, len(MAGIC) + 4 + length
+
+
+def rowColumns(header):                                                                         # Number of uint16 values in a row
+    return len(header["sensors"]) * (1 + header["channels"])
+
+
+def load(filename, mode="r"):
+    # Returns the header and a (rows, columns) memory mapped array. Nothing is
+    # read until the array is used, so any part of a long recording can be
+    # accessed without loading the rest.
+    header, offset = readHeader(filename)
+    columns = rowColumns(header)
+    rows = (os.path.getsize(filename) - offset) // (columns * DTYPE.itemsize)                   # A partly written last row is ignored
+
+    if (rows == 0):                                                                             # np.memmap can not map zero bytes
+        return header, np.zeros((0, columns), dtype=DTYPE)
+
+    return header, np.memmap(filename, dtype=DTYPE, mode=mode, offset=offset,
+                             shape=(rows, columns))
+
+
+def column(header, sensor, ch):                                                                 # Column of a sensor channel, ch 0 is the Time column
+    return header["sensors"].index(sensor) * (1 + header["channels"]) + ch
+
+
+class Writer:                                                                                   # Used by Recorder to save the .wda file during a data capture
+
+    def __init__(self, filename, header):
+        self.filename = filename + ".wda"
+        self.file = open(self.filename, mode="wb")
+        self.header = header
+        self.headerWritten = False
+
+
+    def write(self, store, start, end):                                                         # Write samples start to end-1 of every sensor in the SampleStore
+        if (not self.headerWritten):
+            self.header["sensors"] = store.sensors()
+            writeHeader(self.file, self.header)
+            self.headerWritten = True
+
+        if (end <= start):
+            return
+
+        blocks = [store.view(sensor)[start:end] for sensor in store.sensors()]                  # Already in the same column order as the file
+        self.file.write(np.hstack(blocks).astype(DTYPE, copy=False).tobytes())
+
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def csvToWDA(csvFilename, wdaFilename, fs=None):
+    # fs is found from the Time column if it is not given, which needs at
+    # least two rows of samples
+    with open(csvFilename, "r", newline="") as file:
+        reader = csv.reader(file)
+        sensors = [name for name in next(reader) if name != ""]                                 # First header row has the sensor names
+        names = next(reader)                                                                    # Second header row has Time, CH1, ...
+        inputChannels = len(names) // len(sensors) - 1
+
+        lines = list(itertools.islice(file, CHUNK_ROWS))
+        if (fs is None):
+            if (len(lines) < 2):                                                                # wdaToCSV() needs fs to write the Time column again
+                raise ValueError(csvFilename + " has less than two rows of samples, the sample frequency "
+                                 "can't be found from it, pass fs")
+            fs = round(1.0 / (float(lines[1].split(",")[0]) - float(lines[0].split(",")[0])))   # Sample frequency is found from the first two time values
+
+        header = makeHeader(sensors, inputChannels, int(fs))
+        timeColumns = [num * (1 + inputChannels) for num in range(len(sensors))]
+        row = 0
+
+        with open(wdaFilename, "wb") as out:
+            writeHeader(out, header)
+
+            while (len(lines) > 0):
+                block = np.loadtxt(lines, delimiter=",", ndmin=2)
+                block = np.rint(np.nan_to_num(block, nan=0xFFFF)).astype(DTYPE)                 # Channels are whole ADC values, nan is a lost sample
+                block[:, timeColumns] = (np.arange(row, row + len(block)) % 65536)[:, None]     # Time in seconds can't be stored, use the sample number like the devices do
+                out.write(block.tobytes())
+                row += len(block)
+
+                lines = list(itertools.islice(file, CHUNK_ROWS))
+
+
+def wdaToCSV(wdaFilename, csvFilename):
+    header, data = load(wdaFilename)
+    inputChannels = header["channels"]
+    columns = 1 + inputChannels
+
+    with open(csvFilename, "w", newline="") as file:
+        writer = csv.writer(file)
+        sensorRow = []
+        namesRow = []
+        for sensor in header["sensors"]:                                                        # Same two header rows the core application writes
+            sensorRow += [sensor] + [""] * inputChannels
+            namesRow += ["Time"] + ["CH" + str(ch+1) for ch in range(inputChannels)]
+
+        writer.writerow(sensorRow)
+        writer.writerow(namesRow)
+
+        for start in range(0, len(data), CHUNK_ROWS):
+            block = np.array(data[start:start+CHUNK_ROWS], dtype=np.float64)
+            block[block == header.get("missing", -1)] = np.nan                                  # Lost samples are saved as nan
+            block[:, 0::columns] = (np.arange(start, start + len(block)) / header["fs"])[:, None] # Same time values the core application writes
+            np.savetxt(file, block, fmt="%.10g", delimiter=",", newline="\r\n")
+
+
+if __name__ == "__main__":
+    source, destination = sys.argv[1], sys.argv[2]
+
+    if (source.endswith(".csv")):
+        csvToWDA(source, destination, int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    else:
+        wdaToCSV(source, destination)
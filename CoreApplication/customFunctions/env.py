@@ -1,61 +1,172 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
-# ---------------- Getting input from core application ---------------- 
-# Read data from core application throigh stdin pipe
-data = input()
 
-# Turn string into list
-data = data.split(',')
+NAME = "env"
+HINT = "Calculate moving average envelope"
+MODE = "inprocess"                                                                              # Cheap NumPy transform, run on the GUI thread
+ORDER = 1
 
-# Extract the sample frequency and parent figure title
-frequency = float(data[0])
-title = data[1]
+WINDOW = 0.250                                                                                  # Window length in seconds
+KINDS = ("mav", "rms")
 
-# Remove frequency and title from list
-data = data[2:]
 
-# Remove brackets if any and convert string to float
-data = [float(d.strip("[]")) for d in data]
+# ------------------------- ENVELOPE ENGINE --------------------------
+# Sliding windows are summed with a cumulative sum, so every window costs
+# the same no matter how long it is. hop is the time between window starts,
+# hop == window gives non-overlapping windows and hop < window overlaps them.
+# Lost samples (NaN) are left out of the windows they fall in, a window with
+# no samples at all is NaN.
+def rectify(data, center, kind):                                                                # Value that is averaged over each window
+    data = np.subtract(data, center)
 
+    if (kind == "rms"):
+        return np.square(data)
 
+    return np.absolute(data)
 
-# -------------------- CUSTOM FUNCTION STARTS HERE --------------------
-# Use frequency to make time series 
-# Use parent figure title to name the new figure displaying the envelope
-# Use data to calculate moving average envelope
 
-# Zero mean the data
-data = np.subtract(data, np.mean(data))
+def windowSums(values, N, starts):                                                              # Sum and number of the samples in values[s:s+N] for every s in starts
+    received = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(received, values, 0.0))))                  # One NaN would carry on through every later sum
+    counts = np.concatenate(([0], np.cumsum(received)))
+    ends = np.minimum(starts + N, len(values))                                                  # Last window may be cut short by the end of the data
+
+    return sums[ends] - sums[starts], counts[ends] - counts[starts]
+
+
+def finish(sums, counts, kind):                                                                 # Turn window sums into MAV or RMS values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = sums / counts                                                                  # 0 / 0 is NaN for a window that was lost
+
+    if (kind == "rms"):
+        return np.sqrt(values)
+
+    return values
+
+
+def envelope(data, fs, window=WINDOW, hop=None, kind="mav", center=None, partial=True):
+    # Returns (time, values) of the MAV or RMS envelope of data. time is the
+    # start of each window. center is subtracted before rectifying, it
+    # defaults to the mean of the received samples. partial keeps the last window even if it
+    # is shorter than window.
+    if (kind not in KINDS):
+        raise ValueError("kind must be one of " + ", ".join(KINDS))
+
+    N = max(int(window * fs), 1)                                                                # Window and hop in samples
+    step = N if hop is None else max(int(hop * fs), 1)
+    center = np.nanmean(data) if center is None else center
+
+    last = len(data) if partial else len(data) - N + 1                                          # Windows start before this sample
+    starts = np.arange(0, max(last, 0), step)
+
+    sums, counts = windowSums(rectify(data, center, kind), N, starts)
+
+    return starts / fs, finish(sums, counts, kind)
+
+
+class EnvelopeStream:
+    # Computes the same envelope as envelope() from data that arrives in
+    # chunks, for example from the MQTT decoder thread while a capture is
+    # running. update() only works on the new chunk and the samples of the
+    # windows that are still open, so each call is O(len(chunk)).
+    #
+    # If center is None the mean of every sample seen so far is used, so the
+    # first few points can differ from envelope() of the whole recording.
+    #
+    # If first (the sample number of chunk[0]) is given, lost samples before
+    # the chunk are filled with NaN so the windows stay at the right time, and
+    # a chunk that starts before the end of the last one is dropped.
+    #
+    # To follow a channel while it is being captured:
+    #   stream = EnvelopeStream(fs)
+    #   mqtt.addSampleListener(lambda sensor, samples, first:
+    #                          stream.update(samples[:, 1] * 3.3 / 1023, first))
+
+    def __init__(self, fs, window=WINDOW, hop=None, kind="mav", center=None):
+        if (kind not in KINDS):
+            raise ValueError("kind must be one of " + ", ".join(KINDS))
 
-# Rectify the data
-data = np.absolute(data)
+        self.fs = fs
+        self.kind = kind
+        self.center = center
+        self.N = max(int(window * fs), 1)
+        self.step = self.N if hop is None else max(int(hop * fs), 1)
 
-env = []
-timeSeries = []
+        self.pending = np.zeros(0)                                                              # Rectified samples of windows that have not ended yet
+        self.start = 0                                                                          # Sample number of pending[0]
+        self.skip = 0                                                                           # Samples to drop before the next window, only when hop > window
+        self.total = 0.0                                                                        # Sum and count of all samples, for the running mean
+        self.count = 0
+        self.end = 0                                                                            # Sample number after the last sample added
 
-# Create a 250ms window
-N = int(0.250 * frequency)
 
-for i in range(0, len(data), N):
-    if (i+N > len(data)):
-        break
-    else:
-        env.append(np.mean(data[i:i+N]))
+    def update(self, chunk, first=None):                                                        # Add samples, returns (time, values) of the windows they complete
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if (first is not None and first < self.end):                                            # Late packet, its windows were already emitted
+            return np.zeros(0), np.zeros(0)
+
+        if (first is not None and first > self.end):                                            # Lost samples are left out of their windows
+            chunk = np.concatenate((np.full(first - self.end, np.nan), chunk))
+
+        self.end += len(chunk)
+        self.total += np.nansum(chunk)
+        self.count += np.count_nonzero(~np.isnan(chunk))
+        center = self.total / max(self.count, 1) if self.center is None else self.center
+
+        values = rectify(chunk[self.skip:], center, self.kind)
+        self.skip -= min(self.skip, len(chunk))
+
+        self.pending = np.concatenate((self.pending, values))
+        return self.emit(len(self.pending) - self.N + 1)
+
+
+    def flush(self):                                                                            # Emit the last window even if it is short
+        return self.emit(len(self.pending))
+
+
+    def emit(self, last):                                                                       # Emit every window that starts before pending[last]
+        starts = np.arange(0, max(last, 0), self.step)
+        sums, counts = windowSums(self.pending, self.N, starts)
+
+        used = len(starts) * self.step                                                          # Samples before the next window start are no longer needed
+        time = (self.start + starts) / self.fs
+        self.skip += max(used - len(self.pending), 0)
+        self.pending = self.pending[used:]
+        self.start += used
+
+        return time, finish(sums, counts, self.kind)
+
+
+# -------------------- CUSTOM FUNCTION STARTS HERE --------------------
+# Use fs to make time series
+# Use data to calculate moving average envelope
+def compute(data, fs, meta):
+    return envelope(data, fs)
+
+
+# Use parent figure title to name the new figure displaying the envelope
+def render(result, fig, meta):
+    timeSeries, env = result
 
-    # calculate time
-    timeSeries.append((1/frequency) * i)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(timeSeries, env)
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("MAV")
+    ax.set_title("Envelope: " + meta["title"])
+    ax.set_ylim([-0.1, 1.75])
 
 
+# ---------------- Getting input from core application ----------------
+# Only used when the script is run on its own with the data sent through stdin
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    import inputData                                                                            # Gets the plot data from the core application
 
-# Create a new plot to display the results
-plt.figure()
-plt.plot(timeSeries, env)
-plt.xlabel("Time (s)")
-plt.ylabel("MAV")
-plt.title("Envelope: " + title)
-plt.ylim([-0.1, 1.75])
+    # Read data from core application through stdin pipe
+    data, frequency, title = inputData.readInput()
+    meta = {"title": title}
 
+    render(compute(data, frequency, meta), plt.figure(), meta)
 
-# Block and display the figure until closed
-plt.show()
\ No newline at end of file
+    # Block and display the figure until closed
+    plt.show()
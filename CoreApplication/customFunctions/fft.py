@@ -1,54 +1,60 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
-# ---------------- Getting input from core application ---------------- 
-# Read data from core application throigh stdin pipe
-data = input()
 
-# Turn string into list
-data = data.split(',')
+NAME = "fft"
+HINT = "Calculate FFT"
+MODE = "inprocess"                                                                              # A single FFT is fast enough to run on the GUI thread
+ORDER = 0
 
-# Extract the sample frequency and parent figure title
-frequency = float(data[0])
-title = data[1]
 
-# Remove frequency and title from list
-data = data[2:]
+# -------------------- CUSTOM FUNCTION STARTS HERE --------------------
+# Use fs to get fft frequency axis
+# Use data to calculate fft
+def compute(data, fs, meta):
+    nfft = len(data)
 
-# Remove brackets if any and convert string to float
-data = [float(d.strip("[]")) for d in data]
+    # Zero mean the data, lost samples (NaN) are set to the mean so they
+    # don't add to the spectrum
+    data = np.nan_to_num(data - np.nanmean(data))
 
+    # Data is real, so rfft only calculates the positive frequencies
+    fft = np.fft.rfft(data, nfft)
 
+    # Magnitude of fft 
+    fft = np.abs(fft)
 
-# -------------------- CUSTOM FUNCTION STARTS HERE --------------------
-# Use frequency to get fft frequency axis
-# Use parent figure title to name the new figure displaying fft
-# Use data to calculate fft
+    # Frequency in cycles/d, so d = sample period
+    freq = np.fft.rfftfreq(nfft, d=(1.0/int(fs)))
+
+    # Zoom in on 0 to caprture frequency / 4 
+    fft = fft[0:nfft//4]
+    freq = freq[0:nfft//4]
 
-nfft = len(data)
+    return freq, fft
 
-# Zero mean the data
-data = data - np.mean(data)
 
-fft = np.fft.fft(data, nfft)
+# Use parent figure title to name the new figure displaying fft
+def render(result, fig, meta):
+    freq, fft = result
 
-# Magnitude of fft 
-fft = np.abs(fft)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(freq, fft)
+    ax.set_xlabel("Frequency (Hz)")
+    ax.set_ylabel("Relative Magnitude")
+    ax.set_title("FFT: " + meta["title"])
 
-# Frequency in cycles/d, so d = sample period
-freq = np.fft.fftfreq(nfft, d=(1.0/int(frequency)))
 
-# Arrays are from min->max->mirror so remove mirror and zoom in on 0 to caprture frequency / 4 
-fft = fft[0:nfft//4]
-freq = freq[0:nfft//4]
+# ---------------- Getting input from core application ---------------- 
+# Only used when the script is run on its own with the data sent through stdin
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    import inputData                                                                            # Gets the plot data from the core application
 
+    # Read data from core application through stdin pipe
+    data, frequency, title = inputData.readInput()
+    meta = {"title": title}
 
-# Create a new plot to display the results
-plt.figure()
-plt.plot(freq, fft)
-plt.xlabel("Frequency (Hz)")
-plt.ylabel("Relative Magnitude")
-plt.title("FFT: " + title)
+    render(compute(data, frequency, meta), plt.figure(), meta)
 
-# Block and display the figure until closed
-plt.show()
\ No newline at end of file
+    # Block and display the figure until closed
+    plt.show()
@@ -1,36 +1,44 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
-# ---------------- Getting input from core application ---------------- 
-# Read data from core application throigh stdin pipe
-data = input()
 
-# Turn string into list
-data = data.split(',')
+NAME = "func2"
+HINT = "Custom function 2"
+MODE = "process"                                                                                # "inprocess", "thread", or "process", see Plugins.py
+ORDER = 12
 
-# Extract the sample frequency and parent figure title
-frequency = float(data[0])
-title = data[1]
 
-# Remove frequency and title from list
-data = data[2:]
+# -------------------- CUSTOM FUNCTION STARTS HERE --------------------
+# Called by the core application with the plot data as a read-only NumPy
+# array, the sample frequency, and a dict with the parent figure title,
+# sensor, and channel. Return anything render() needs
+def compute(data, fs, meta):
 
-# Remove brackets if any and convert string to float
-data = [float(d.strip("[]")) for d in data]
 
 
 
-# -------------------- CUSTOM FUNCTION STARTS HERE --------------------
+    return data
 
 
+# Draw the result of compute() into the new figure
+def render(result, fig, meta):
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(result)
+    ax.set_xlabel("X-axis")
+    ax.set_ylabel("Y-axis")
+    ax.set_title("Custom Function 2: " + meta["title"])
+
+
+# ---------------- Getting input from core application ---------------- 
+# Only used when the script is run on its own with the data sent through stdin
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    import inputData                                                                            # Gets the plot data from the core application
 
+    # Read data from core application through stdin pipe
+    data, frequency, title = inputData.readInput()
+    meta = {"title": title}
 
-# Create a new plot to display the results
-plt.figure()
-plt.plot(data)
-plt.xlabel("X-axis")
-plt.ylabel("Y-axis")
-plt.title("Custom Function 2: " + title)
+    render(compute(data, frequency, meta), plt.figure(), meta)
 
-# Block and display the figure until closed
-plt.show()
\ No newline at end of file
+    # Block and display the figure until closed
+    plt.show()
@@ -0,0 +1,73 @@
+################################################################################
+#   Title: inputData.py
+#   Author: Zac Lynn
+#
+#   Description: Helper used by the custom functions to get the plot data from
+#           the core application. The core application sends a descriptor of a
+#           shared memory block; attach() maps that block as a NumPy array
+#           without copying it.
+################################################################################
+from multiprocessing import shared_memory, resource_tracker
+import json
+import numpy as np
+
+
+def attach(descriptor, untrack=True):
+    # Returns (shm, data) where data is a read-only view of the plot data.
+    # Keep shm referenced for as long as data is used, then call detach(shm).
+    # untrack should be False in processes started by multiprocessing, they
+    # share the resource tracker of the core application
+    if (not untrack):
+        return view(shared_memory.SharedMemory(name=descriptor["name"]), descriptor)
+
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor["name"], track=False)                  # Python 3.13+, the core application owns the block
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=descriptor["name"])
+        try:                                                                                    # Older versions would remove the block when this process exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+
+    return view(shm, descriptor)
+
+
+def view(shm, descriptor):                                                                      # Read-only NumPy view of an attached block
+    data = np.ndarray((descriptor["length"],), dtype=np.dtype(descriptor["dtype"]),
+                      buffer=shm.buf)
+    data.flags.writeable = False                                                                # The core application may still be adding data after this point
+
+    return shm, data
+
+
+def detach(shm):                                                                                # Returns True once the block was closed
+    try:
+        shm.close()
+        return True
+    except BufferError:                                                                         # Something still references the data
+        return False
+
+
+def readInput():
+    # Read the data sent through stdin by the core application, returns
+    # (data, frequency, title). Accepts the shared memory descriptor or the
+    # older "frequency,title,[data]" text.
+    line = input()
+
+    if (line.startswith("{")):
+        descriptor = json.loads(line)
+        shm, data = attach(descriptor)
+        readInput.shm = shm                                                                     # Keep the block open until the script exits
+        return data, float(descriptor["fs"]), descriptor["title"]
+
+    # Turn string into list
+    line = line.split(',')
+
+    # Extract the sample frequency and parent figure title
+    frequency = float(line[0])
+    title = line[1]
+
+    # Remove brackets if any and convert string to float
+    data = np.array([float(d.strip("[]")) for d in line[2:]])
+
+    return data, frequency, title